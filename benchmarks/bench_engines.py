@@ -0,0 +1,225 @@
+"""End-to-end throughput of the scraper engines against the local mock server
+
+Starts benchmarks/mock_server.py, then runs every engine in its own process and
+working directory and reports URLs/s, p50/p99 latency per URL, peak RSS and
+bytes written:
+    python3 benchmarks/bench_engines.py --count 500 --latency-ms 80 --error-rate 0.02
+Mock server options are passed through. full_run needs Chrome and is only run
+when listed in --engines.
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(BENCHMARKS, '..', 'src')
+
+ENGINES = ['async_metadata', 'threaded_metadata', 'parallel_metadata',
+           'async_comments', 'threaded_comments', 'parallel_comments']
+MOCK_OPTIONS = ('latency_ms', 'latency_sigma', 'error_rate', 'burst_every', 'burst_length',
+                'payload_kb', 'comments', 'videos_per_scroll', 'seed')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_server(base_url:str, timeout:float=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'{base_url}/__stats', timeout=1)
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'mock server did not start on {base_url}')
+
+def video_urls(base_url:str, count:int) -> list:
+    """URLs of count distinct mock videos"""
+    return [f'{base_url}/@mock{i % 97}/video/{7 * 10 ** 18 + i}' for i in range(count)]
+
+def written_bytes() -> int:
+    """Bytes written by this process and its reaped children, 0 where /proc is not available"""
+    try:
+        with open('/proc/self/io') as file:
+            return int(dict(line.split(': ') for line in file.read().splitlines())['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0
+
+def directory_size(path:str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def timed(cls):
+    """Subclass of an engine that appends the duration of every fetch attempt to latencies-<pid>.txt"""
+    import asyncio
+
+    def record(start_time:float):
+        with open(f'latencies-{os.getpid()}.txt', 'a') as file:
+            file.write(f'{time.monotonic() - start_time}\n')
+
+    if asyncio.iscoroutinefunction(cls._fetch_data):
+        async def _fetch_data(self, session, url, *args, **kwargs):
+            start_time = time.monotonic()
+            try:
+                return await cls._fetch_data(self, session, url, *args, **kwargs)
+            finally:
+                record(start_time)
+    else:
+        def _fetch_data(self, url, *args, **kwargs):
+            start_time = time.monotonic()
+            try:
+                return cls._fetch_data(self, url, *args, **kwargs)
+            finally:
+                record(start_time)
+    subclass = type(f'Timed{cls.__name__}', (cls,), {'_fetch_data': _fetch_data})
+    # process pools pickle the bound methods by reference to this module
+    globals()[subclass.__name__] = subclass
+    return subclass
+
+def run_engine(engine:str, urls:list, options) -> dict:
+    """Runs one engine in the current process, which works in its own directory"""
+    sys.path.insert(0, SRC)
+    from config import ScraperConfig
+    ScraperConfig.RATE_LIMITING = options.rate_limit
+    ScraperConfig.RESPONSE_CACHE = False
+    ScraperConfig.STORAGE_BACKEND = options.storage
+    ScraperConfig.COMMENT_COUNT = options.comment_target
+    from storage import COMMENTS_PATH, FULL_DATA_PATH, METADATA_PATH, get_storage
+
+    storage = get_storage()
+    storage.initialize()
+    # drawn once before the clock starts, as the scraper does
+    import user_agents
+    user_agents.pool()
+    start_time = time.monotonic()
+    if engine == 'full_run':
+        from scraper import Scraper
+        ScraperConfig.URL_SCRAP_COUNT = len(urls)
+        scraper = Scraper()
+        try:
+            scraper.full_run()
+        finally:
+            scraper.close()
+        processed = storage.count(FULL_DATA_PATH)
+    else:
+        kind, data = engine.split('_')
+        if kind == 'async':
+            from async_video_processor import AsyncProcessComments, AsyncProcessMetaData
+            classes = {'metadata': AsyncProcessMetaData, 'comments': AsyncProcessComments}
+        elif kind == 'threaded':
+            from threaded_video_processor import ThreadedProcessComments, ThreadedProcessMetaData
+            classes = {'metadata': ThreadedProcessMetaData, 'comments': ThreadedProcessComments}
+        else:
+            from parallel_video_processor import ProcessComments, ProcessMetaData
+            classes = {'metadata': ProcessMetaData, 'comments': ProcessComments}
+        processor = timed(classes[data])(urls)
+        if data == 'metadata':
+            processor.get_metadata()
+        else:
+            processor.get_comments()
+        processed = storage.count(METADATA_PATH if data == 'metadata' else COMMENTS_PATH)
+    seconds = time.monotonic() - start_time
+    storage.close()
+
+    latencies = []
+    for name in os.listdir('.'):
+        if name.startswith('latencies-'):
+            with open(name) as file:
+                latencies += [float(line) for line in file if line.strip()]
+    latencies.sort()
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {'engine': engine,
+            'processed': processed,
+            'seconds': round(seconds, 2),
+            'urls_per_second': round(processed / seconds, 1) if seconds else 0,
+            'p50_ms': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+            'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1) if latencies else None,
+            'peak_rss_mb': round(max(own, children) / 1024, 1),
+            'written_mb': round(written_bytes() / 2 ** 20, 2),
+            'data_mb': round(directory_size('data') / 2 ** 20, 2)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the scraper engines against the mock server')
+    parser.add_argument('--engines', default=','.join(ENGINES),
+                        help=f'comma separated, any of {", ".join(ENGINES + ["full_run"])}')
+    parser.add_argument('--count', type=int, default=300, help='URLs per engine')
+    parser.add_argument('--comment-target', type=int, default=100, help='ScraperConfig.COMMENT_COUNT')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--rate-limit', action='store_true', help='keep the shared rate limiter on')
+    parser.add_argument('--json', action='store_true', help='print one JSON line per engine')
+    parser.add_argument('--run-engine', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--burst-every', type=float, default=0)
+    parser.add_argument('--burst-length', type=float, default=2)
+    parser.add_argument('--payload-kb', type=int, default=200)
+    parser.add_argument('--comments', type=int, default=120)
+    parser.add_argument('--videos-per-scroll', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.run_engine:
+        # child process: the base URL is already in the environment
+        print(json.dumps(run_engine(options.run_engine, video_urls(options.base_url, options.count), options)))
+        return
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    mock_arguments = [f'--port={port}']
+    for option in MOCK_OPTIONS:
+        mock_arguments.append(f'--{option.replace("_", "-")}={getattr(options, option)}')
+    server = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, 'mock_server.py'), *mock_arguments])
+    results = []
+    try:
+        wait_for_server(base_url)
+        for engine in options.engines.split(','):
+            work_directory = tempfile.mkdtemp(prefix=f'bench-{engine}-')
+            arguments = [sys.executable, os.path.abspath(__file__), f'--run-engine={engine}', f'--base-url={base_url}',
+                         f'--count={options.count}', f'--comment-target={options.comment_target}',
+                         f'--storage={options.storage}'] + (['--rate-limit'] if options.rate_limit else [])
+            try:
+                output = subprocess.run(arguments, cwd=work_directory, capture_output=True, text=True,
+                                        env=os.environ | {'TIKTOK_BASE_URL': base_url})
+                lines = [line for line in output.stdout.splitlines() if line.startswith('{')]
+                if output.returncode or not lines:
+                    print(f'{engine} failed:\n{output.stderr[-2000:]}', file=sys.stderr)
+                    continue
+                results.append(json.loads(lines[-1]))
+            finally:
+                shutil.rmtree(work_directory, ignore_errors=True)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if options.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print(f'{"engine":<18} {"done":>6} {"URLs/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"RSS MB":>8} {"written MB":>11} {"data MB":>8}')
+    for result in results:
+        print(f'{result["engine"]:<18} {result["processed"]:>6} {result["urls_per_second"]:>8} '
+              f'{result["p50_ms"]!s:>8} {result["p99_ms"]!s:>8} {result["peak_rss_mb"]:>8} '
+              f'{result["written_mb"]:>11} {result["data_mb"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Microbenchmark of the rehydration JSON extractor against the BeautifulSoup and lxml paths
+
+Save TikTok video pages as benchmarks/fixtures/*.html and run:
+    python3 benchmarks/bench_extractor.py
+Without fixtures a synthetic page of similar size is generated.
+"""
+
+import glob
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from extractor import extract_video_info, parse_video_info
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def synthetic_page() -> bytes:
+    """Builds a video page with a rehydration script of a few hundred KB"""
+    item_struct = {
+        'id': '7375775673576705312',
+        'desc': 'grow up #fashiontiktok #streetwear',
+        'createTime': '1717250000',
+        'author': {'uniqueId': 'dynasty.l', 'nickname': 'dynasty', 'signature': 'x' * 200},
+        'stats': {'playCount': 4000000, 'diggCount': 730600, 'collectCount': 93363,
+                  'commentCount': 14100, 'shareCount': 24100},
+        'music': {'title': 'original sound', 'playUrl': 'https://example.com/' + 'm' * 300},
+        'video': {'bitrateInfo': [{'PlayAddr': {'UrlList': ['https://example.com/' + 'v' * 300] * 3}}] * 8},
+    }
+    scope = {
+        'webapp.app-context': {'language': 'en', 'region': 'US', 'abTestVersion': {'parameters': ['p' * 40] * 2000}},
+        'seo.abtest': {'canonical': 'https://www.tiktok.com/', 'pageId': 'x' * 100},
+        'webapp.video-detail': {'itemInfo': {'itemStruct': item_struct}, 'statusCode': 0},
+        'webapp.biz-context': {'features': {f'feature_{i}': True for i in range(5000)}},
+    }
+    script = json.dumps({'__DEFAULT_SCOPE__': scope})
+    body = '<div class="css-x6y88p-DivItemContainerV2">' + '<span>filler</span>' * 5000 + '</div>'
+    page = (f'<!DOCTYPE html><html><head><title>TikTok</title></head><body>{body}'
+            f'<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">{script}</script>'
+            f'</body></html>')
+    return page.encode('utf-8')
+
+def load_fixtures() -> list:
+    """Loads the saved pages, or a synthetic page if there are none"""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, '*.html'))):
+        with open(path, 'rb') as file:
+            pages.append((os.path.basename(path), file.read()))
+    return pages or [('synthetic', synthetic_page())]
+
+def beautifulsoup_path(page:bytes) -> dict:
+    """The previous ProcessMetaData extraction"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(page.decode('utf-8'), 'html.parser')
+    json_content = soup.find(id="__UNIVERSAL_DATA_FOR_REHYDRATION__").string
+    video_data = json.loads(json_content)["__DEFAULT_SCOPE__"]["webapp.video-detail"]["itemInfo"]["itemStruct"]
+    return parse_video_info(video_data)
+
+def lxml_path(page:bytes) -> dict:
+    """The previous AsyncProcessMetaData extraction"""
+    from lxml import html
+    tree = html.fromstring(page.decode('utf-8'))
+    json_content = tree.xpath('//script[@id="__UNIVERSAL_DATA_FOR_REHYDRATION__"]/text()')
+    video_data = json.loads(json_content[0])["__DEFAULT_SCOPE__"]["webapp.video-detail"]["itemInfo"]["itemStruct"]
+    return parse_video_info(video_data)
+
+def main(number:int=50):
+    candidates = {'extractor': extract_video_info, 'beautifulsoup': beautifulsoup_path, 'lxml': lxml_path}
+    for name, page in load_fixtures():
+        print(f'{name}: {len(page) / 1024:.0f} KB')
+        expected = extract_video_info(page)
+        for label, function in candidates.items():
+            try:
+                assert function(page) == expected
+            except ImportError as e:
+                print(f'  {label:<14} skipped ({e.name} not installed)')
+                continue
+            seconds = timeit.timeit(lambda: function(page), number=number) / number
+            print(f'  {label:<14} {seconds * 1000:8.3f} ms/page')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Cold start of the scraper modules and of spawned worker processes
+
+Imports every module in a fresh interpreter and reports the best wall time
+over --repeat runs, less the best start of an empty interpreter, which is
+measured between the modules too. Modules that import in less time than the
+noise of the baseline report 0, the raw times are reported next to it.
+Worker processes started with the spawn method (the default on macOS and
+Windows) import the module of the function they run, the spawn column is the
+time from creating such a worker to its first result:
+    python3 benchmarks/bench_startup.py --repeat 20
+--src points at another checkout of src/ to compare against, e.g. a git worktree.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(BENCHMARKS, '..', 'src')
+
+MODULES = ['config', 'utils', 'storage', 'cli', 'scraper', 'distributed',
+           'async_video_processor', 'threaded_video_processor', 'parallel_video_processor',
+           'url_processor', 'language']
+
+# runs in the benchmarked interpreter: spawns one worker that imports the module
+SPAWN_SCRIPT = """
+import concurrent.futures, multiprocessing, sys, time
+start_time = time.perf_counter()
+with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+    executor.submit(exec, f'import {sys.argv[1]}').result()
+    print(time.perf_counter() - start_time)
+"""
+
+
+def best_time(command:list, cwd:str, env:dict, repeat:int) -> float:
+    """Best wall time of a command in seconds"""
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.run(command, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def spawn_time(module:str, cwd:str, env:dict, repeat:int) -> float:
+    """Best seconds from creating a spawned worker to the import of module in it"""
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', SPAWN_SCRIPT, module], cwd=cwd, env=env, check=True,
+                                capture_output=True, text=True)
+        elapsed = float(output.stdout.split()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def net_ms(elapsed:float, baseline:float) -> float:
+    """Milliseconds over the baseline, 0 when the difference is within its noise"""
+    return round(max(elapsed - baseline, 0) * 1000, 1)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--src', default=SRC, help='directory of the modules')
+    parser.add_argument('--modules', help='comma separated modules, by default all of them')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-spawn', action='store_true', help='skip the spawned worker column')
+    parser.add_argument('--json', action='store_true', help='print one JSON line per module')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    src = os.path.abspath(options.src)
+    env = os.environ | {'PYTHONPATH': src}
+    modules = options.modules.split(',') if options.modules else MODULES
+    # older checkouts may not have every module
+    modules = [module for module in modules if os.path.exists(os.path.join(src, f'{module}.py'))]
+    results = []
+    # data files the modules create land in a scratch directory
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = best_time([sys.executable, '-c', 'pass'], directory, env, options.repeat)
+        empty_spawn = None if options.no_spawn else spawn_time('os', directory, env, options.repeat)
+        raw = []
+        for module in modules:
+            imported = best_time([sys.executable, '-c', f'import {module}'], directory, env, options.repeat)
+            spawned = None if options.no_spawn else spawn_time(module, directory, env, options.repeat)
+            raw.append((module, imported, spawned))
+            # the best baseline over the whole run, a single one drifts with the load of the machine
+            baseline = min(baseline, best_time([sys.executable, '-c', 'pass'], directory, env, options.repeat))
+            if empty_spawn is not None:
+                empty_spawn = min(empty_spawn, spawn_time('os', directory, env, options.repeat))
+        for module, imported, spawned in raw:
+            result = {'module': module, 'import_ms': net_ms(imported, baseline), 'import_raw_ms': round(imported * 1000, 1)}
+            if spawned is not None:
+                result['spawn_ms'] = net_ms(spawned, empty_spawn)
+                result['spawn_raw_ms'] = round(spawned * 1000, 1)
+            results.append(result)
+    if options.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print(f'interpreter start {baseline * 1000:.1f} ms' +
+          ('' if empty_spawn is None else f', empty spawned worker {empty_spawn * 1000:.1f} ms'))
+    print(f'{"module":<26} {"import ms":>10} {"raw ms":>8} {"spawn ms":>10} {"raw ms":>8}')
+    for result in results:
+        print(f'{result["module"]:<26} {result["import_ms"]:>10} {result["import_raw_ms"]:>8} '
+              f'{result.get("spawn_ms", "-"):>10} {result.get("spawn_raw_ms", "-"):>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""Local stand-in for the TikTok endpoints the scraper uses
+
+Serves video pages with the __UNIVERSAL_DATA_FOR_REHYDRATION__ payload, the
+/api/comment/list/ endpoint with cursors and hashtag pages that load more
+videos on scroll. Latency, errors, 429 bursts and payload sizes are configurable:
+    python3 benchmarks/mock_server.py --port 8081 --latency-ms 80 --error-rate 0.02
+and the scraper is pointed at it with:
+    TIKTOK_BASE_URL=http://127.0.0.1:8081 python3 src/scraper.py
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+import zlib
+
+from aiohttp import web
+
+COMMENT_PAGE_SIZE = 50
+
+
+class MockSettings:
+    """
+    Behaviour of the mock server.
+
+    Parameters
+    ----------
+    latency_ms : float, optional
+        Median response latency in ms, by default 50
+    latency_sigma : float, optional
+        Sigma of the lognormal latency distribution, 0 for a fixed latency, by default 0.5
+    error_rate : float, optional
+        Share of responses answered with a 500, by default 0
+    burst_every : float, optional
+        Seconds between two 429 bursts, 0 disables bursts, by default 0
+    burst_length : float, optional
+        Seconds every endpoint answers 429 during a burst, by default 2
+    payload_kb : int, optional
+        Padding added to the rehydration payload of video pages in KB, by default 200
+    comment_count : int, optional
+        Comments of every video, by default 120
+    videos_per_scroll : int, optional
+        Videos a hashtag page adds on every scroll, by default 12
+    seed : int, optional
+        Random seed, by default 0
+    """
+
+    def __init__(self, latency_ms:float=50, latency_sigma:float=0.5, error_rate:float=0,
+                 burst_every:float=0, burst_length:float=2, payload_kb:int=200,
+                 comment_count:int=120, videos_per_scroll:int=12, seed:int=0) -> None:
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.payload_kb = payload_kb
+        self.comment_count = comment_count
+        self.videos_per_scroll = videos_per_scroll
+        self.seed = seed
+
+
+def video_page(video_id:str, user:str, payload_kb:int) -> bytes:
+    """Builds a video page with the rehydration script of the video"""
+    item_struct = {
+        'id': video_id,
+        'desc': f'mock video {video_id} #mock #fashion',
+        'createTime': str(1717250000 + int(video_id) % 10 ** 6),
+        'author': {'uniqueId': user, 'nickname': user},
+        'stats': {'playCount': int(video_id) % 10 ** 7, 'diggCount': int(video_id) % 10 ** 5,
+                  'collectCount': int(video_id) % 10 ** 4, 'commentCount': 120, 'shareCount': int(video_id) % 10 ** 3},
+    }
+    scope = {
+        'webapp.app-context': {'language': 'en', 'padding': 'p' * (payload_kb * 1024)},
+        'webapp.video-detail': {'itemInfo': {'itemStruct': item_struct}, 'statusCode': 0},
+    }
+    script = json.dumps({'__DEFAULT_SCOPE__': scope})
+    return (f'<!DOCTYPE html><html><head><title>{user} on TikTok</title></head><body>'
+            f'<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">{script}</script>'
+            f'</body></html>').encode('utf-8')
+
+def hashtag_page(tag:str, videos_per_scroll:int, video_tag:str) -> str:
+    """Builds a hashtag page that appends videos_per_scroll video links on every scroll"""
+    seed = zlib.crc32(tag.encode()) % 10 ** 6
+    return f"""<!DOCTYPE html><html><head><title>#{tag}</title></head>
+<body style="height: 200000px"><div id="videos"></div>
+<script>
+let count = 0;
+function load() {{
+    const container = document.getElementById('videos');
+    for (let i = 0; i < {videos_per_scroll}; i++) {{
+        const id = '7' + String({seed}).padStart(6, '0') + String(count).padStart(12, '0');
+        const div = document.createElement('div');
+        div.className = '{video_tag}';
+        div.innerHTML = `<a href="${{location.origin}}/@mock${{count % 97}}/video/${{id}}">video</a>`;
+        container.appendChild(div);
+        count++;
+    }}
+}}
+load();
+window.addEventListener('scroll', load);
+</script></body></html>"""
+
+def comment_page(video_id:str, cursor:int, comment_count:int) -> dict:
+    """One page of the comment API response"""
+    end = min(cursor + COMMENT_PAGE_SIZE, comment_count)
+    comments = [{'cid': f'{video_id}{index}',
+                 'text': f'comment {index} on {video_id}',
+                 'share_info': {'desc': f"mock{index}'s comment: comment {index} on {video_id}"}}
+                for index in range(cursor, end)]
+    return {'comments': comments or None, 'cursor': end, 'has_more': int(end < comment_count), 'status_code': 0}
+
+
+class MockServer:
+    """
+    The aiohttp application of the mock server and its request counters.
+
+    Parameters
+    ----------
+    settings : MockSettings
+    video_tag : str, optional
+        Class of the video divs of hashtag pages, by default the one in ScraperConfig.VIDEO_TAG
+    """
+
+    def __init__(self, settings:MockSettings, video_tag:str='css-x6y88p-DivItemContainerV2 e19c29qe8') -> None:
+        self.settings = settings
+        self.video_tag = video_tag
+        self.random = random.Random(settings.seed)
+        self.started_at = time.monotonic()
+        self.counts = collections.Counter()
+        self.pages = {}
+
+    def _latency(self) -> float:
+        median = self.settings.latency_ms / 1000
+        if self.settings.latency_sigma <= 0:
+            return median
+        return self.random.lognormvariate(0, self.settings.latency_sigma) * median
+
+    def _in_burst(self) -> bool:
+        if self.settings.burst_every <= 0:
+            return False
+        return (time.monotonic() - self.started_at) % self.settings.burst_every < self.settings.burst_length
+
+    @web.middleware
+    async def behaviour(self, request:web.Request, handler):
+        """Adds latency, 429 bursts and errors in front of every endpoint"""
+        if request.path == '/__stats':
+            return await handler(request)
+        await asyncio.sleep(self._latency())
+        if self._in_burst():
+            self.counts[429] += 1
+            return web.Response(status=429, text='Too Many Requests')
+        if self.random.random() < self.settings.error_rate:
+            self.counts[500] += 1
+            return web.Response(status=500, text='Internal Server Error')
+        response = await handler(request)
+        self.counts[response.status] += 1
+        return response
+
+    async def video(self, request:web.Request) -> web.Response:
+        video_id = request.match_info['video_id']
+        if video_id not in self.pages:
+            self.pages[video_id] = video_page(video_id, request.match_info['user'], self.settings.payload_kb)
+        return web.Response(body=self.pages[video_id], content_type='text/html')
+
+    async def comments(self, request:web.Request) -> web.Response:
+        video_id = request.query.get('aweme_id', '0')
+        cursor = int(request.query.get('cursor', 0))
+        return web.json_response(comment_page(video_id, cursor, self.settings.comment_count))
+
+    async def hashtag(self, request:web.Request) -> web.Response:
+        page = hashtag_page(request.match_info['tag'], self.settings.videos_per_scroll, self.video_tag)
+        return web.Response(text=page, content_type='text/html')
+
+    async def stats(self, request:web.Request) -> web.Response:
+        return web.json_response({str(status): count for status, count in self.counts.items()})
+
+    def application(self) -> web.Application:
+        app = web.Application(middlewares=[self.behaviour])
+        app.router.add_get('/@{user}/video/{video_id:\\d+}', self.video)
+        app.router.add_get('/api/comment/list/', self.comments)
+        app.router.add_get('/tag/{tag}', self.hashtag)
+        app.router.add_get('/__stats', self.stats)
+        return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the TikTok endpoints')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=50, help='median latency')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='sigma of the lognormal latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of 500 responses')
+    parser.add_argument('--burst-every', type=float, default=0, help='seconds between 429 bursts, 0 disables them')
+    parser.add_argument('--burst-length', type=float, default=2, help='seconds of a 429 burst')
+    parser.add_argument('--payload-kb', type=int, default=200, help='padding of the video page payload')
+    parser.add_argument('--comments', type=int, default=120, help='comments per video')
+    parser.add_argument('--videos-per-scroll', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = MockSettings(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                            error_rate=args.error_rate, burst_every=args.burst_every,
+                            burst_length=args.burst_length, payload_kb=args.payload_kb,
+                            comment_count=args.comments, videos_per_scroll=args.videos_per_scroll,
+                            seed=args.seed)
+    web.run_app(MockServer(settings).application(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,139 @@
 import asyncio
-import datetime
+import contextlib
 import json
+import math
 import re
+import time
 
 import aiohttp
-from fake_useragent import UserAgent
-from lxml import html
 
+import user_agents
 import utils
 from config import ScraperConfig
+from extractor import extract_video_info
+from metrics import FETCH_LATENCY, PARSE_TIME, QUEUE_DEPTH, REQUESTS
+from rate_limiter import endpoint_for, get_rate_limiter
+from response_cache import expire, get_response_cache
+from retry import NETWORK, PARSE, FetchError, RetryScheduler, get_circuit_breaker
+from storage import COMMENTS_PATH, METADATA_PATH, get_storage
 
 
 class AsyncVideoProcessor:
     
+    # adaptive limit on requests in flight, None keeps the worker pool as the only bound
+    controller = None
+    
+    # if True, fresh cached responses are revalidated too (stats refresh)
+    revalidate = False
+    
+    # called with (url, data) for every stored result, e.g. to join it right away
+    on_result = None
+    
+    # retry scheduler of the latest batch, holds its failures
+    retries = None
+    
+    def _slot(self):
+        """Waits for the concurrency controller to admit a request"""
+        if self.controller is None:
+            return contextlib.nullcontext()
+        return self.controller.async_slot()
+    
+    async def _throttle(self, endpoint:str):
+        """Waits for the shared rate limiter to admit a request to the endpoint"""
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            await limiter.acquire_async(endpoint)
+    
+    async def _wait_for_circuit(self, endpoint:str):
+        """Waits while the circuit breaker pauses the requests to the endpoint"""
+        breaker = get_circuit_breaker()
+        while breaker is not None and (delay := breaker.wait(endpoint)) > 0:
+            await asyncio.sleep(delay)
+    
+    def _timeout(self) -> float:
+        """Request timeout in seconds"""
+        if self.controller is None:
+            return 10
+        return self.controller.request_timeout
+    
+    def _record(self, outcome, start_time:float=None):
+        """Reports the outcome of a request to the concurrency controller"""
+        if self.controller is None:
+            return
+        if outcome == 'parse':
+            self.controller.record_parse_failure()
+        else:
+            latency = time.monotonic() - start_time if start_time is not None else None
+            self.controller.record(outcome, latency)
+    
+    async def _get(self, session: aiohttp.ClientSession, url:str) -> tuple:
+        """
+        Sends a GET request through the response cache, paced by the rate limiter
+        and the circuit breaker and admitted by the concurrency controller. Fresh
+        cached responses are returned without a request, stale ones are revalidated.
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The aiohttp session to use for the request.
+        url : str
+            The URL to request.
+
+        Returns
+        -------
+        tuple
+            (status, body), cached and not modified bodies come back with status 200.
+
+        Raises
+        ------
+        FetchError
+            A NETWORK error if the request times out or fails.
+        """
+        endpoint = endpoint_for(url)
+        cache = get_response_cache()
+        entry = cache.lookup(url) if cache is not None else None
+        if entry is not None and entry['fresh'] and not self.revalidate:
+            REQUESTS.inc(endpoint, 'cached')
+            return 200, entry['body']
+        headers = user_agents.headers()
+        if entry is not None:
+            headers = headers | cache.validators(entry)
+        await self._wait_for_circuit(endpoint)
+        await self._throttle(endpoint)
+        async with self._slot():
+            start_time = time.monotonic()
+            try:
+                async with session.get(url, headers=headers, timeout=self._timeout()) as response:
+                    self._record(response.status, start_time)
+                    status, body = response.status, await response.read()
+                    response_headers = response.headers
+            except asyncio.TimeoutError as e:
+                self._record('timeout')
+                REQUESTS.inc(endpoint, 'timeout')
+                raise FetchError(NETWORK, 'timeout') from e
+            except aiohttp.ClientError as e:
+                self._record('error')
+                REQUESTS.inc(endpoint, 'error')
+                raise FetchError(NETWORK, f'{type(e).__name__}: {e}') from e
+        REQUESTS.inc(endpoint, status)
+        breaker = get_circuit_breaker()
+        if breaker is not None:
+            breaker.record(endpoint, status)
+        FETCH_LATENCY.observe(time.monotonic() - start_time, endpoint)
+        if status == 304 and entry is not None:
+            cache.refresh(url)
+            return 200, entry['body']
+        if status == 200 and cache is not None:
+            cache.put(url, body, response_headers)
+        return status, body
+    
     async def _process_url(self, 
                            session: aiohttp.ClientSession, 
                            url:str, 
                            shared_dict:dict, 
                            lock:asyncio.Lock, 
-                           path:str):
+                           path:str,
+                           sink=None):
         """
         Asynchronously processes a URL to fetch data and updates the shared dictionary.
 
@@ -34,16 +149,74 @@ class AsyncVideoProcessor:
             The lock to synchronize access to the shared dictionary.
         path : str
             The path where the shared dictionary is saved.
+        sink : ResultJournal | SQLiteResultSink, optional
+            If given, the result is appended to the sink instead of
+            rewriting the whole file, by default None
         """
         fetched_data = await self._fetch_data(session, url)
         if fetched_data:
             async with lock:
-                shared_dict[url] = fetched_data               
-                utils.write(path, shared_dict)
+                shared_dict[url] = fetched_data
+                if sink:
+                    sink.append(url, fetched_data)
+                else:
+                    utils.write(path, shared_dict)
+            if self.on_result is not None:
+                self.on_result(url, fetched_data)
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        """
+        Creates the session shared by all workers, backed by a pooled connector
+        with a global and per-host connection limit, a DNS cache and keep-alive.
+
+        Returns
+        -------
+        aiohttp.ClientSession
+        """
+        connector = aiohttp.TCPConnector(limit=ScraperConfig.ASYNC_CONCURRENCY,
+                                         limit_per_host=ScraperConfig.ASYNC_PER_HOST_CONCURRENCY,
+                                         ttl_dns_cache=ScraperConfig.ASYNC_DNS_CACHE_TTL,
+                                         use_dns_cache=True,
+                                         keepalive_timeout=ScraperConfig.ASYNC_KEEPALIVE_TIMEOUT)
+        return aiohttp.ClientSession(connector=connector)
+
+    async def _worker(self, retries:RetryScheduler, process, queue:str='async'):
+        """
+        Takes the URLs that are due from the retry scheduler and processes them one at a time
+        until every URL is done. A failing URL goes back to the scheduler to wait out its backoff
+        while the worker goes on with other URLs.
+
+        Parameters
+        ----------
+        retries : RetryScheduler
+            The scheduler of the URLs to be processed.
+        process : callable
+            Coroutine function processing a single URL.
+        queue : str, optional
+            Label of the queue depth metric, by default 'async'
+        """
+        while True:
+            url, delay = retries.next()
+            if url is None:
+                if delay is None:
+                    return
+                await asyncio.sleep(delay)
+                continue
+            QUEUE_DEPTH.set(len(retries), queue)
+            try:
+                await process(url)
+            except Exception as e:
+                # any error of a URL, e.g. of the sink or of on_result, fails that URL only,
+                # errors that are neither FetchErrors nor OSErrors count as parse errors
+                retries.failed(url, e)
+            else:
+                retries.done(url)
 
     async def _async_scraper(self, url_list:list, path:str):
         """
         Asynchronously scrapes data from a list of URLs and saves the results to the specified path.
+        URLs are processed by a bounded pool of ScraperConfig.ASYNC_CONCURRENCY workers,
+        failed URLs are retried through a RetryScheduler kept as self.retries.
 
         Parameters
         ----------
@@ -52,11 +225,23 @@ class AsyncVideoProcessor:
         path : str
             The path where the scraped data will be saved.
         """
-        shared_dict = {}
         lock = asyncio.Lock()
-        async with aiohttp.ClientSession() as session:
-            tasks = [self._process_url(session, url, shared_dict, lock, path) for url in url_list]
-            await asyncio.gather(*tasks)
+        sink = get_storage().open_sink(path, compact_every=ScraperConfig.JOURNAL_COMPACT_EVERY)
+        # with RESUME results add to the fetched data instead of replacing it,
+        # without a sink every result rewrites the file with what it already holds
+        if sink and not ScraperConfig.RESUME:
+            sink.begin_batch()
+        shared_dict = get_storage().read(path) if ScraperConfig.RESUME and not sink else {}
+        try:
+            self.retries = RetryScheduler(url_list)
+            worker_count = min(ScraperConfig.ASYNC_CONCURRENCY, len(url_list))
+            async with self._create_session() as session:
+                process = lambda url: self._process_url(session, url, shared_dict, lock, path, sink)
+                workers = [self._worker(self.retries, process) for _ in range(worker_count)]
+                await asyncio.gather(*workers)
+        finally:
+            if sink:
+                sink.compact()
     
     async def _fetch_data(self,):
         """Placeholder for fetching data from a URL"""
@@ -64,16 +249,14 @@ class AsyncVideoProcessor:
     
 class AsyncProcessMetaData(AsyncVideoProcessor): 
     
-    def __init__(self, url_list) -> None:
+    def __init__(self, url_list, controller=None) -> None:
         self.url_list = url_list
+        self.controller = controller
     
-    async def _fetch_data(self, 
-                          session: aiohttp.ClientSession, 
-                          url:str, 
-                          max_retries:int=5):
+    async def _fetch_data(self, session: aiohttp.ClientSession, url:str) -> dict:
         """
-        Asynchronous metadata scraping for a single URL.
-        If scraping fails, retries up to max_retries times.
+        Asynchronous metadata scraping for a single URL, in a single attempt:
+        failed URLs are retried by the retry scheduler of the batch.
 
         Parameters
         ----------
@@ -81,63 +264,61 @@ class AsyncProcessMetaData(AsyncVideoProcessor):
             The aiohttp session to use for the request.
         url : str
             The URL to fetch.
-        max_retries : int, optional
-            The number of fetch attempts, by default 5.
 
         Returns
         -------
         dict
-            The video metadata information or None if fetching is not successful.
+            The video metadata information.
+
+        Raises
+        ------
+        FetchError
+            If the request fails, the status is not 200 or the page holds no video details.
         """
-        attempt = 0
-        while attempt < max_retries:
-            try:
-                async with session.get(url, headers=ScraperConfig.HEADERS, timeout=10) as response:
-                    if response.status == 200:
-                        text = await response.text()
-                        tree = html.fromstring(text)
-                        json_content = tree.xpath('//script[@id="__UNIVERSAL_DATA_FOR_REHYDRATION__"]/text()')
-                        if json_content:
-                            video_data = json.loads(json_content[0])["__DEFAULT_SCOPE__"]["webapp.video-detail"]["itemInfo"]["itemStruct"]
-                            video_info = {
-                                'Account': video_data['author']['uniqueId'],
-                                'Views': video_data['stats']['playCount'],
-                                'Likes': video_data['stats']['diggCount'],
-                                'Saved': video_data['stats']['collectCount'],
-                                'Comment Count': video_data['stats']['commentCount'],
-                                'Share Count': video_data['stats']['shareCount'],
-                                'Caption': re.sub(r'#\w+', '', video_data['desc']).strip().replace(',', ''),
-                                'Hashtags': ' '.join(re.findall(r'#\w+', video_data['desc'])),
-                                'Date posted': datetime.datetime.fromtimestamp(int(video_data['createTime'])).strftime("%m/%d/%Y"),
-                                'Date Collected': datetime.datetime.today().strftime("%m/%d/%Y")
-                            }
-                            return video_info if video_info else None
-            except (aiohttp.ClientError, json.JSONDecodeError, KeyError) as e:
-                # print(e)
-                pass
-            attempt += 1
-            await asyncio.sleep(1)
-        return None
+        status, page = await self._get(session, url)
+        if status != 200:
+            raise FetchError.from_status(status)
+        try:
+            with PARSE_TIME.time('video'):
+                video_info = extract_video_info(page)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._record('parse')
+            expire(url)
+            raise FetchError(PARSE, f'{type(e).__name__}: {e}') from e
+        if not video_info:
+            self._record('parse')
+            expire(url)
+            raise FetchError(PARSE, 'no video details')
+        return video_info
     
     def get_metadata(self):
         """Retrieves metadata for the URLs in the url_list. until timeout"""
         try:
-            asyncio.run(asyncio.wait_for(self._async_scraper(self.url_list, 'data/fetched_metadata.json'), 
+            asyncio.run(asyncio.wait_for(self._async_scraper(self.url_list, METADATA_PATH), 
                                          timeout=ScraperConfig.METADATA_SCRAPER_TIMEOUT))
-        except:
+        except asyncio.TimeoutError:
             pass
+        except Exception as e:
+            print(f'Metadata scraping stopped: {type(e).__name__}: {e}')
     
 class AsyncProcessComments(AsyncVideoProcessor):
-    """_summary_
+    """Asynchronous comment scraper
 
     Parameters
     ----------
-    AsyncVideoProcessor : _type_
-        _description_
+    url_list : list
+        A list of video URLs to scrap the comments for.
+    comment_counts : dict, optional
+        keys: URLs | values: 'Comment Count' from the metadata, used to size
+        the pipelined pagination, by default None
+    controller : ConcurrencyController, optional
+        Adaptive limit on requests in flight, by default None
     """
     
-    def __init__(self, url_list) -> None:
+    def __init__(self, url_list, comment_counts:dict=None, controller=None) -> None:
         self.url_list = url_list
+        self.comment_counts = comment_counts or {}
+        self.controller = controller
     
     async def _fetch(self, session: aiohttp.ClientSession, url: str) -> dict:
         """
@@ -154,16 +335,106 @@ class AsyncProcessComments(AsyncVideoProcessor):
         -------
         dict
             The fetched JSON data.
+
+        Raises
+        ------
+        FetchError
+            If the request fails, the status is not 200 or the body is not JSON.
         """
-        async with session.get(url, headers=ScraperConfig.HEADERS) as response:
-            try: 
-                return await response.json()
-            except: 
-                return None  
+        status, body = await self._get(session, url)
+        if status != 200:
+            raise FetchError.from_status(status)
+        try: 
+            with PARSE_TIME.time('comments'):
+                return json.loads(body)
+        except ValueError as e: 
+            self._record('parse')
+            expire(url)
+            raise FetchError(PARSE, f'comments are not JSON: {e}') from e
             
+    async def _fetch_page(self, session: aiohttp.ClientSession, video_id:str, cursor_index:int) -> list:
+        """
+        Fetches a single page of comments.
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The aiohttp session to use for the request.
+        video_id : str
+            The ID of the video.
+        cursor_index : int
+            The cursor of the page.
+
+        Returns
+        -------
+        list
+            The comments of the page, empty if there are no more comments.
+
+        Raises
+        ------
+        FetchError
+            If the page cannot be fetched or a comment cannot be read from it.
+        """
+        pattern = r'comment:\s*(.*)'
+        comment_url = f'{ScraperConfig.BASE_URL}/api/comment/list/?aweme_id={video_id}&count=50&cursor={cursor_index}'
+        comment_data = await self._fetch(session, comment_url)
+        try:
+            comment_data = comment_data.get('comments') or []
+            return [re.search(pattern, comment['share_info']['desc']).group(1) for comment in comment_data]
+        except (AttributeError, KeyError, TypeError) as e:
+            self._record('parse')
+            expire(comment_url)
+            raise FetchError(PARSE, f'unexpected comment page: {type(e).__name__}: {e}') from e
+
+    async def _fetch_data_pipelined(self, session: aiohttp.ClientSession, url :str) -> list:
+        """
+        Fetch comments data for a given video URL, requesting a window of cursor
+        pages concurrently. The window covers the pages expected from COMMENT_COUNT,
+        or from the 'Comment Count' of the video when it is known, capped at
+        ScraperConfig.COMMENT_PAGE_WINDOW. Pages are consumed in cursor order, so the
+        result is the same as the sequential walk: it stops at the first empty page
+        and pages beyond the target are discarded.
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            The aiohttp session to use for the request.
+        url : str
+            The URL of the video to scrape comments for.
+
+        Returns
+        -------
+        list
+            A list of comments for the given video URL.
+        """
+        video_id = url.split('/')[-1]
+        target = ScraperConfig.COMMENT_COUNT
+        expected = target
+        if self.comment_counts.get(url) is not None:
+            expected = min(target, int(self.comment_counts[url]))
+        window = max(1, min(ScraperConfig.COMMENT_PAGE_WINDOW, math.ceil(expected / 50)))
+
+        post_comments = []
+        cursor_index = 0
+        while len(post_comments) < target:
+            pages = await asyncio.gather(*[self._fetch_page(session, video_id, cursor_index + 50 * i) 
+                                           for i in range(window)], 
+                                         return_exceptions=True)
+            for page in pages:
+                if isinstance(page, BaseException):
+                    raise page
+                if not page:
+                    return post_comments
+                post_comments.extend(page)
+                if len(post_comments) >= target:
+                    return post_comments
+            cursor_index += 50 * window
+        return post_comments
+
     async def _fetch_data(self, session: aiohttp.ClientSession, url :str) -> list:
         """
         Fetch comments data for a given video URL.
+        Delegates to the pipelined pagination if ScraperConfig.PIPELINED_COMMENTS is set.
 
         Parameters
         ----------
@@ -176,37 +447,37 @@ class AsyncProcessComments(AsyncVideoProcessor):
         -------
         list
             A list of comments for the given video URL.
+
+        Raises
+        ------
+        FetchError
+            If a page of comments cannot be fetched.
         """
+        if ScraperConfig.PIPELINED_COMMENTS:
+            return await self._fetch_data_pipelined(session, url)
         video_id = url.split('/')[-1]
-        pattern = r'comment:\s*(.*)'
 
         post_comments = []
         cursor_index = 0
 
+        # a page that fails raises, the video is retried as a whole by the retry scheduler
         while len(post_comments) < ScraperConfig.COMMENT_COUNT:
-            comment_url = f'https://www.tiktok.com/api/comment/list/?aweme_id={video_id}&count=50&cursor={cursor_index}'
-            comment_data = await self._fetch(session, comment_url)
-            try: 
-                if comment_data:
-                    comment_data = comment_data.get('comments', [])
-                    if not comment_data:
-                        break
-                    temp_comments = [re.search(pattern, comment['share_info']['desc']).group(1) for comment in comment_data]
-                    post_comments.extend(temp_comments)
-                else:
-                    break
-            except:
-                continue
+            page = await self._fetch_page(session, video_id, cursor_index)
+            if not page:
+                break
+            post_comments.extend(page)
             cursor_index += 50 
         return post_comments
     
     def get_comments(self):
         """Retrieves comments for the URLs in the url_list."""
         try:
-            asyncio.run(asyncio.wait_for(self._async_scraper(self.url_list, 'data/fetched_comments.json'), 
+            asyncio.run(asyncio.wait_for(self._async_scraper(self.url_list, COMMENTS_PATH), 
                                          timeout=ScraperConfig.COMMENT_SCRAPER_TIMEOUT))
-        except:
+        except asyncio.TimeoutError:
             pass
+        except Exception as e:
+            print(f'Comment scraping stopped: {type(e).__name__}: {e}')
     
 
 if __name__ == '__main__':
@@ -216,8 +487,8 @@ if __name__ == '__main__':
     AsyncProcessMetaData(urls[:10]).get_metadata()
     AsyncProcessComments(urls[:10]).get_comments()
     try:
-        comments = utils.read('data/fetched_comments.json')
-        metadata = utils.read('data/fetched_metadata.json')
+        comments = get_storage().read(COMMENTS_PATH)
+        metadata = get_storage().read(METADATA_PATH)
         print(f'metadata: {len(metadata)}')
         print(f'comments: {len(comments)}')
     except Exception as e:
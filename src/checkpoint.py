@@ -0,0 +1,50 @@
+"""Checkpoint of the scrap loop, the stage a restarted scraper resumes from"""
+
+import os
+import time
+
+import utils
+from config import ScraperConfig
+
+
+class Checkpoint:
+    """
+    The run and stage the scrap loop is in, kept in a JSON file that is
+    rewritten atomically (temporary file and rename) at every stage, so a
+    crash leaves either the previous or the current stage on disk. The
+    progress within a stage is the fetched data itself, which is kept
+    across restarts when ScraperConfig.RESUME is on.
+
+    Fields:
+        run          'full' or 'left_over'
+        stage        'urls', 'metadata', 'comments', 'merge', 'pipeline' or 'refresh'
+        left_over    index of the left over run
+        run_log      run log of the interrupted run
+        updated_at   time of the latest save
+
+    Parameters
+    ----------
+    path : str, optional
+        The checkpoint file, by default ScraperConfig.CHECKPOINT_PATH
+    """
+
+    def __init__(self, path:str=None) -> None:
+        self.path = path or ScraperConfig.CHECKPOINT_PATH
+        self.state = {}
+
+    def load(self) -> dict:
+        """The saved checkpoint, empty if the latest run finished"""
+        self.state = utils.read(self.path) if os.path.exists(self.path) else {}
+        return dict(self.state)
+
+    def save(self, **fields):
+        """Updates fields of the checkpoint and writes it"""
+        self.state.update(fields)
+        self.state['updated_at'] = time.time()
+        utils.write(self.path, self.state)
+
+    def clear(self):
+        """Removes the checkpoint once the run is finished"""
+        self.state = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
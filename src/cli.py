@@ -0,0 +1,116 @@
+"""Command line entry point of the scraper
+
+    python3 src/cli.py scrape [--mode async] [--run-mode pipelined] [--storage sqlite] [--fresh]
+    python3 src/cli.py coordinator|worker [options of src/distributed.py]
+    python3 src/cli.py export [parquet|arrow|csv] [--full]
+    python3 src/cli.py import-json
+    python3 src/cli.py reparse
+
+Only the modules of the chosen command are imported, and the scraper imports
+the engine of a mode the first time it runs in that mode. Options override
+ScraperConfig before anything reads it.
+"""
+
+import argparse
+import sys
+import time
+
+from config import ScraperConfig
+
+MODES = ('async', 'threaded', 'parallel')
+
+
+def scrape(options):
+    """Runs the scrap loop until TOTAL_SCRAP_COUNT records are collected"""
+    if options.mode:
+        ScraperConfig.METADATA_MODE = ScraperConfig.COMMENTS_MODE = options.mode
+    if options.metadata_mode:
+        ScraperConfig.METADATA_MODE = options.metadata_mode
+    if options.comments_mode:
+        ScraperConfig.COMMENTS_MODE = options.comments_mode
+    if options.run_mode:
+        ScraperConfig.RUN_MODE = options.run_mode
+    if options.storage:
+        ScraperConfig.STORAGE_BACKEND = options.storage
+    if options.fresh:
+        ScraperConfig.RESUME = False
+    from scraper import Scraper
+
+    scraper = Scraper()
+    try:
+        scraper.scrap()
+    finally:
+        scraper.close()
+
+def distributed(options):
+    """Runs a coordinator or a worker node"""
+    from distributed import main
+
+    main([options.command, *options.arguments])
+
+def export(options):
+    """Exports the database"""
+    from exporter import export
+
+    start_time = time.time()
+    record_count, comment_count = export(options.format, incremental=not options.full)
+    print(f'{record_count} records and {comment_count} comments exported in {time.time() - start_time:.2f} seconds')
+
+def import_json(options):
+    """Imports the JSON files of data/ into the SQLite backend"""
+    from storage import SQLiteStorage, import_json
+
+    import_json(SQLiteStorage())
+
+def reparse(options):
+    """Replaces the fetched metadata and comments with the cached responses of the videos not in the database"""
+    from response_cache import reparse_fetched
+    from storage import get_storage
+
+    storage = get_storage()
+    metadata, comments = reparse_fetched(storage)
+    storage.close()
+    print(f'Re-parsed metadata of {len(metadata)} and comments of {len(comments)} videos from the cache')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='TikTok scraper')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scrape_parser = commands.add_parser('scrape', help='run the scraper')
+    scrape_parser.add_argument('--mode', choices=MODES, help='metadata and comments scraper mode')
+    scrape_parser.add_argument('--metadata-mode', choices=MODES)
+    scrape_parser.add_argument('--comments-mode', choices=MODES)
+    scrape_parser.add_argument('--run-mode', choices=('staged', 'pipelined'))
+    scrape_parser.add_argument('--storage', choices=('json', 'sqlite'))
+    scrape_parser.add_argument('--fresh', action='store_true', help='reset the fetched data instead of resuming')
+    scrape_parser.set_defaults(run=scrape)
+
+    for role in ('coordinator', 'worker'):
+        # the options are parsed by src/distributed.py
+        role_parser = commands.add_parser(role, help=f'run a {role} node of the distributed mode', add_help=False)
+        role_parser.set_defaults(run=distributed)
+
+    export_parser = commands.add_parser('export', help='export the database')
+    # exporter.FORMATS, without importing pyarrow
+    export_parser.add_argument('format', nargs='?', choices=('parquet', 'arrow', 'csv'), default='parquet')
+    export_parser.add_argument('--full', action='store_true', help='replace earlier exports instead of adding new records')
+    export_parser.set_defaults(run=export)
+
+    import_parser = commands.add_parser('import-json', help='import the JSON files into the SQLite backend')
+    import_parser.set_defaults(run=import_json)
+
+    reparse_parser = commands.add_parser('reparse', help='re-parse the fetched data from the response cache')
+    reparse_parser.set_defaults(run=reparse)
+    options, arguments = parser.parse_known_args(argv)
+    if arguments and options.run is not distributed:
+        parser.error(f'unrecognized arguments: {" ".join(arguments)}')
+    options.arguments = arguments
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    options.run(options)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""Compact comment storage: interned strings in compressed blocks and an ID array per video
+
+Every distinct comment text is stored once in a string table shared by the
+fetched comments and the database, in blocks of COMMENT_BLOCK_STRINGS strings
+compressed with zstd (zlib if zstandard is not installed). The comments of a
+video are a compressed array of string ID deltas: new comments get consecutive
+IDs, so a comment repeated across videos or moved from the fetched data into
+the database costs a byte or two. The tables live in an
+SQLite file next to the storage backend. To move an existing database into
+the store:
+    python3 src/comment_store.py
+"""
+
+import array
+import collections
+import hashlib
+import itertools
+import json
+import sys
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from config import ScraperConfig
+
+# digests per lookup query, below the SQLite limit of bound parameters
+LOOKUP_CHUNK = 500
+
+
+def compress(data:bytes) -> bytes:
+    """Compresses a block, prefixed with its codec"""
+    if zstandard is not None:
+        return b'Z' + zstandard.ZstdCompressor(level=ScraperConfig.COMMENT_ZSTD_LEVEL).compress(data)
+    return b'D' + zlib.compress(data, 9)
+
+def decompress(blob:bytes) -> bytes:
+    """Decompresses a block written by compress"""
+    codec, data = blob[:1], blob[1:]
+    if codec == b'Z':
+        if zstandard is None:
+            raise ImportError('zstandard is required to read zstd comment blocks')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def pack_ids(ids:list) -> bytes:
+    """String IDs as the compressed little-endian int32 array of their deltas"""
+    deltas = array.array('i', [current - previous for previous, current in zip([0] + ids, ids)])
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return compress(deltas.tobytes())
+
+def unpack_ids(data:bytes) -> list:
+    deltas = array.array('i')
+    deltas.frombytes(decompress(data))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return list(itertools.accumulate(deltas))
+
+def _digest(text:str) -> int:
+    """64-bit hash of a string, strings are looked up by it and then compared"""
+    digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+class CommentStore:
+    """
+    Comment lists of videos, grouped in namespaces (e.g. the fetched comments and
+    the database). Methods run on a connection of the SQLite file holding the
+    tables, writes must run inside a write transaction of that connection.
+
+    Strings are append-only: the strings of comments that are replaced or
+    cleared stay in the table, where the next videos can reuse them.
+
+    Parameters
+    ----------
+    cache_blocks : int, optional
+        Decompressed string blocks kept in memory, by default ScraperConfig.COMMENT_BLOCK_CACHE
+    """
+
+    def __init__(self, cache_blocks:int=None) -> None:
+        self.block_size = ScraperConfig.COMMENT_BLOCK_STRINGS
+        self.cache_blocks = cache_blocks or ScraperConfig.COMMENT_BLOCK_CACHE
+        self._blocks = collections.OrderedDict()
+
+    @staticmethod
+    def create_tables(connection):
+        # digests are not unique: two strings with the same digest get an ID each
+        connection.execute('CREATE TABLE IF NOT EXISTS comment_digests (id INTEGER PRIMARY KEY, digest INTEGER NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS comment_digests_digest ON comment_digests (digest)')
+        # stores written before keyed the strings by their digest alone
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'comment_strings'").fetchone():
+            connection.execute('INSERT OR IGNORE INTO comment_digests (id, digest) SELECT id, digest FROM comment_strings')
+            connection.execute('DROP TABLE comment_strings')
+        connection.execute('CREATE TABLE IF NOT EXISTS comment_blocks (block INTEGER PRIMARY KEY, data BLOB NOT NULL)')
+        # strings of the block that is not full yet
+        connection.execute('CREATE TABLE IF NOT EXISTS comment_pending (id INTEGER PRIMARY KEY, text TEXT NOT NULL)')
+        connection.execute('CREATE TABLE IF NOT EXISTS comment_lists ('
+                           'namespace TEXT NOT NULL, url TEXT NOT NULL, ids BLOB NOT NULL, '
+                           'PRIMARY KEY (namespace, url)) WITHOUT ROWID')
+
+    def _intern(self, connection, texts:list) -> list:
+        """IDs of the texts, new texts are added to the string table in the order they come.
+        The digest of a text only narrows the lookup down, the stored strings are compared"""
+        digests = {text: _digest(text) for text in texts}
+        unique = list(set(digests.values()))
+        candidates = collections.defaultdict(list)
+        for start in range(0, len(unique), LOOKUP_CHUNK):
+            chunk = unique[start:start + LOOKUP_CHUNK]
+            for digest, string_id in connection.execute(f'SELECT digest, id FROM comment_digests WHERE digest IN '
+                                                        f'({",".join("?" * len(chunk))})', chunk):
+                candidates[digest].append(string_id)
+        strings = self._strings(connection, [string_id for ids in candidates.values() for string_id in ids])
+        known = {}
+        for text, digest in digests.items():
+            known.update((text, string_id) for string_id in candidates.get(digest, ()) if strings[string_id] == text)
+        new = [text for text in digests if text not in known]
+        if new:
+            first_id = self._next_id(connection)
+            rows = [(digests[text], string_id, text) for string_id, text in enumerate(new, first_id)]
+            connection.executemany('INSERT INTO comment_digests (digest, id) VALUES (?, ?)',
+                                   [(digest, string_id) for digest, string_id, _ in rows])
+            known.update((text, string_id) for _, string_id, text in rows)
+            # pending strings are added up to the end of their block, which is sealed
+            # right away, so at most one block of strings is ever pending
+            start = 0
+            while start < len(rows):
+                end = start + self.block_size - rows[start][1] % self.block_size
+                connection.executemany('INSERT INTO comment_pending (id, text) VALUES (?, ?)',
+                                       [(string_id, text) for _, string_id, text in rows[start:end]])
+                if end <= len(rows):
+                    self._seal(connection, rows[start][1] // self.block_size)
+                start = end
+        return [known[text] for text in texts]
+
+    def _next_id(self, connection) -> int:
+        """ID of the next new string, after the pending strings or the last sealed block"""
+        last = connection.execute('SELECT MAX(id) FROM comment_pending').fetchone()[0]
+        if last is not None:
+            return last + 1
+        block = connection.execute('SELECT MAX(block) FROM comment_blocks').fetchone()[0]
+        return 0 if block is None else (block + 1) * self.block_size
+
+    def _seal(self, connection, block:int):
+        """Compresses a full block and moves it out of the pending strings"""
+        start, end = block * self.block_size, (block + 1) * self.block_size - 1
+        texts = [row[0] for row in connection.execute('SELECT text FROM comment_pending WHERE id BETWEEN ? AND ? '
+                                                      'ORDER BY id', (start, end))]
+        data = compress(json.dumps(texts, ensure_ascii=False).encode('utf-8', 'surrogatepass'))
+        connection.execute('INSERT OR REPLACE INTO comment_blocks (block, data) VALUES (?, ?)', (block, data))
+        connection.execute('DELETE FROM comment_pending WHERE id BETWEEN ? AND ?', (start, end))
+
+    def _block(self, connection, block:int) -> list:
+        """Strings of a sealed block, None if the block is still pending"""
+        if block in self._blocks:
+            self._blocks.move_to_end(block)
+            return self._blocks[block]
+        row = connection.execute('SELECT data FROM comment_blocks WHERE block = ?', (block,)).fetchone()
+        if row is None:
+            return None
+        texts = json.loads(decompress(row[0]).decode('utf-8', 'surrogatepass'))
+        self._blocks[block] = texts
+        if len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return texts
+
+    def _strings(self, connection, ids) -> dict:
+        """keys: string IDs | values: texts"""
+        strings = {}
+        pending = []
+        for block in sorted({string_id // self.block_size for string_id in ids}):
+            texts = self._block(connection, block)
+            if texts is None:
+                pending.append(block)
+                continue
+            start = block * self.block_size
+            strings.update(enumerate(texts, start))
+        for block in pending:
+            start, end = block * self.block_size, (block + 1) * self.block_size - 1
+            strings.update(connection.execute('SELECT id, text FROM comment_pending WHERE id BETWEEN ? AND ?',
+                                              (start, end)))
+        return strings
+
+    def _decode(self, connection, rows:list) -> dict:
+        """Resolves (url, ids) rows into keys: URLs | values: comment lists"""
+        lists = [(url, unpack_ids(data)) for url, data in rows]
+        strings = self._strings(connection, {string_id for _, ids in lists for string_id in ids})
+        return {url: [strings[string_id] for string_id in ids] for url, ids in lists}
+
+    def put(self, connection, namespace:str, items):
+        """
+        Inserts or replaces the comment lists of videos.
+
+        Parameters
+        ----------
+        connection : sqlite3.Connection
+            In a write transaction.
+        namespace : str
+        items : iterable
+            (url, list of comment texts) pairs.
+        """
+        items = [(url, comments or []) for url, comments in items]
+        ids = iter(self._intern(connection, [comment for _, comments in items for comment in comments]))
+        rows = [(namespace, url, pack_ids(list(itertools.islice(ids, len(comments))))) for url, comments in items]
+        connection.executemany('INSERT OR REPLACE INTO comment_lists (namespace, url, ids) VALUES (?, ?, ?)', rows)
+
+    def get(self, connection, namespace:str, url:str) -> list:
+        """Comments of a single video, None if it is not stored"""
+        return self.get_many(connection, namespace, [url]).get(url)
+
+    def get_many(self, connection, namespace:str, urls:list) -> dict:
+        """
+        Comments of the given videos, decoding only the blocks they use.
+
+        Returns
+        -------
+        dict
+            keys: the stored URLs among urls | values: comment lists
+        """
+        rows = []
+        for url in urls:
+            row = connection.execute('SELECT ids FROM comment_lists WHERE namespace = ? AND url = ?',
+                                     (namespace, url)).fetchone()
+            if row is not None:
+                rows.append((url, row[0]))
+        return self._decode(connection, rows)
+
+    def read(self, connection, namespace:str) -> dict:
+        """All comment lists of a namespace, keys: URLs | values: comment lists"""
+        rows = connection.execute('SELECT url, ids FROM comment_lists WHERE namespace = ?', (namespace,)).fetchall()
+        return self._decode(connection, rows)
+
+    def count(self, connection, namespace:str) -> int:
+        return connection.execute('SELECT COUNT(*) FROM comment_lists WHERE namespace = ?', (namespace,)).fetchone()[0]
+
+    def remove(self, connection, namespace:str, urls:list):
+        """Removes the comment lists of the given videos, the strings are kept"""
+        urls = list(urls)
+        for start in range(0, len(urls), LOOKUP_CHUNK):
+            chunk = urls[start:start + LOOKUP_CHUNK]
+            connection.execute(f'DELETE FROM comment_lists WHERE namespace = ? AND url IN ({",".join("?" * len(chunk))})',
+                               [namespace, *chunk])
+
+    def clear(self, connection, namespace:str):
+        """Removes the comment lists of a namespace, the strings are kept"""
+        connection.execute('DELETE FROM comment_lists WHERE namespace = ?', (namespace,))
+
+
+if __name__ == '__main__':
+    # rewrites the database so that its comments move into the store
+    import os
+    import time
+
+    from storage import DATABASE_PATH, get_storage
+
+    if not ScraperConfig.COMMENT_STORE:
+        sys.exit('ScraperConfig.COMMENT_STORE is off')
+    storage = get_storage()
+    start_time = time.time()
+    database = storage.read(DATABASE_PATH)
+    storage.write(DATABASE_PATH, database)
+    # give the pages freed by the inline comments back to the file system
+    sqlite_storage = storage.comment_db if hasattr(storage, 'comment_db') else storage
+    sqlite_storage._connection().execute('VACUUM')
+    storage.close()
+    print(f'Comments of {len(database)} records moved into the comment store in {time.time() - start_time:.2f} seconds')
+    for path in (DATABASE_PATH, ScraperConfig.COMMENT_STORE_PATH, ScraperConfig.SQLITE_PATH):
+        if os.path.exists(path):
+            print(f'{path}: {os.path.getsize(path) / 2 ** 20:.2f} MB')
@@ -0,0 +1,167 @@
+"""Adaptive (AIMD) concurrency control for the scrapers"""
+
+import collections
+import contextlib
+import threading
+import time
+
+from config import ScraperConfig
+
+# outcomes that signal we are being throttled or blocked
+BACKOFF_STATUSES = {403, 429, 'timeout'}
+
+
+class ConcurrencyController:
+    """
+    Additive-increase / multiplicative-decrease limit on requests in flight.
+
+    The limit grows by one after a full window of healthy responses and is
+    multiplied by decrease on 429/403/timeouts, at most once per cooldown.
+    A high share of parse failures in the recent window (blocked pages are
+    usually served with status 200) and latency far above the observed
+    baseline also back off. The request timeout follows the latency.
+    The controller is shared by threads and event loops of one process.
+
+    Parameters
+    ----------
+    initial : int
+        Initial limit.
+    min_limit : int
+        Lowest limit.
+    max_limit : int
+        Highest limit.
+    decrease : float, optional
+        Factor applied to the limit on backoff, by default 0.5
+    cooldown : float, optional
+        Minimum seconds between two backoffs, by default 2
+    window : int, optional
+        Number of recent outcomes used for the parse failure rate, by default 50
+    """
+
+    def __init__(self, initial:int, min_limit:int, max_limit:int,
+                 decrease:float=0.5, cooldown:float=2, window:int=50) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._in_flight = 0
+        self._successes = 0
+        self._last_backoff = 0
+        self._latency = None
+        self._baseline = None
+        self._recent = collections.deque(maxlen=window)
+        self._condition = threading.Condition()
+        self.counts = collections.Counter()
+
+    @classmethod
+    def from_config(cls):
+        """Creates a controller with the limits of ScraperConfig"""
+        return cls(ScraperConfig.ADAPTIVE_INITIAL_CONCURRENCY,
+                   ScraperConfig.ADAPTIVE_MIN_CONCURRENCY,
+                   ScraperConfig.ADAPTIVE_MAX_CONCURRENCY)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def request_timeout(self) -> float:
+        """Request timeout in seconds derived from the smoothed latency"""
+        if self._latency is None:
+            return ScraperConfig.ADAPTIVE_MAX_TIMEOUT
+        return min(max(4 * self._latency, ScraperConfig.ADAPTIVE_MIN_TIMEOUT), ScraperConfig.ADAPTIVE_MAX_TIMEOUT)
+
+    def _try_acquire(self) -> bool:
+        with self._condition:
+            if self._in_flight < self.limit:
+                self._in_flight += 1
+                return True
+            return False
+
+    def _release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Blocks the calling thread until a request may be sent"""
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait(timeout=0.1)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    @contextlib.asynccontextmanager
+    async def async_slot(self):
+        """Waits without blocking the event loop until a request may be sent"""
+        # asyncio is imported by the async engine, not by every user of the controller
+        import asyncio
+
+        while not self._try_acquire():
+            await asyncio.sleep(0.01)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _backoff(self, now:float):
+        if now - self._last_backoff >= self.cooldown:
+            self._limit = max(self.min_limit, self._limit * self.decrease)
+            self._last_backoff = now
+            self._successes = 0
+
+    def record(self, outcome, latency:float=None):
+        """
+        Records the outcome of a single request.
+
+        Parameters
+        ----------
+        outcome : int | str
+            The HTTP status code, 'timeout' or 'error'.
+        latency : float, optional
+            Seconds from sending the request to the response, by default None
+        """
+        now = time.monotonic()
+        with self._condition:
+            self.counts[outcome] += 1
+            self._recent.append(outcome)
+            if outcome in BACKOFF_STATUSES:
+                self._backoff(now)
+                return
+            if not isinstance(outcome, int) or outcome >= 400:
+                return
+            if latency is not None:
+                self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+                self._baseline = latency if self._baseline is None else min(self._baseline * 1.01, latency)
+                if self._latency > ScraperConfig.ADAPTIVE_LATENCY_TOLERANCE * self._baseline:
+                    self._backoff(now)
+                    return
+            self._successes += 1
+            if self._successes >= self.limit:
+                self._limit = min(self.max_limit, self._limit + 1)
+                self._successes = 0
+            self._condition.notify_all()
+
+    def record_parse_failure(self):
+        """Records a response that could not be parsed"""
+        now = time.monotonic()
+        with self._condition:
+            self.counts['parse'] += 1
+            self._recent.append('parse')
+            failures = sum(1 for outcome in self._recent if outcome == 'parse')
+            if len(self._recent) >= 10 and failures / len(self._recent) > ScraperConfig.ADAPTIVE_PARSE_FAILURE_RATE:
+                self._backoff(now)
+
+    def snapshot(self) -> dict:
+        """Current state of the controller for the run log"""
+        with self._condition:
+            return {'limit': self.limit,
+                    'in_flight': self._in_flight,
+                    'latency': round(self._latency, 3) if self._latency is not None else None,
+                    'timeout': round(self.request_timeout, 1),
+                    'counts': {str(outcome): count for outcome, count in self.counts.items()}}
@@ -1,15 +1,13 @@
 """Configuration Settings for the App"""
 
-import multiprocessing
-
-from fake_useragent import UserAgent
-
-cpu_count = multiprocessing.cpu_count()
-ua = UserAgent()
+import os
 
 class ScraperConfig:
+    # site root, TIKTOK_BASE_URL points the scraper at another server (e.g. benchmarks/mock_server.py)
+    BASE_URL = os.environ.get('TIKTOK_BASE_URL', 'https://www.tiktok.com').rstrip('/')
+    
     # base url
-    URL = "https://www.tiktok.com/tag/"
+    URL = BASE_URL + "/tag/"
     
     # hashtags to scrap
     HASHTAGS = ['fashion', 'dress', 'trend', 'fashiontiktok', 'outfit', 'stylish'] 
@@ -17,23 +15,44 @@ class ScraperConfig:
     # tiktok video class tag
     VIDEO_TAG = 'css-x6y88p-DivItemContainerV2 e19c29qe8'
     
+    # video link extraction: 'incremental' runs a script in the page, 'page_source' parses VIDEO_TAG divs
+    LINK_EXTRACTION = 'incremental'
+    
     # number of urls to scrap at single run
     URL_SCRAP_COUNT = 100
     
-    # user agent header
-    HEADERS = {'User-Agent': ua.random}
+    # extra request headers, the User-Agent header is picked from the user agent pool unless it is set here
+    HEADERS = {}
+    
+    # user agents of the requests and the Chrome drivers, drawn once from the fake_useragent data
+    USER_AGENT_POOL_PATH = 'data/user_agents.json'
+    
+    # number of user agents in the pool
+    USER_AGENT_POOL_SIZE = 50
     
     # number of comments to scrap at single run
     COMMENT_COUNT = 50
     
-    # metadata scrapper method: parallel or async
-    ASYNC_METADATA = True
+    # async comment scrapper: request comment pages of a video concurrently
+    PIPELINED_COMMENTS = True
     
-    # number of cores to use for parallel processes
-    CPU_COUNT = max(cpu_count - 4, 1)
+    # async comment scrapper: maximum number of comment pages in flight per video
+    COMMENT_PAGE_WINDOW = 4
     
-    # comment scrapper method: parallel or async
-    ASYNC_COMMENTS = True 
+    # metadata scrapper method: 'async', 'threaded' or 'parallel'
+    METADATA_MODE = 'async'
+    
+    # number of cores to use for parallel processes, SCRAPER_CPU_COUNT sets it per node
+    CPU_COUNT = int(os.environ.get('SCRAPER_CPU_COUNT', max((os.cpu_count() or 1) - 4, 1)))
+    
+    # comment scrapper method: 'async', 'threaded' or 'parallel'
+    COMMENTS_MODE = 'async'
+    
+    # number of threads for the threaded scrappers
+    THREAD_COUNT = 32
+    
+    # number of processes the threaded metadata scrapper parses pages on, 0 parses in the threads
+    PARSE_PROCESS_COUNT = 0
     
     # total urls to scrap
     TOTAL_SCRAP_COUNT = 600 
@@ -41,6 +60,21 @@ class ScraperConfig:
     # url scrapper timeout in seconds
     URL_SCRAPER_TIMEOUT = 60
     
+    # url scrapper: index of the video IDs in the database
+    URL_INDEX_PATH = 'data/url_index.bin'
+    
+    # url scrapper: index of the video IDs discovered in the current run
+    DISCOVERED_INDEX_PATH = 'data/discovered_index.bin'
+    
+    # url scrapper: keep Chrome drivers alive across runs
+    PERSISTENT_DRIVERS = True
+    
+    # url scrapper: hashtag pages a driver serves before it is restarted
+    DRIVER_MAX_PAGES = 20
+    
+    # url scrapper: memory of a driver in MB before it is restarted (needs psutil)
+    DRIVER_MAX_MEMORY_MB = 1500
+    
     # metadata scrapper timeout in seconds
     METADATA_SCRAPER_TIMEOUT = 40 
     
@@ -56,9 +90,227 @@ class ScraperConfig:
     # success rate threshold
     SUCCESS_RATE_THRESHOLD = 60
     
+    # adapt the concurrency of the async and threaded scrappers instead of switching scrapper methods
+    ADAPTIVE_CONCURRENCY = True
+    
+    # adaptive concurrency: requests in flight at start, lowest and highest
+    ADAPTIVE_INITIAL_CONCURRENCY = 8
+    ADAPTIVE_MIN_CONCURRENCY = 1
+    ADAPTIVE_MAX_CONCURRENCY = 64
+    
+    # adaptive concurrency: request timeout bounds in seconds
+    ADAPTIVE_MIN_TIMEOUT = 3
+    ADAPTIVE_MAX_TIMEOUT = 15
+    
+    # adaptive concurrency: back off when the latency exceeds this multiple of the best observed latency
+    ADAPTIVE_LATENCY_TOLERANCE = 3
+    
+    # adaptive concurrency: back off when this share of recent responses fail to parse
+    ADAPTIVE_PARSE_FAILURE_RATE = 0.5
+    
     # left over run count
     LEFT_OVER_RUN_COUNT = 3
     
+    # run mode: 'staged' runs discovery, metadata and comments one after another, 'pipelined' streams URLs through them
+    RUN_MODE = 'staged'
+    
+    # pipelined run: seconds between storing merged records
+    PIPELINE_FLUSH_INTERVAL = 2
+    
+    # pipelined run: number of merged records that triggers storing before the interval
+    PIPELINE_FLUSH_SIZE = 50
+    
+    # pipelined run: seconds to finish fetching after discovery ends
+    PIPELINE_DRAIN_TIMEOUT = 40
+    
+    # result storage for fetched batches: 'journal' appends, 'json' rewrites the file per result
+    RESULT_STORAGE = 'journal'
+    
+    # number of journal records between fsync calls
+    JOURNAL_FSYNC_EVERY = 50
+    
+    # number of journal records between compactions in the async scrapper
+    JOURNAL_COMPACT_EVERY = 500
+    
+    # storage backend for the database and fetched data: 'json' or 'sqlite'
+    STORAGE_BACKEND = 'json'
+    
+    # keep the fetched data across restarts and resume an interrupted run from its checkpoint,
+    # False resets the fetched data on every start
+    RESUME = True
+    
+    # checkpoint of the scrap loop, removed when a run finishes
+    CHECKPOINT_PATH = 'data/checkpoint.json'
+    
+    # sqlite database file
+    SQLITE_PATH = 'data/database.sqlite'
+    
+    # number of fetched results per sqlite transaction
+    SQLITE_BATCH_SIZE = 100
+    
+    # async scrapper: number of workers and connections in flight
+    ASYNC_CONCURRENCY = 64
+    
+    # async scrapper: connections in flight per host
+    ASYNC_PER_HOST_CONCURRENCY = 32
+    
+    # async scrapper: DNS cache TTL in seconds
+    ASYNC_DNS_CACHE_TTL = 300
+    
+    # async scrapper: keep-alive of idle connections in seconds
+    ASYNC_KEEPALIVE_TIMEOUT = 30
+    
+    # shared token-bucket rate limiting of requests and page scrolls,
+    # replaces the fixed breaks between methods, runs, retries and scrolls
+    RATE_LIMITING = True
+    
+    # file holding the token buckets shared by every process
+    RATE_LIMIT_PATH = 'data/rate_limits.bin'
+    
+    # keys: endpoints | values: (requests per second, burst)
+    RATE_LIMITS = {'video': (10, 20), 'comments': (10, 20), 'scroll': (2, 6)}
+    
+    # attempts per URL and stage before it is dropped for the run, failed URLs wait in a
+    # delay queue while the workers go on with other URLs
+    RETRY_MAX_ATTEMPTS = 5
+    
+    # keys: failure kinds | values: backoff of the first retry in seconds, doubled per attempt with jitter,
+    # client errors (4xx other than 403/429) are not retried
+    RETRY_BASE_DELAYS = {'network': 0.5, 'server': 0.25, 'parse': 0.25, 'blocked': 2}
+    
+    # longest backoff in seconds
+    RETRY_MAX_DELAY = 60
+    
+    # seconds idle workers wait before looking at the delay queue again
+    RETRY_POLL_INTERVAL = 0.05
+    
+    # pause the requests to an endpoint during storms of blocked (403/429) responses
+    CIRCUIT_BREAKER = True
+    
+    # blocked responses within CIRCUIT_BREAKER_WINDOW seconds that open the circuit of an endpoint
+    CIRCUIT_BREAKER_THRESHOLD = 10
+    CIRCUIT_BREAKER_WINDOW = 30
+    
+    # seconds an open circuit pauses requests before a single probe request is let through,
+    # doubled with jitter up to CIRCUIT_BREAKER_MAX_COOLDOWN every time the probe is blocked too
+    CIRCUIT_BREAKER_COOLDOWN = 2
+    CIRCUIT_BREAKER_MAX_COOLDOWN = 120
+    
+    # on-disk cache of video pages and comment pages shared by every engine
+    RESPONSE_CACHE = True
+    
+    # response cache directory
+    RESPONSE_CACHE_DIR = 'data/http_cache'
+    
+    # size of the cached bodies in MB before least recently used entries are evicted
+    RESPONSE_CACHE_MAX_MB = 1024
+    
+    # keys: endpoints | values: seconds a cached response is used without revalidation
+    RESPONSE_CACHE_TTL = {'video': 6 * 3600, 'comments': 3600}
+    
+    # refresh the stats of known videos between scraper runs
+    REFRESH_STATS = True
+    
+    # share of the video page requests of a run spent on stats refreshes
+    REFRESH_SHARE = 0.25
+    
+    # minimum number of stats refreshes per run, used when few new URLs are found
+    REFRESH_MIN_BUDGET = 20
+    
+    # refresh interval in seconds of a day old video that does not grow,
+    # older videos are refreshed less often and growing videos more often
+    REFRESH_BASE_INTERVAL = 6 * 3600
+    
+    # bounds of the refresh interval in seconds
+    REFRESH_MIN_INTERVAL = 3600
+    REFRESH_MAX_INTERVAL = 7 * 24 * 3600
+    
+    # directory of the database exports
+    EXPORT_DIR = 'exports'
+    
+    # number of records read from the database per exported chunk
+    EXPORT_CHUNK_SIZE = 5000
+    
+    # serve Prometheus metrics on /metrics and the scrap loop status on /status
+    METRICS_SERVER = True
+    
+    # port of the metrics server, exposed by the Dockerfile
+    METRICS_PORT = 8000
+    
+    # interface of the metrics server, the Dockerfile sets '0.0.0.0' so that the exposed port reaches it
+    METRICS_HOST = os.environ.get('SCRAPER_METRICS_HOST', '127.0.0.1')
+    
+    # keep comments as interned strings in compressed blocks and an ID array per video
+    COMMENT_STORE = True
+    
+    # SQLite file of the comment store of the JSON backend, the SQLite backend uses SQLITE_PATH
+    COMMENT_STORE_PATH = 'data/comments.sqlite'
+    
+    # distinct comments per compressed block of the string table
+    COMMENT_BLOCK_STRINGS = 4096
+    
+    # zstd level of the string blocks
+    COMMENT_ZSTD_LEVEL = 10
+    
+    # decompressed string blocks kept in memory for per-video reads
+    COMMENT_BLOCK_CACHE = 32
+    
+    # distributed mode: host:port of the coordinator, None makes workers use the queue file directly
+    COORDINATOR_ADDRESS = os.environ.get('SCRAPER_COORDINATOR')
+    
+    # distributed mode: TCP port the coordinator serves the queue on
+    COORDINATOR_PORT = 8100
+    
+    # distributed mode: interface the coordinator serves the queue on, e.g. '0.0.0.0' for worker nodes on other hosts
+    COORDINATOR_HOST = os.environ.get('SCRAPER_COORDINATOR_HOST', '127.0.0.1')
+    
+    # distributed mode: shared secret of the coordinator and the workers, required to serve the queue beyond localhost
+    COORDINATOR_TOKEN = os.environ.get('SCRAPER_COORDINATOR_TOKEN')
+    
+    # distributed mode: SQLite file of the work queue and of the coordinated videos
+    QUEUE_PATH = 'data/queue.sqlite'
+    
+    # distributed mode: seconds a task is leased for, workers extend it while they work
+    LEASE_TIMEOUT = 120
+    
+    # distributed mode: times a task is leased, and a video is batched, before it is dropped
+    TASK_MAX_ATTEMPTS = 3
+    
+    # distributed mode: number of shards the video IDs are split into
+    SHARD_COUNT = 16
+    
+    # distributed mode: videos per fetch batch, a batch holds videos of one shard
+    FETCH_BATCH_SIZE = 50
+    
+    # tag the language of every comment of merged records as 'Comment Languages'
+    COMMENT_LANGUAGES = True
+    
+    # keep only the English comments of merged records
+    ENGLISH_COMMENTS_ONLY = False
+    
+    # processes of the language detection pool, 0 detects in the scraper process
+    LANGUAGE_PROCESS_COUNT = CPU_COUNT
+    
+    # comments missing the cache below which a batch is detected in the scraper process
+    LANGUAGE_POOL_MIN_BATCH = 500
+    
+    # comments with fewer letters are not detected, e.g. emoji-only comments
+    LANGUAGE_MIN_LETTERS = 4
+    
+    # number of normalized comments whose language is cached
+    LANGUAGE_CACHE_SIZE = 100_000
+    
+    # seed of langdetect, fixed so that the tags are deterministic
+    LANGUAGE_SEED = 0
+    
+    # profile every stage and worker process with cProfile and tracemalloc
+    PROFILING = False
+    
+    # directory of the profiles, one subdirectory per run
+    PROFILE_DIR = 'profiles'
     
+    # frames kept per traced allocation, more frames cost more memory and time
+    PROFILE_TRACEMALLOC_FRAMES = 1
     
-    
\ No newline at end of file
+    # number of functions and allocation sites in the profile reports
+    PROFILE_TOP = 25
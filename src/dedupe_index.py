@@ -0,0 +1,178 @@
+"""Compact set of 64-bit video IDs shared between processes through a memory-mapped file"""
+
+import mmap
+import os
+import struct
+
+MAGIC = b'VIDINDEX'
+HEADER = struct.Struct('<8sQQ')
+HEADER_SIZE = 64
+MAX_LOAD = 0.7
+EMPTY = 0
+
+
+def _capacity_for(count:int) -> int:
+    """Smallest power of two that keeps count entries under MAX_LOAD"""
+    capacity = 1024
+    while capacity * MAX_LOAD < count:
+        capacity *= 2
+    return capacity
+
+
+class VideoIdIndex:
+    """
+    Open-addressing hash set of numeric video IDs stored in a memory-mapped file.
+    Every slot is a uint64, so 10M IDs take 128MB instead of a list of URL strings,
+    and membership checks are O(1) reads of the shared mapping without any proxy.
+
+    The object pickles to its path only; each process maps the file on first use.
+    Reads need no lock. Concurrent add calls must be serialized by the caller.
+
+    Parameters
+    ----------
+    path : str
+        The index file, created with VideoIdIndex.create.
+    """
+
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self._file = None
+        self._mmap = None
+        self._slots = None
+        self._pid = None
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    @classmethod
+    def create(cls, path:str, video_ids, capacity:int=None):
+        """
+        Creates (or replaces) an index file holding the given IDs.
+
+        Parameters
+        ----------
+        path : str
+            The index file.
+        video_ids : iterable of int
+            IDs to insert, None values are skipped.
+        capacity : int, optional
+            Number of IDs the index should hold without growing,
+            by default the number of given IDs
+
+        Returns
+        -------
+        VideoIdIndex
+        """
+        video_ids = [i for i in video_ids if i]
+        slot_count = _capacity_for(max(capacity or 0, len(video_ids)))
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, slot_count, 0).ljust(HEADER_SIZE, b'\0'))
+            file.truncate(HEADER_SIZE + slot_count * 8)
+        os.replace(temp_path, path)
+        index = cls(path)
+        for video_id in video_ids:
+            index.add(video_id)
+        return index
+
+    def _map(self):
+        """Maps the file in the current process"""
+        if self._mmap is None or self._pid != os.getpid():
+            self._file = open(self.path, 'r+b')
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+            magic, capacity, _ = HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                raise ValueError(f'{self.path} is not a video ID index')
+            self._slots = memoryview(self._mmap)[HEADER_SIZE:HEADER_SIZE + capacity * 8].cast('Q')
+            self._pid = os.getpid()
+        return self._slots
+
+    def close(self):
+        """Unmaps the file in the current process"""
+        if self._mmap is not None and self._pid == os.getpid():
+            self._slots.release()
+            self._mmap.close()
+            self._file.close()
+        self._file = None
+        self._mmap = None
+        self._slots = None
+        self._pid = None
+
+    @property
+    def capacity(self) -> int:
+        return len(self._map())
+
+    def __len__(self) -> int:
+        self._map()
+        return HEADER.unpack_from(self._mmap, 0)[2]
+
+    def _probe(self, slots, video_id:int) -> int:
+        """Returns the slot holding video_id, or the empty slot where it belongs"""
+        mask = len(slots) - 1
+        shift = 64 - mask.bit_length()
+        position = ((video_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> shift
+        while True:
+            value = slots[position]
+            if value == video_id or value == EMPTY:
+                return position
+            position = (position + 1) & mask
+
+    def __contains__(self, video_id) -> bool:
+        if not video_id:
+            return False
+        slots = self._map()
+        return slots[self._probe(slots, video_id)] == video_id
+
+    def add(self, video_id:int) -> bool:
+        """
+        Adds a video ID.
+
+        Parameters
+        ----------
+        video_id : int
+
+        Returns
+        -------
+        bool
+            True if the ID was not in the index yet.
+
+        Raises
+        ------
+        OverflowError
+            If the index is full, call grow first.
+        """
+        if not video_id:
+            return False
+        slots = self._map()
+        position = self._probe(slots, video_id)
+        if slots[position] == video_id:
+            return False
+        count = len(self)
+        if count + 1 >= len(slots):
+            raise OverflowError(f'{self.path} is full')
+        slots[position] = video_id
+        HEADER.pack_into(self._mmap, 0, MAGIC, len(slots), count + 1)
+        return True
+
+    def grow(self, extra:int):
+        """
+        Makes room for extra more IDs, rebuilding the file if needed.
+        Must not run while other processes use the index.
+
+        Parameters
+        ----------
+        extra : int
+            Number of IDs about to be added.
+        """
+        needed = len(self) + extra
+        if needed <= self.capacity * MAX_LOAD:
+            return
+        video_ids = [value for value in self._map() if value != EMPTY]
+        self.close()
+        VideoIdIndex.create(self.path, video_ids, capacity=needed).close()
@@ -0,0 +1,392 @@
+"""Distributed mode: a coordinator hands discovery and fetch work to worker nodes
+
+The coordinator queues a discovery task per hashtag, shards the discovered
+videos by video ID and queues them in fetch batches of one shard, and stores
+the merged records the workers report back. Workers lease tasks from the
+coordinator over TCP, or from the queue file when they share its file system:
+    SCRAPER_COORDINATOR_TOKEN=<secret> python3 src/distributed.py coordinator --host 0.0.0.0
+    SCRAPER_COORDINATOR_TOKEN=<secret> python3 src/distributed.py worker --coordinator 10.0.0.5:8100
+A worker scrapes in its own working directory (--directory), which holds its
+scratch fetched data, response cache and rate limits, so several workers can
+run on one machine. Sharding keeps a video in a single batch across nodes;
+--shards pins a worker to shards so retries hit its response cache.
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+from concurrency import ConcurrencyController
+from config import ScraperConfig
+from driver_pool import DriverPool
+from metrics import set_status, start_server
+from storage import (COMMENTS_PATH, FULL_DATA_PATH, METADATA_PATH, get_storage,
+                     video_id)
+from work_queue import QueueServer, WorkQueue, get_queue
+
+
+def shard_of(url:str) -> int:
+    """Shard of a video URL, by its video ID"""
+    return (video_id(url) or 0) % ScraperConfig.SHARD_COUNT
+
+
+class Coordinator:
+    """
+    Plans the work of the worker nodes and stores their results.
+
+    Videos are kept in the queue file with their shard and state
+    (new, queued, done or dropped), so a restarted coordinator goes on where
+    it stopped. A video is fetched up to ScraperConfig.TASK_MAX_ATTEMPTS times.
+
+    Parameters
+    ----------
+    queue : WorkQueue, optional
+        by default the queue at ScraperConfig.QUEUE_PATH
+    """
+
+    def __init__(self, queue:WorkQueue=None) -> None:
+        self.queue = queue or WorkQueue()
+        self.storage = get_storage()
+        # the records of the run are kept, like the videos of the queue
+        self.storage.initialize([])
+        # tags the comment languages of the stored records, as the scraper does
+        self.language_tagger = None
+        if ScraperConfig.COMMENT_LANGUAGES:
+            from language import LanguageTagger
+            self.language_tagger = LanguageTagger()
+        self.rounds = 0
+        self.round_videos = 0
+        with self.queue.transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS videos ('
+                               'video_id INTEGER PRIMARY KEY, url TEXT NOT NULL, shard INTEGER NOT NULL, '
+                               'state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)')
+            connection.execute('CREATE INDEX IF NOT EXISTS videos_state ON videos (state, shard)')
+
+    def video_counts(self) -> dict:
+        """keys: video states | values: number of videos"""
+        return dict(self.queue._connection().execute('SELECT state, COUNT(*) FROM videos GROUP BY state'))
+
+    def outstanding(self, kind:str) -> int:
+        """Number of pending and leased tasks of a kind"""
+        counts = self.queue.counts().get(kind, {})
+        return counts.get('pending', 0) + counts.get('leased', 0)
+
+    def seed(self):
+        """Queues a discovery round, a task per hashtag"""
+        self.rounds += 1
+        self.round_videos = 0
+        self.queue.add('discover', [{'hashtag': hashtag, 'round': self.rounds} for hashtag in ScraperConfig.HASHTAGS])
+
+    def add_videos(self, urls:list) -> int:
+        """Adds discovered videos that are neither known nor in the database, returns their number"""
+        urls = self.storage.filter_new([url for url in dict.fromkeys(urls) if video_id(url)])
+        with self.queue.transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO videos (video_id, url, shard, state) VALUES (?, ?, ?, 'new')",
+                                   [(video_id(url), url, shard_of(url)) for url in urls])
+            added = connection.total_changes - before
+        self.round_videos += added
+        return added
+
+    def store(self, records:dict, missing:list):
+        """Stores merged records and puts the missing videos back for another batch"""
+        if records:
+            if self.language_tagger is not None:
+                self.language_tagger.tag_records(records)
+            self.storage.update_database(records)
+            self.storage.append(FULL_DATA_PATH, records)
+        with self.queue.transaction() as connection:
+            connection.executemany("UPDATE videos SET state = 'done' WHERE video_id = ?",
+                                   [(video_id(url),) for url in records])
+            connection.executemany("UPDATE videos SET state = CASE WHEN attempts >= ? THEN 'dropped' ELSE 'new' END "
+                                   'WHERE video_id = ?',
+                                   [(ScraperConfig.TASK_MAX_ATTEMPTS, video_id(url)) for url in missing])
+
+    def ingest(self) -> int:
+        """Takes in the finished tasks, returns their number"""
+        tasks = self.queue.finished()
+        for task in tasks:
+            result = task['result'] or {}
+            if task['kind'] == 'discover' and task['state'] == 'done':
+                self.add_videos(result.get('urls', []))
+            elif task['kind'] == 'fetch':
+                records = result.get('records', {}) if task['state'] == 'done' else {}
+                self.store(records, [url for url in task['payload']['urls'] if url not in records])
+        self.queue.mark_ingested([task['id'] for task in tasks])
+        return len(tasks)
+
+    def plan(self, flush:bool=False) -> int:
+        """
+        Queues the new videos in fetch batches of ScraperConfig.FETCH_BATCH_SIZE
+        videos of one shard.
+
+        Parameters
+        ----------
+        flush : bool, optional
+            If True, shards with fewer new videos than a batch are queued too
+
+        Returns
+        -------
+        int
+            Number of batches queued.
+        """
+        connection = self.queue._connection()
+        shards = {}
+        for shard, url in connection.execute("SELECT shard, url FROM videos WHERE state = 'new' ORDER BY shard, video_id"):
+            shards.setdefault(shard, []).append(url)
+        batches = 0
+        size = ScraperConfig.FETCH_BATCH_SIZE
+        for shard, urls in shards.items():
+            cut = len(urls) if flush else len(urls) - len(urls) % size
+            for start in range(0, cut, size):
+                batch = urls[start:start + size]
+                with self.queue.transaction() as connection:
+                    self.queue.insert(connection, 'fetch', {'urls': batch}, shard)
+                    connection.executemany("UPDATE videos SET state = 'queued', attempts = attempts + 1 WHERE video_id = ?",
+                                           [(video_id(url),) for url in batch])
+                batches += 1
+        return batches
+
+    def run(self, port:int=None, poll_interval:float=1, host:str=None):
+        """
+        Coordinates the workers until ScraperConfig.TOTAL_SCRAP_COUNT records are
+        stored or a discovery round finds no new videos.
+
+        Parameters
+        ----------
+        port : int, optional
+            TCP port the queue is served on, 0 serves no TCP,
+            by default ScraperConfig.COORDINATOR_PORT
+        poll_interval : float, optional
+            Seconds between two looks at the queue, by default 1
+        host : str, optional
+            Interface the queue is served on, by default ScraperConfig.COORDINATOR_HOST
+        """
+        server = None
+        if port != 0:
+            server = QueueServer(self.queue, port, host).start()
+            print(f'Coordinator listening on {server.server_address[0]}:{server.server_address[1]}')
+        start_time = time.time()
+        try:
+            while True:
+                self.ingest()
+                discovering = self.outstanding('discover')
+                self.plan(flush=not discovering)
+                videos = self.video_counts()
+                set_status(stage='distributed', round=self.rounds, videos=videos, tasks=self.queue.counts())
+                if videos.get('done', 0) >= ScraperConfig.TOTAL_SCRAP_COUNT:
+                    self.queue.cancel()
+                    break
+                if not discovering and not self.outstanding('fetch') and not videos.get('new'):
+                    if self.rounds and not self.round_videos:
+                        print('A discovery round found no new videos')
+                        break
+                    self.seed()
+                time.sleep(poll_interval)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        videos = self.video_counts()
+        print(f'{videos.get("done", 0)} videos stored, {videos.get("dropped", 0)} dropped, '
+              f'{self.rounds} discovery rounds in {time.time() - start_time:.2f} seconds')
+
+    def close(self):
+        if self.language_tagger is not None:
+            self.language_tagger.close()
+        self.storage.close()
+
+
+class Worker:
+    """
+    Leases tasks and reports their results. Discovery runs a Chrome driver
+    on the hashtag page, fetch batches run the async metadata and comment
+    scrappers into the scratch fetched data of the node and report the
+    videos that have both as merged records.
+
+    Parameters
+    ----------
+    queue : WorkQueue | QueueClient, optional
+        by default work_queue.get_queue()
+    name : str, optional
+        by default <host>-<pid>
+    kinds : list, optional
+        Kinds of tasks taken, by default all
+    shards : list, optional
+        Shards taken, by default all
+    """
+
+    def __init__(self, queue=None, name:str=None, kinds:list=None, shards:list=None) -> None:
+        self.queue = queue or get_queue()
+        self.name = name or f'{socket.gethostname()}-{os.getpid()}'
+        self.kinds = kinds
+        self.shards = shards
+        self.storage = get_storage()
+        self.storage.initialize()
+        self.metadata_controller = None
+        self.comments_controller = None
+        if ScraperConfig.ADAPTIVE_CONCURRENCY:
+            self.metadata_controller = ConcurrencyController.from_config()
+            self.comments_controller = ConcurrencyController.from_config()
+        self.driver_pool = None
+        self.completed = 0
+
+    def _heartbeat(self, task:dict, done:threading.Event):
+        """Extends the lease of a task until it is done"""
+        while not done.wait(ScraperConfig.LEASE_TIMEOUT / 3):
+            try:
+                if not self.queue.extend(task['id'], task['token']):
+                    print(f'{self.name} lost the lease of task {task["id"]}')
+                    return
+            except (OSError, RuntimeError) as e:
+                print(f'{self.name} could not extend task {task["id"]}: {e}')
+
+    def discover(self, hashtag:str) -> dict:
+        """New video URLs of a hashtag, until URL_SCRAP_COUNT or URL_SCRAPER_TIMEOUT"""
+        # fetch-only workers never load selenium
+        from url_processor import fetch_video_urls
+
+        if self.driver_pool is None and ScraperConfig.PERSISTENT_DRIVERS:
+            self.driver_pool = DriverPool(size=1)
+        urls = []
+        stop_signal = SimpleNamespace(value=False)
+
+        def run():
+            # the coordinator checks the URLs against the database
+            if self.driver_pool is None:
+                fetch_video_urls(ScraperConfig.URL + hashtag, [], urls, threading.Lock(), stop_signal)
+                return
+            with self.driver_pool.driver() as driver:
+                fetch_video_urls(ScraperConfig.URL + hashtag, [], urls, threading.Lock(), stop_signal, driver)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(ScraperConfig.URL_SCRAPER_TIMEOUT)
+        stop_signal.value = True
+        thread.join()
+        return {'urls': list(urls)}
+
+    def fetch(self, urls:list) -> dict:
+        """Merged records of a batch of videos and the videos missing metadata or comments"""
+        from async_video_processor import (AsyncProcessComments,
+                                           AsyncProcessMetaData)
+
+        self.storage.initialize()
+        AsyncProcessMetaData(urls, self.metadata_controller).get_metadata()
+        metadata = self.storage.read(METADATA_PATH)
+        comment_counts = {url: metadata[url].get('Comment Count') for url in urls if url in metadata}
+        AsyncProcessComments(urls, comment_counts, self.comments_controller).get_comments()
+        comments = self.storage.read(COMMENTS_PATH)
+        records = {}
+        for url in urls:
+            if url in metadata and url in comments:
+                records[url] = metadata[url] | {'Comments': comments[url]}
+        return {'records': records, 'missing': [url for url in urls if url not in records]}
+
+    def work(self, task:dict):
+        """Runs a leased task and reports its result"""
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(task, done), daemon=True).start()
+        try:
+            if task['kind'] == 'discover':
+                result = self.discover(task['payload']['hashtag'])
+            else:
+                result = self.fetch(task['payload']['urls'])
+        except Exception as e:
+            result = None
+            error = f'{type(e).__name__}: {e}'
+            print(f'{self.name} failed task {task["id"]}: {error}')
+        finally:
+            done.set()
+        # a report that does not get through leaves the task to its lease timeout
+        try:
+            if result is None:
+                self.queue.fail(task['id'], task['token'], error)
+            elif self.queue.complete(task['id'], task['token'], result):
+                self.completed += 1
+            else:
+                print(f'{self.name} dropped the result of task {task["id"]}, its lease was lost')
+        except (OSError, RuntimeError) as e:
+            print(f'{self.name} could not report task {task["id"]}: {e}')
+
+    def run(self, idle_timeout:float=None, poll_interval:float=1):
+        """
+        Works on leased tasks.
+
+        Parameters
+        ----------
+        idle_timeout : float, optional
+            Seconds without a task after which the worker stops, by default it never stops
+        poll_interval : float, optional
+            Seconds between two lease attempts while the queue is empty, by default 1
+        """
+        idle_since = time.monotonic()
+        try:
+            while True:
+                try:
+                    task = self.queue.lease(self.name, self.kinds, self.shards)
+                except (OSError, RuntimeError) as e:
+                    print(f'{self.name} could not reach the coordinator: {e}')
+                    task = None
+                if task is None:
+                    if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+                self.work(task)
+                idle_since = time.monotonic()
+        finally:
+            print(f'{self.name} completed {self.completed} tasks')
+
+    def close(self):
+        if self.driver_pool is not None:
+            self.driver_pool.close()
+        self.storage.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Distributed scraper: a coordinator and worker nodes')
+    parser.add_argument('role', choices=('coordinator', 'worker'))
+    parser.add_argument('--port', type=int, help='coordinator: TCP port, 0 for none (workers use the queue file)')
+    parser.add_argument('--host', help='coordinator: interface to serve on, e.g. 0.0.0.0 (requires SCRAPER_COORDINATOR_TOKEN)')
+    parser.add_argument('--queue', help='SQLite queue file')
+    parser.add_argument('--coordinator', help='worker: host:port of the coordinator')
+    parser.add_argument('--directory', help='worker: working directory of its scratch data')
+    parser.add_argument('--name', help='worker: node name')
+    parser.add_argument('--kinds', help='worker: comma separated task kinds, discover and/or fetch')
+    parser.add_argument('--shards', help='worker: comma separated shards')
+    parser.add_argument('--idle-timeout', type=float, help='worker: seconds without a task before stopping')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    # workers change their working directory
+    ScraperConfig.QUEUE_PATH = os.path.abspath(options.queue or ScraperConfig.QUEUE_PATH)
+    if options.role == 'coordinator':
+        if ScraperConfig.METRICS_SERVER:
+            start_server()
+        coordinator = Coordinator()
+        try:
+            coordinator.run(options.port, host=options.host)
+        finally:
+            coordinator.close()
+        return
+    if options.coordinator:
+        ScraperConfig.COORDINATOR_ADDRESS = options.coordinator
+    if options.directory:
+        os.makedirs(options.directory, exist_ok=True)
+        os.chdir(options.directory)
+    worker = Worker(name=options.name,
+                    kinds=options.kinds.split(',') if options.kinds else None,
+                    shards=[int(shard) for shard in options.shards.split(',')] if options.shards else None)
+    try:
+        worker.run(options.idle_timeout)
+    finally:
+        worker.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Long-lived pool of Chrome drivers for URL discovery"""
+
+import contextlib
+import queue
+import threading
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from config import ScraperConfig
+
+
+class DriverPool:
+    """
+    Keeps Chrome drivers alive across URL-discovery runs. A driver is
+    health-checked when it is borrowed and recycled after max_pages hashtag
+    pages or when Chrome exceeds max_memory_mb (requires psutil).
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of drivers alive at the same time.
+    max_pages : int, optional
+        Pages a driver serves before it is recycled, by default ScraperConfig.DRIVER_MAX_PAGES
+    max_memory_mb : int, optional
+        Memory of a driver's process tree in MB before it is recycled,
+        by default ScraperConfig.DRIVER_MAX_MEMORY_MB
+    """
+
+    def __init__(self, size:int, max_pages:int=None, max_memory_mb:int=None) -> None:
+        self.size = size
+        self.max_pages = max_pages or ScraperConfig.DRIVER_MAX_PAGES
+        self.max_memory_mb = max_memory_mb or ScraperConfig.DRIVER_MAX_MEMORY_MB
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._drivers = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create(self):
+        """Starts a new driver"""
+        from url_processor import create_driver
+        driver = create_driver()
+        with self._lock:
+            self._drivers[id(driver)] = [driver, 0]
+        return driver
+
+    def _quit(self, driver):
+        """Quits a driver and forgets it"""
+        with self._lock:
+            self._drivers.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _is_healthy(self, driver) -> bool:
+        """Checks that the browser still answers commands"""
+        try:
+            driver.execute_script('return 1')
+            return True
+        except Exception:
+            return False
+
+    def _memory_mb(self, driver) -> float:
+        """Resident memory of chromedriver and its Chrome processes in MB, 0 without psutil"""
+        if psutil is None:
+            return 0
+        try:
+            root = psutil.Process(driver.service.process.pid)
+            processes = [root] + root.children(recursive=True)
+            return sum(process.memory_info().rss for process in processes) / 2 ** 20
+        except (psutil.Error, AttributeError):
+            return 0
+
+    def _should_recycle(self, driver) -> bool:
+        """True if the driver served too many pages or uses too much memory"""
+        with self._lock:
+            pages = self._drivers.get(id(driver), [None, self.max_pages])[1]
+        return pages >= self.max_pages or self._memory_mb(driver) > self.max_memory_mb
+
+    @contextlib.contextmanager
+    def driver(self):
+        """
+        Borrows a healthy driver and returns it to the pool afterwards.
+
+        Yields
+        ------
+        selenium.webdriver.Chrome
+        """
+        if self._closed:
+            raise RuntimeError('driver pool is closed')
+        self._slots.acquire()
+        driver = None
+        try:
+            while driver is None:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    driver = self._create()
+                    break
+                if not self._is_healthy(driver):
+                    self._quit(driver)
+                    driver = None
+            yield driver
+        finally:
+            if driver is not None:
+                with self._lock:
+                    if id(driver) in self._drivers:
+                        self._drivers[id(driver)][1] += 1
+                if self._closed or self._should_recycle(driver):
+                    self._quit(driver)
+                else:
+                    self._idle.put(driver)
+            self._slots.release()
+
+    def close(self):
+        """Quits every driver, idle or borrowed"""
+        self._closed = True
+        with self._lock:
+            drivers = [driver for driver, _ in self._drivers.values()]
+        for driver in drivers:
+            self._quit(driver)
+        while not self._idle.empty():
+            self._idle.get_nowait()
@@ -0,0 +1,251 @@
+"""Streaming export of the database to Parquet, Arrow IPC and CSV"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from config import ScraperConfig
+from storage import get_storage, video_id
+
+COUNT_FIELDS = ('Views', 'Likes', 'Saved', 'Comment Count', 'Share Count')
+DATE_FIELDS = ('Date posted', 'Date Collected')
+RECORD_COLUMNS = ('Video ID', 'URL', 'Account', *COUNT_FIELDS, 'Caption', 'Hashtags', *DATE_FIELDS)
+COMMENT_COLUMNS = ('Video ID', 'URL', 'Position', 'Comment', 'Language')
+FORMATS = ('parquet', 'arrow', 'csv')
+
+
+def _count(value):
+    """Count as int, None if it is missing or not a number"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _date(value):
+    """'mm/dd/YYYY' as a date, None if it is missing or malformed"""
+    try:
+        return datetime.strptime(value, '%m/%d/%Y').date()
+    except (TypeError, ValueError):
+        return None
+
+def record_row(url:str, record:dict) -> dict:
+    """
+    Converts a database record to a typed row of the records table.
+
+    Parameters
+    ----------
+    url : str
+        The video URL.
+    record : dict
+        The metadata + comments of the video.
+
+    Returns
+    -------
+    dict
+        keys: RECORD_COLUMNS, counts as int, dates as date and hashtags as a list.
+    """
+    row = {'Video ID': video_id(url), 'URL': url, 'Account': record.get('Account'), 'Caption': record.get('Caption')}
+    for field in COUNT_FIELDS:
+        row[field] = _count(record.get(field))
+    for field in DATE_FIELDS:
+        row[field] = _date(record.get(field))
+    row['Hashtags'] = (record.get('Hashtags') or '').split()
+    return row
+
+def comment_rows(url:str, record:dict) -> list:
+    """
+    Converts the comments of a database record to rows of the comments long table.
+
+    Parameters
+    ----------
+    url : str
+        The video URL.
+    record : dict
+        The metadata + comments of the video.
+
+    Returns
+    -------
+    list
+        dicts with the keys COMMENT_COLUMNS, one per comment. Language is None
+        for records stored before comment languages were tagged.
+    """
+    identifier = video_id(url)
+    comments = record.get('Comments') or []
+    languages = record.get('Comment Languages') or [None] * len(comments)
+    return [{'Video ID': identifier, 'URL': url, 'Position': position, 'Comment': comment, 'Language': language}
+            for position, (comment, language) in enumerate(zip(comments, languages))]
+
+
+def _schemas():
+    """Arrow schemas of the records and comments tables"""
+    records = pa.schema([('Video ID', pa.int64()), ('URL', pa.string()), ('Account', pa.string()),
+                         *[(field, pa.int64()) for field in COUNT_FIELDS],
+                         ('Caption', pa.string()), ('Hashtags', pa.list_(pa.string())),
+                         *[(field, pa.date32()) for field in DATE_FIELDS]])
+    comments = pa.schema([('Video ID', pa.int64()), ('URL', pa.string()),
+                          ('Position', pa.int32()), ('Comment', pa.string()), ('Language', pa.string())])
+    return records, comments
+
+
+class ArrowExporter:
+    """
+    Writes each export as new part files of the records and comments datasets,
+    directory/records/part-<time>-<id>.<format> and directory/comments/part-<time>-<id>.<format>,
+    one row group or record batch per chunk. Part files are never overwritten. Each dataset directory loads at once with
+    pyarrow.dataset or pandas.read_parquet. Requires pyarrow.
+
+    Parameters
+    ----------
+    directory : str
+        The export directory.
+    format : str
+        'parquet' or 'arrow' (Arrow IPC file).
+    """
+
+    def __init__(self, directory:str, format:str) -> None:
+        if pa is None:
+            raise ImportError(f'pyarrow is required for the {format} export')
+        self.format = format
+        self.schemas = dict(zip(('records', 'comments'), _schemas()))
+        self.paths = {}
+        self.writers = {}
+        self.files = []
+        # the time orders the parts, the ID keeps exports within the same second apart
+        part = f'part-{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex}.{format}'
+        for table in self.schemas:
+            os.makedirs(os.path.join(directory, table), exist_ok=True)
+            self.paths[table] = os.path.join(directory, table, part)
+
+    def _writer(self, table:str):
+        if table not in self.writers:
+            # raises FileExistsError rather than replacing the records of an earlier export
+            file = open(self.paths[table], 'xb')
+            self.files.append(file)
+            if self.format == 'parquet':
+                self.writers[table] = pq.ParquetWriter(file, self.schemas[table], compression='zstd')
+            else:
+                self.writers[table] = pa.ipc.new_file(file, self.schemas[table])
+        return self.writers[table]
+
+    def write(self, table:str, rows:list):
+        """Writes a chunk of rows of the records or comments table"""
+        if rows:
+            batch = pa.Table.from_pylist(rows, schema=self.schemas[table])
+            self._writer(table).write_table(batch)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        for file in self.files:
+            file.close()
+
+
+class CsvExporter:
+    """
+    Appends rows to directory/records.csv and directory/comments.csv as they are
+    read, the header is written when a file is created. Hashtags are space
+    separated and dates ISO formatted.
+
+    Parameters
+    ----------
+    directory : str
+        The export directory.
+    """
+
+    def __init__(self, directory:str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.files = {}
+        self.writers = {}
+        for table, columns in (('records', RECORD_COLUMNS), ('comments', COMMENT_COLUMNS)):
+            path = os.path.join(directory, f'{table}.csv')
+            is_new = not os.path.exists(path)
+            self.files[table] = open(path, 'a', newline='', encoding='utf-8')
+            self.writers[table] = csv.DictWriter(self.files[table], fieldnames=columns)
+            if is_new:
+                self.writers[table].writeheader()
+
+    def write(self, table:str, rows:list):
+        """Writes a chunk of rows of the records or comments table"""
+        if table == 'records':
+            rows = [row | {'Hashtags': ' '.join(row['Hashtags'])} for row in rows]
+        self.writers[table].writerows(rows)
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+
+def export(format:str='parquet', directory:str=None, incremental:bool=True, chunk_size:int=None) -> tuple:
+    """
+    Streams the database out in chunks into the records and comments tables.
+    Each format is exported to its own directory, directory/<format>. An incremental
+    export only writes the records added since the previous export of the same
+    format, tracked with a cursor in directory/<format>/state.json.
+
+    Parameters
+    ----------
+    format : str, optional
+        'parquet', 'arrow' or 'csv', by default 'parquet'
+    directory : str, optional
+        The parent export directory, by default ScraperConfig.EXPORT_DIR
+    incremental : bool, optional
+        If False, earlier exports of the format are replaced, by default True
+    chunk_size : int, optional
+        Records per chunk, by default ScraperConfig.EXPORT_CHUNK_SIZE
+
+    Returns
+    -------
+    tuple
+        (number of records, number of comments) written.
+    """
+    directory = os.path.join(directory or ScraperConfig.EXPORT_DIR, format)
+    chunk_size = chunk_size or ScraperConfig.EXPORT_CHUNK_SIZE
+    state_path = os.path.join(directory, 'state.json')
+    state = {}
+    if incremental and os.path.exists(state_path):
+        with open(state_path) as file:
+            state = json.load(file)
+    if state.get('backend') != ScraperConfig.STORAGE_BACKEND:
+        # full export, or the cursor belongs to another backend: start over
+        state = {'backend': ScraperConfig.STORAGE_BACKEND, 'cursor': 0}
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+
+    exporter = CsvExporter(directory) if format == 'csv' else ArrowExporter(directory, format)
+    record_count = comment_count = 0
+    try:
+        for cursor, chunk in get_storage().iter_records(state['cursor'], chunk_size):
+            records = [record_row(url, record) for url, record in chunk.items()]
+            comments = [row for url, record in chunk.items() for row in comment_rows(url, record)]
+            exporter.write('records', records)
+            exporter.write('comments', comments)
+            record_count += len(records)
+            comment_count += len(comments)
+            state['cursor'] = cursor
+    finally:
+        exporter.close()
+        with open(state_path, 'w') as file:
+            json.dump(state, file)
+    return record_count, comment_count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports the database to Parquet, Arrow IPC or CSV')
+    parser.add_argument('format', nargs='?', choices=FORMATS, default='parquet')
+    parser.add_argument('--full', action='store_true', help='replace earlier exports instead of adding new records')
+    args = parser.parse_args()
+    start_time = time.time()
+    record_count, comment_count = export(args.format, incremental=not args.full)
+    print(f'{record_count} records and {comment_count} comments exported in {time.time() - start_time:.2f} seconds')
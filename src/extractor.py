@@ -0,0 +1,130 @@
+"""Fast extraction of video metadata from the rehydration JSON of a TikTok video page"""
+
+import datetime
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SCRIPT_ID = b'id="__UNIVERSAL_DATA_FOR_REHYDRATION__"'
+SCRIPT_END = b'</script>'
+VIDEO_DETAIL_KEY = '"webapp.video-detail"'
+ITEM_STRUCT_KEY = '"itemStruct"'
+HASHTAG_PATTERN = re.compile(r'#\w+')
+
+_decoder = json.JSONDecoder()
+
+
+def find_rehydration_script(page) -> str:
+    """
+    Finds the __UNIVERSAL_DATA_FOR_REHYDRATION__ script by scanning the raw page
+    instead of building an HTML tree.
+
+    Parameters
+    ----------
+    page : bytes | str
+        The HTML of the video page.
+
+    Returns
+    -------
+    str
+        The JSON text of the script, or None if the page does not have it.
+    """
+    if isinstance(page, str):
+        page = page.encode('utf-8')
+    start = page.find(SCRIPT_ID)
+    if start == -1:
+        return None
+    start = page.find(b'>', start)
+    end = page.find(SCRIPT_END, start)
+    if start == -1 or end == -1:
+        return None
+    return page[start + 1:end].decode('utf-8')
+
+def decode_item_struct(script:str) -> dict:
+    """
+    Decodes only the itemStruct subtree of the rehydration JSON.
+    If the subtree cannot be located the whole script is decoded,
+    with orjson when it is installed.
+
+    Parameters
+    ----------
+    script : str
+        The JSON text of the rehydration script.
+
+    Returns
+    -------
+    dict
+        The itemStruct of the video.
+
+    Raises
+    ------
+    KeyError
+        If the script does not contain the video details.
+    ValueError
+        If the script is not valid JSON.
+    """
+    detail = script.find(VIDEO_DETAIL_KEY)
+    key = script.find(ITEM_STRUCT_KEY, detail) if detail != -1 else -1
+    if key != -1:
+        start = script.find('{', key + len(ITEM_STRUCT_KEY))
+        if start != -1 and not script[key + len(ITEM_STRUCT_KEY):start].strip(' \t\r\n:'):
+            video_data, _ = _decoder.raw_decode(script, start)
+            return video_data
+    data = orjson.loads(script) if orjson else json.loads(script)
+    return data["__DEFAULT_SCOPE__"]["webapp.video-detail"]["itemInfo"]["itemStruct"]
+
+def parse_video_info(video_data:dict) -> dict:
+    """
+    Maps the itemStruct of a video to the metadata fields we collect.
+
+    Parameters
+    ----------
+    video_data : dict
+        The itemStruct of the video.
+
+    Returns
+    -------
+    dict
+        The video metadata information.
+    """
+    description = video_data['desc']
+    return {
+        'Account': video_data['author']['uniqueId'],
+        'Views': video_data['stats']['playCount'],
+        'Likes': video_data['stats']['diggCount'],
+        'Saved': video_data['stats']['collectCount'],
+        'Comment Count': video_data['stats']['commentCount'],
+        'Share Count': video_data['stats']['shareCount'],
+        'Caption': HASHTAG_PATTERN.sub('', description).strip().replace(',', ''),
+        'Hashtags': ' '.join(HASHTAG_PATTERN.findall(description)),
+        'Date posted': datetime.datetime.fromtimestamp(int(video_data['createTime'])).strftime("%m/%d/%Y"),
+        'Date Collected': datetime.datetime.today().strftime("%m/%d/%Y")
+    }
+
+def extract_video_info(page) -> dict:
+    """
+    Extracts the video metadata from the HTML of a video page.
+
+    Parameters
+    ----------
+    page : bytes | str
+        The HTML of the video page.
+
+    Returns
+    -------
+    dict
+        The video metadata information or None if the page has no rehydration script.
+
+    Raises
+    ------
+    KeyError, ValueError
+        If the rehydration script does not hold valid video details.
+    """
+    script = find_rehydration_script(page)
+    if not script:
+        return None
+    return parse_video_info(decode_item_struct(script))
@@ -0,0 +1,158 @@
+"""Incremental join of the metadata and comments of videos, keyed by video ID"""
+
+from storage import video_id
+
+
+def _key(url:str):
+    """Join key of a URL: its video ID, the URL itself if it has none"""
+    return video_id(url) or url
+
+
+class IncrementalJoin:
+    """
+    Merges the metadata and the comments of a video the moment both have
+    arrived. Until then each half waits in its pending index, so the videos
+    missing comments or metadata are listed in O(missing) without reading
+    the fetched data. URLs of the same video ID are joined, the merged record
+    is keyed by the URL of its metadata.
+
+    Parameters
+    ----------
+    emit : callable, optional
+        Called with (url, record) for every merged record, by default None
+        (records are kept until take_merged)
+    """
+
+    def __init__(self, emit=None) -> None:
+        self.emit = emit
+        # keys: video IDs | values: URLs without any data
+        self.urls = {}
+        # keys: video IDs | values: (URL, metadata) waiting for comments
+        self.pending_metadata = {}
+        # keys: video IDs | values: (URL, comments) waiting for metadata
+        self.pending_comments = {}
+        # keys: URLs | values: merged records not taken yet
+        self.merged = {}
+        # URLs of both halves of the merged records not taken yet
+        self.merged_urls = []
+        # video IDs of every merged record
+        self.joined = set()
+
+    @classmethod
+    def load(cls, urls:list, metadata:dict, comments:dict, emit=None):
+        """Join holding fetched data read from the storage, e.g. when resuming"""
+        join = cls(emit)
+        join.add_urls(urls)
+        for url, value in metadata.items():
+            join.add_metadata(url, value)
+        for url, value in comments.items():
+            join.add_comments(url, value)
+        return join
+
+    def add_urls(self, urls:list):
+        """Adds discovered URLs, the ones that already have data are skipped"""
+        for url in urls:
+            key = _key(url)
+            if key not in self.pending_metadata and key not in self.pending_comments and key not in self.joined:
+                self.urls.setdefault(key, url)
+
+    def add_metadata(self, url:str, metadata:dict) -> dict:
+        """
+        Adds the metadata of a video.
+
+        Returns
+        -------
+        dict
+            The merged record if the comments were already there, None otherwise.
+        """
+        key = _key(url)
+        self.urls.pop(key, None)
+        if key in self.pending_comments:
+            comment_url, comments = self.pending_comments.pop(key)
+            return self._merge(url, metadata, comment_url, comments)
+        self.pending_metadata[key] = (url, metadata)
+        return None
+
+    def add_comments(self, url:str, comments:list) -> dict:
+        """
+        Adds the comments of a video.
+
+        Returns
+        -------
+        dict
+            The merged record if the metadata was already there, None otherwise.
+        """
+        key = _key(url)
+        self.urls.pop(key, None)
+        if key in self.pending_metadata:
+            metadata_url, metadata = self.pending_metadata.pop(key)
+            return self._merge(metadata_url, metadata, url, comments)
+        self.pending_comments[key] = (url, comments)
+        return None
+
+    def _merge(self, url:str, metadata:dict, comment_url:str, comments:list) -> dict:
+        record = metadata | {'Comments': comments}
+        self.joined.add(_key(url))
+        self.merged_urls.append(url)
+        if comment_url != url:
+            self.merged_urls.append(comment_url)
+        if self.emit is not None:
+            self.emit(url, record)
+        else:
+            self.merged[url] = record
+        return record
+
+    def take_merged(self) -> tuple:
+        """
+        Hands over the merged records.
+
+        Returns
+        -------
+        tuple
+            (keys: URLs | values: metadata + comments, URLs the halves were stored under)
+        """
+        merged, urls = self.merged, self.merged_urls
+        self.merged, self.merged_urls = {}, []
+        return merged, urls
+
+    def has_metadata(self, url:str) -> bool:
+        """True if the metadata of the video arrived"""
+        key = _key(url)
+        return key in self.pending_metadata or key in self.joined
+
+    def has_comments(self, url:str) -> bool:
+        """True if the comments of the video arrived"""
+        key = _key(url)
+        return key in self.pending_comments or key in self.joined
+
+    def metadata_of(self, url:str) -> dict:
+        """Pending metadata of a video, None if it is not pending"""
+        pending = self.pending_metadata.get(_key(url))
+        return pending[1] if pending else None
+
+    def missing_comments(self) -> list:
+        """URLs that have metadata but no comments"""
+        return [url for url, _ in self.pending_metadata.values()]
+
+    def missing_metadata(self) -> list:
+        """URLs that have comments but no metadata"""
+        return [url for url, _ in self.pending_comments.values()]
+
+    def unprocessed(self) -> list:
+        """URLs that have neither metadata nor comments"""
+        return list(self.urls.values())
+
+    def metadata(self) -> dict:
+        """keys: URLs | values: metadata waiting for comments"""
+        return dict(self.pending_metadata.values())
+
+    def comments(self) -> dict:
+        """keys: URLs | values: comments waiting for metadata"""
+        return dict(self.pending_comments.values())
+
+    def clear(self):
+        """Drops every URL and pending half, merged records not taken are kept"""
+        self.urls.clear()
+        self.pending_metadata.clear()
+        self.pending_comments.clear()
+        self.joined.clear()
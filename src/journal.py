@@ -0,0 +1,173 @@
+"""Append-only NDJSON journal for fetched results"""
+
+import json
+import os
+import time
+
+from config import ScraperConfig
+from metrics import STORAGE_WRITE
+
+
+def journal_path(filename:str) -> str:
+    """
+    Returns the journal path that belongs to a JSON result file.
+
+    Parameters
+    ----------
+    filename : str
+        The JSON result file, e.g. data/fetched_metadata.json
+
+    Returns
+    -------
+    str
+        The path of the journal next to the result file.
+    """
+    return filename + '.journal'
+
+def replay(filename:str, state):
+    """
+    Applies the journal records of a result file on top of its loaded state.
+
+    Records are one JSON object per line:
+    {"op": "batch"} marks the start of a fetch batch. The first "set" after it
+    replaces the state, mirroring a batch that rewrites the whole file.
+    {"op": "set", "k": key, "v": value} stores a single result.
+    A torn last line (crash while appending) is ignored.
+
+    Parameters
+    ----------
+    filename : str
+        The JSON result file the journal belongs to.
+    state : dict
+        The state loaded from the JSON result file.
+
+    Returns
+    -------
+    dict
+        The state with all journal records applied.
+    """
+    path = journal_path(filename)
+    if not os.path.exists(path) or not isinstance(state, dict):
+        return state
+    pending_reset = False
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if record['op'] == 'batch':
+                pending_reset = True
+            elif record['op'] == 'set':
+                if pending_reset:
+                    state = {}
+                    pending_reset = False
+                state[record['k']] = record['v']
+    return state
+
+
+class ResultJournal:
+    """
+    Appends fetched results to an NDJSON journal instead of rewriting the
+    whole JSON file on every result. The journal is compacted back into the
+    JSON file once the batch is done, so the file on disk ends up identical
+    to the one written by utils.write.
+
+    The file handle is opened lazily per process, so the journal can be
+    handed to ProcessPoolExecutor workers.
+
+    Parameters
+    ----------
+    filename : str
+        The JSON result file the journal belongs to.
+    fsync_every : int, optional
+        Number of appended records between fsync calls,
+        by default ScraperConfig.JOURNAL_FSYNC_EVERY
+    compact_every : int, optional
+        Number of appended results between compactions, by default None
+        (compact only when the batch is done). Only safe when a single
+        process appends to the journal.
+    """
+
+    def __init__(self, filename:str, fsync_every:int=None, compact_every:int=None) -> None:
+        self.filename = filename
+        self.path = journal_path(filename)
+        self.fsync_every = fsync_every or ScraperConfig.JOURNAL_FSYNC_EVERY
+        self.compact_every = compact_every
+        self._file = None
+        self._pid = None
+        self._unsynced = 0
+        self._uncompacted = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_pid'] = None
+        state['_unsynced'] = 0
+        state['_uncompacted'] = 0
+        return state
+
+    def _handle(self):
+        """Opens the journal in append mode for the current process"""
+        if self._file is None or self._pid != os.getpid():
+            self._file = open(self.path, 'a')
+            self._pid = os.getpid()
+            self._unsynced = 0
+        return self._file
+
+    def _append(self, record:dict):
+        """Appends a single record and fsyncs periodically"""
+        file = self._handle()
+        with STORAGE_WRITE.time(os.path.basename(self.filename)):
+            file.write(json.dumps(record) + '\n')
+            file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                os.fsync(file.fileno())
+                self._unsynced = 0
+
+    def begin_batch(self):
+        """Marks the start of a fetch batch"""
+        self._append({'op': 'batch', 'ts': time.time()})
+
+    def append(self, key:str, value):
+        """
+        Appends a single fetched result.
+
+        Parameters
+        ----------
+        key : str
+            The URL the result belongs to.
+        value : dict | list
+            The fetched result.
+        """
+        self._append({'op': 'set', 'k': key, 'v': value})
+        self._uncompacted += 1
+        if self.compact_every and self._uncompacted >= self.compact_every:
+            self.compact()
+
+    def close(self):
+        """Flushes, fsyncs and closes the handle of the current process"""
+        if self._file is not None and self._pid == os.getpid():
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._file = None
+        self._pid = None
+
+    def compact(self):
+        """Folds the journal into the JSON result file and removes the journal"""
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        with open(self.filename, 'r') as file:
+            state = json.load(file)
+        state = replay(self.filename, state)
+        temp_path = self.filename + '.tmp'
+        with open(temp_path, 'w') as json_file:
+            json.dump(state, json_file, indent=4)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+        os.replace(temp_path, self.filename)
+        os.remove(self.path)
+        self._uncompacted = 0
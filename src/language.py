@@ -0,0 +1,184 @@
+"""Batched language detection of comments"""
+
+import collections
+import concurrent.futures
+import itertools
+import re
+
+from langdetect import DetectorFactory, detect
+from langdetect.lang_detect_exception import LangDetectException
+
+from config import ScraperConfig
+from profiler import profiled
+
+# langdetect samples n-grams at random, a fixed seed makes the tags deterministic
+DetectorFactory.seed = ScraperConfig.LANGUAGE_SEED
+
+# tag of comments whose language is not detected (too short, emoji-only, ...)
+UNDETERMINED = 'und'
+
+_MENTION = re.compile(r'@\S+')
+_LINK = re.compile(r'https?://\S+')
+_SPACE = re.compile(r'\s+')
+_LETTER = re.compile(r'[^\W\d_]')
+
+# keys: normalized comments | values: languages, least recently used first
+_cache = collections.OrderedDict()
+
+
+def normalize(comment:str) -> str:
+    """Case folded comment without mentions, links and repeated whitespace"""
+    comment = _LINK.sub(' ', _MENTION.sub(' ', comment.casefold()))
+    return _SPACE.sub(' ', comment).strip()
+
+def is_detectable(text:str) -> bool:
+    """False for texts with fewer than LANGUAGE_MIN_LETTERS letters, e.g. emoji-only comments"""
+    return len(text) >= ScraperConfig.LANGUAGE_MIN_LETTERS and \
+        len(_LETTER.findall(text)) >= ScraperConfig.LANGUAGE_MIN_LETTERS
+
+def detect_languages(texts:list) -> list:
+    """
+    Detects the language of normalized texts, without the cache.
+
+    Parameters
+    ----------
+    texts : list
+        Normalized, detectable texts.
+
+    Returns
+    -------
+    list
+        ISO 639-1 codes, UNDETERMINED where detection fails.
+    """
+    languages = []
+    for text in texts:
+        try:
+            languages.append(detect(text))
+        except LangDetectException:
+            languages.append(UNDETERMINED)
+    return languages
+
+def _remember(text:str, language:str):
+    _cache[text] = language
+    if len(_cache) > ScraperConfig.LANGUAGE_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+def language_of(comment:str) -> str:
+    """
+    Detects the language of a single comment through the cache.
+
+    Parameters
+    ----------
+    comment : str
+
+    Returns
+    -------
+    str
+        ISO 639-1 code or UNDETERMINED.
+    """
+    text = normalize(comment)
+    if not is_detectable(text):
+        return UNDETERMINED
+    if text in _cache:
+        _cache.move_to_end(text)
+        return _cache[text]
+    language = detect_languages([text])[0]
+    _remember(text, language)
+    return language
+
+
+class LanguageTagger:
+    """
+    Tags the language of comments in batches. Comments are normalized and
+    deduplicated, short and emoji-only ones are tagged UNDETERMINED without
+    detection, and the rest is looked up in an LRU cache. Misses are detected
+    on a process pool when a batch has at least LANGUAGE_POOL_MIN_BATCH of them.
+
+    Parameters
+    ----------
+    process_count : int, optional
+        Processes of the detection pool, 0 detects in this process,
+        by default ScraperConfig.LANGUAGE_PROCESS_COUNT
+    """
+
+    def __init__(self, process_count:int=None) -> None:
+        self.process_count = ScraperConfig.LANGUAGE_PROCESS_COUNT if process_count is None else process_count
+        self._pool = None
+
+    def _detect(self, texts:list) -> list:
+        if not self.process_count or len(texts) < ScraperConfig.LANGUAGE_POOL_MIN_BATCH:
+            return detect_languages(texts)
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.process_count)
+        # a few chunks per process balances the load without per-comment IPC
+        size = -(-len(texts) // (self.process_count * 4))
+        chunks = [texts[start:start + size] for start in range(0, len(texts), size)]
+        results = self._pool.map(profiled, itertools.repeat(detect_languages), chunks)
+        return [language for chunk in results for language in chunk]
+
+    def tag(self, comments:list) -> list:
+        """
+        Detects the language of a batch of comments.
+
+        Parameters
+        ----------
+        comments : list
+            Comment texts.
+
+        Returns
+        -------
+        list
+            ISO 639-1 codes or UNDETERMINED, in the order of comments.
+        """
+        languages = [UNDETERMINED] * len(comments)
+        # keys: normalized comments that miss the cache | values: their positions
+        pending = {}
+        for position, comment in enumerate(comments):
+            text = normalize(comment) if isinstance(comment, str) else ''
+            if not is_detectable(text):
+                continue
+            if text in _cache:
+                _cache.move_to_end(text)
+                languages[position] = _cache[text]
+            else:
+                pending.setdefault(text, []).append(position)
+        for text, language in zip(pending, self._detect(list(pending))):
+            _remember(text, language)
+            for position in pending[text]:
+                languages[position] = language
+        return languages
+
+    def tag_records(self, records:dict, english_only:bool=None) -> dict:
+        """
+        Adds the language of every comment of merged records as 'Comment Languages',
+        aligned with 'Comments'. The comments of all records are tagged in one batch.
+
+        Parameters
+        ----------
+        records : dict
+            keys: URLs | values: metadata + comments, updated in place
+        english_only : bool, optional
+            If True, only the English comments are kept,
+            by default ScraperConfig.ENGLISH_COMMENTS_ONLY
+
+        Returns
+        -------
+        dict
+            The records.
+        """
+        english_only = ScraperConfig.ENGLISH_COMMENTS_ONLY if english_only is None else english_only
+        comments = [record.get('Comments') or [] for record in records.values()]
+        languages = iter(self.tag([comment for video in comments for comment in video]))
+        for record, video in zip(records.values(), comments):
+            tags = list(itertools.islice(languages, len(video)))
+            if english_only:
+                record['Comments'] = [comment for comment, tag in zip(video, tags) if tag == 'en']
+                tags = ['en'] * len(record['Comments'])
+            record['Comment Languages'] = tags
+        return records
+
+    def close(self):
+        """Shuts the detection pool down"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
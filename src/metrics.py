@@ -0,0 +1,194 @@
+"""Prometheus metrics and JSON status of the scraper, served over HTTP"""
+
+import bisect
+import contextlib
+import json
+import threading
+import time
+
+from config import ScraperConfig
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names:tuple, values:tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    """
+    Base of the metric types: a family of values keyed by label values.
+    Metrics only cover the process that records them; results of process
+    pool workers are not included.
+
+    Parameters
+    ----------
+    name : str
+        The metric name.
+    documentation : str
+        The HELP text.
+    labels : tuple, optional
+        Label names, by default ()
+    """
+
+    kind = None
+
+    def __init__(self, name:str, documentation:str, labels:tuple=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _samples(self):
+        """Yields (suffix, label values, extra labels, value)"""
+        for values, value in sorted(self._values.items()):
+            yield '', values, '', value
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for suffix, values, extra, value in self._samples():
+                labels = _labels(self.labels, values)
+                if extra:
+                    labels = labels[:-1] + ',' + extra + '}' if labels else '{' + extra + '}'
+                lines.append(f'{self.name}{suffix}{labels} {value}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount:float=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value:float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name:str, documentation:str, labels:tuple=(), buckets:tuple=DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value:float, *labels):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        """Observes the duration of the enclosed block"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, *labels)
+
+    def _samples(self):
+        for values, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', values, f'le="{"+Inf" if bound == float("inf") else bound}"', cumulative
+            yield '_sum', values, '', round(total, 6)
+            yield '_count', values, '', cumulative
+
+
+REGISTRY = []
+
+REQUESTS = Counter('scraper_requests_total', 'HTTP requests by endpoint and status', ('endpoint', 'status'))
+FETCH_LATENCY = Histogram('scraper_fetch_seconds', 'Latency of HTTP requests', ('endpoint',))
+PARSE_TIME = Histogram('scraper_parse_seconds', 'Time spent parsing responses', ('endpoint',),
+                       buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+QUEUE_DEPTH = Gauge('scraper_queue_depth', 'URLs waiting in the fetcher queues', ('queue',))
+STAGE_SUCCESS = Gauge('scraper_stage_success_rate', 'Share of URLs processed by the latest run of a stage', ('stage',))
+URLS_DISCOVERED = Counter('scraper_urls_discovered_total', 'New video URLs discovered per hashtag', ('hashtag',))
+STORAGE_WRITE = Histogram('scraper_storage_write_seconds', 'Time spent writing to the storage backend', ('path',))
+FETCH_FAILURES = Counter('scraper_fetch_failures_total', 'Failed fetch attempts by endpoint and kind', ('endpoint', 'kind'))
+CIRCUIT_OPEN = Gauge('scraper_circuit_open', '1 while the circuit breaker of an endpoint pauses its requests', ('endpoint',))
+
+# state of the Scraper.scrap loop, served as JSON
+STATUS = {}
+_status_lock = threading.Lock()
+
+
+def set_status(**fields):
+    """Updates the status of the scrap loop"""
+    with _status_lock:
+        STATUS.update(fields)
+        STATUS['updated_at'] = time.time()
+
+def render() -> str:
+    """All metrics in the Prometheus text format"""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def _response(path:str) -> tuple:
+    """(body, content type) of a GET request, None for unknown paths"""
+    if path == '/metrics':
+        return render().encode(), 'text/plain; version=0.0.4'
+    if path in ('/', '/status'):
+        with _status_lock:
+            return json.dumps(STATUS, default=str).encode(), 'application/json'
+    return None
+
+
+def start_server(port:int=None, host:str=None) -> 'http.server.ThreadingHTTPServer':
+    """
+    Serves /metrics (Prometheus) and /status (JSON) on a daemon thread.
+
+    Parameters
+    ----------
+    port : int, optional
+        by default ScraperConfig.METRICS_PORT
+    host : str, optional
+        by default ScraperConfig.METRICS_HOST
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The server, or None if the port is taken.
+    """
+    # http.server is only imported by the process that serves the metrics,
+    # not by the worker processes that record them
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            response = _response(self.path)
+            if response is None:
+                self.send_error(404)
+                return
+            body, content_type = response
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host or ScraperConfig.METRICS_HOST, port or ScraperConfig.METRICS_PORT), Handler)
+    except OSError as e:
+        print(f'Metrics server not started: {e}')
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
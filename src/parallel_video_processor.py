@@ -1,20 +1,40 @@
 import concurrent.futures
-import datetime
 import json
 import multiprocessing
 import re
 import time
 
 import requests
-from bs4 import BeautifulSoup
 
+import user_agents
 import utils
 from config import ScraperConfig
+from extractor import extract_video_info
+from metrics import FETCH_LATENCY, PARSE_TIME, QUEUE_DEPTH, REQUESTS
+from profiler import profiled
+from rate_limiter import endpoint_for, get_rate_limiter
+from response_cache import CachedResponse, expire, get_response_cache
+from retry import NETWORK, PARSE, FetchError, RetryScheduler, get_circuit_breaker
+from storage import COMMENTS_PATH, METADATA_PATH, get_storage
 
 
 class VideoBatchProcessor:
     
-    def _process_url(self, url:str, shared_dict:dict, lock, path:str):
+    # called in the calling process with (url, data) for every stored result,
+    # e.g. to join it right away
+    on_result = None
+    
+    # retry scheduler of the latest batch, holds its failures
+    retries = None
+    
+    def __getstate__(self):
+        # the callback and the retries stay in the calling process, worker processes only fetch
+        state = self.__dict__.copy()
+        state.pop('on_result', None)
+        state.pop('retries', None)
+        return state
+    
+    def _process_url(self, url:str, shared_dict:dict, lock, path:str, sink=None):
         """
         Processes a single URL to fetch data and update the shared dictionary.
 
@@ -28,12 +48,29 @@ class VideoBatchProcessor:
             The lock to synchronize access to the shared dictionary.
         path : str
             The path where the shared dictionary is saved.
+        sink : ResultJournal | SQLiteResultSink, optional
+            If given, the result is appended to the sink instead of
+            rewriting the whole file, by default None
+
+        Returns
+        -------
+        dict | list
+            The fetched data or None.
+
+        Raises
+        ------
+        FetchError
+            If the fetch attempt fails.
         """
         fetched_data = self._fetch_data(url)
         if fetched_data:
             with lock:
-                shared_dict[url] = fetched_data
-                utils.write(path, dict(shared_dict))
+                if sink:
+                    sink.append(url, fetched_data)
+                else:
+                    shared_dict[url] = fetched_data
+                    utils.write(path, dict(shared_dict))
+        return fetched_data
               
     def _parallel_process(self, url_list: list, path: str):
         """
@@ -47,30 +84,171 @@ class VideoBatchProcessor:
             The path where the processed data will be saved.
         """
         manager = multiprocessing.Manager()
-        shared_dict = manager.dict()
         lock = manager.Lock()
+        sink = get_storage().open_sink(path)
+        # with RESUME results add to the fetched data instead of replacing it,
+        # without a sink every result rewrites the file with what it already holds
+        if sink and not ScraperConfig.RESUME:
+            sink.begin_batch()
+            sink.close()
+        shared_dict = manager.dict(get_storage().read(path) if ScraperConfig.RESUME and not sink else {})
 
         with concurrent.futures.ProcessPoolExecutor(max_workers=ScraperConfig.CPU_COUNT) as executor:
-            futures = {executor.submit(self._process_url, url, shared_dict, lock, path): url for url in url_list}
-            start_time = time.time()
-            while futures:
-                # Check for completed futures
-                done, not_done = concurrent.futures.wait(futures, timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED)
-                # Remove completed futures from the set
+            submit = lambda url: executor.submit(profiled, self._process_url, url, shared_dict, lock, path, sink)
+            for url, fetched_data in self._scheduled(url_list, submit, ScraperConfig.COMMENT_SCRAPER_TIMEOUT, 'parallel'):
+                if fetched_data and self.on_result is not None:
+                    self.on_result(url, fetched_data)
+        if sink:
+            sink.compact()
+
+    def _scheduled(self, url_list:list, submit, timeout:float, queue:str):
+        """
+        Runs the URLs on an executor through a RetryScheduler kept as self.retries until
+        every URL is done or timeout. Failed URLs wait out their backoff in the scheduler
+        instead of on a worker, so the executor goes on with other URLs in the meantime.
+
+        Parameters
+        ----------
+        url_list : list
+            A list of URLs to be processed.
+        submit : callable
+            Submits a URL to the executor and returns its future.
+        timeout : float
+            Overall timeout in seconds, URLs not processed by then are dropped.
+        queue : str
+            Label of the queue depth metric.
+
+        Yields
+        ------
+        tuple
+            (URL, result) of every processed URL.
+        """
+        self.retries = retries = RetryScheduler(url_list)
+        futures = {}
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                url, delay = retries.next()
+                while url is not None:
+                    futures[submit(url)] = url
+                    url, delay = retries.next()
+                remaining = deadline - time.monotonic()
+                if delay is None or remaining <= 0:
+                    return
+                QUEUE_DEPTH.set(len(retries) + len(futures), queue)
+                if not futures:
+                    # every URL left waits out its backoff
+                    time.sleep(min(delay, remaining))
+                    continue
+                done, _ = concurrent.futures.wait(futures, timeout=min(delay, remaining), 
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
                 for future in done:
+                    url = futures.pop(future)
                     try:
-                        future.result()
+                        fetched_data = future.result()
+                    except concurrent.futures.BrokenExecutor:
+                        raise
                     except Exception as e:
-                        # print(f"Exception occurred: {e}")
-                        pass
-                    finally:
-                        futures.pop(future)
-                # Check if the overall timeout has been reached
-                elapsed_time = time.time() - start_time
-                if elapsed_time >= ScraperConfig.COMMENT_SCRAPER_TIMEOUT:
-                    for future in not_done:
-                        future.cancel()
-                    break
+                        retries.failed(url, e)
+                        continue
+                    retries.done(url)
+                    yield url, fetched_data
+        except concurrent.futures.BrokenExecutor:
+            # a worker died, the URLs not processed are left over like on a timeout
+            pass
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _throttle(self, url:str):
+        """Blocks until the shared rate limiter admits a request to the URL's endpoint"""
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            limiter.acquire(endpoint_for(url))
+
+    def _get(self, url:str) -> requests.Response:
+        """
+        Sends a GET request through the response cache, paced by the rate limiter and
+        the circuit breaker. Fresh cached responses are returned without a request,
+        stale ones are revalidated.
+
+        Parameters
+        ----------
+        url : str
+            The URL to request.
+
+        Returns
+        -------
+        requests.Response | CachedResponse
+
+        Raises
+        ------
+        FetchError
+            A NETWORK error if the request times out or fails.
+        """
+        endpoint = endpoint_for(url)
+        cache = get_response_cache()
+        entry = cache.lookup(url) if cache is not None else None
+        if entry is not None and entry['fresh']:
+            REQUESTS.inc(endpoint, 'cached')
+            return CachedResponse(entry['body'])
+        breaker = get_circuit_breaker()
+        while breaker is not None and (delay := breaker.wait(endpoint)) > 0:
+            time.sleep(delay)
+        self._throttle(url)
+        start_time = time.monotonic()
+        try:
+            response = self._send(url, cache.validators(entry) if entry is not None else {})
+        except requests.Timeout as e:
+            REQUESTS.inc(endpoint, 'timeout')
+            raise FetchError(NETWORK, 'timeout') from e
+        except requests.RequestException as e:
+            REQUESTS.inc(endpoint, 'error')
+            raise FetchError(NETWORK, f'{type(e).__name__}: {e}') from e
+        REQUESTS.inc(endpoint, response.status_code)
+        if breaker is not None:
+            breaker.record(endpoint, response.status_code)
+        FETCH_LATENCY.observe(time.monotonic() - start_time, endpoint)
+        if response.status_code == 304 and entry is not None:
+            cache.refresh(url)
+            return CachedResponse(entry['body'])
+        if response.status_code == 200 and cache is not None:
+            cache.put(url, response.content, response.headers)
+        return response
+
+    def _send(self, url:str, headers:dict) -> requests.Response:
+        """
+        Sends a GET request with the scraper headers.
+
+        Parameters
+        ----------
+        url : str
+            The URL to request.
+        headers : dict
+            Extra headers, e.g. the validators of a stale cached response.
+
+        Returns
+        -------
+        requests.Response
+        """
+        return requests.get(url, headers=user_agents.headers() | headers, timeout=10)
+
+    def _parse(self, page:bytes) -> dict:
+        """
+        Extracts the video metadata from a video page.
+
+        Parameters
+        ----------
+        page : bytes
+            The HTML of the video page.
+
+        Returns
+        -------
+        dict
+            The video metadata information or None.
+        """
+        with PARSE_TIME.time('video'):
+            return extract_video_info(page)
 
     def _fetch_data(self):
         """Placeholder for fetching data from a URL"""
@@ -81,54 +259,42 @@ class ProcessMetaData(VideoBatchProcessor):
     def __init__(self, url_list):
         self.url_list = url_list 
     
-    def _fetch_data(self, url:str, max_retries:int=3) -> dict:
+    def _fetch_data(self, url:str) -> dict:
         """
-        Fetches metadata for a single URL, with retries on failure.
+        Fetches metadata for a single URL, in a single attempt:
+        failed URLs are retried by the retry scheduler of the batch.
 
         Parameters
         ----------
         url : str
             The URL to fetch data from.
-        max_retries : int, optional
-            The number of fetch attempts, by default 3.
 
         Returns
         -------
         dict
-            The fetched metadata information or None if unsuccessful.
+            The fetched metadata information.
+
+        Raises
+        ------
+        FetchError
+            If the request fails, the status is not 200 or the page holds no video details.
         """
-        attempt = 0
-        while attempt < max_retries:
-            try:
-                response = requests.get(url, headers=ScraperConfig.HEADERS, timeout=10)
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    json_content = soup.find(id="__UNIVERSAL_DATA_FOR_REHYDRATION__").string
-                    if json_content:
-                        video_data = json.loads(json_content)["__DEFAULT_SCOPE__"]["webapp.video-detail"]["itemInfo"]["itemStruct"]
-                        video_info = {
-                            'Account': video_data['author']['uniqueId'],
-                            'Views': video_data['stats']['playCount'],
-                            'Likes': video_data['stats']['diggCount'],
-                            'Saved': video_data['stats']['collectCount'],
-                            'Comment Count': video_data['stats']['commentCount'],
-                            'Share Count': video_data['stats']['shareCount'],
-                            'Caption': re.sub(r'#\w+', '', video_data['desc']).strip().replace(',', ''),
-                            'Hashtags': ' '.join(re.findall(r'#\w+', video_data['desc'])),
-                            'Date posted': datetime.datetime.fromtimestamp(int(video_data['createTime'])).strftime("%m/%d/%Y"),
-                            'Date Collected': datetime.datetime.today().strftime("%m/%d/%Y")
-                        }
-                        return video_info if video_info else None
-            except Exception as e:
-                # print(e)
-                pass
-            attempt += 1
-            time.sleep(1)  
-        return None
+        response = self._get(url)
+        if response.status_code != 200:
+            raise FetchError.from_status(response.status_code)
+        try:
+            video_info = self._parse(response.content)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            expire(url)
+            raise FetchError(PARSE, f'{type(e).__name__}: {e}') from e
+        if not video_info:
+            expire(url)
+            raise FetchError(PARSE, 'no video details')
+        return video_info
     
     def get_metadata(self):
         """Retrieves metadata for the URLs in the url_list"""
-        self._parallel_process(self.url_list, 'data/fetched_metadata.json')
+        self._parallel_process(self.url_list, METADATA_PATH)
     
 class ProcessComments(VideoBatchProcessor):
     
@@ -148,26 +314,37 @@ class ProcessComments(VideoBatchProcessor):
         -------
         list
             A list of comments for the given video URL.
+
+        Raises
+        ------
+        FetchError
+            If a page of comments cannot be fetched or read, the video is
+            retried as a whole by the retry scheduler of the batch.
         """
         video_id = url.split('/')[-1]
         pattern = r'comment:\s*(.*)'
         post_comments = []
         cursor_index = 0
         while len(post_comments) < ScraperConfig.COMMENT_COUNT:
-            comment_url = f'https://www.tiktok.com/api/comment/list/?aweme_id={video_id}&count=50&cursor={cursor_index}'
-            response = requests.get(comment_url, headers=ScraperConfig.HEADERS)
-            if response.status_code == 200: 
+            comment_url = f'{ScraperConfig.BASE_URL}/api/comment/list/?aweme_id={video_id}&count=50&cursor={cursor_index}'
+            response = self._get(comment_url)
+            if response.status_code != 200: 
+                raise FetchError.from_status(response.status_code)
+            try:
                 comment_data = response.json()['comments']
                 if not comment_data:
                     break
                 temp_comments = [re.search(pattern, comment['share_info']['desc']).group(1) for comment in comment_data]
-                post_comments.extend(temp_comments)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                expire(comment_url)
+                raise FetchError(PARSE, f'unexpected comment page: {type(e).__name__}: {e}') from e
+            post_comments.extend(temp_comments)
             cursor_index += 50
         return post_comments
     
     def get_comments(self):
         """Retrieves comments for the URLs in the url_list"""
-        self._parallel_process(self.url_list, 'data/fetched_comments.json')
+        self._parallel_process(self.url_list, COMMENTS_PATH)
 
         
 if __name__ == '__main__':
@@ -176,8 +353,8 @@ if __name__ == '__main__':
     ProcessMetaData(urls[:10]).get_metadata()
     ProcessComments(urls[:10]).get_comments()
     try:
-        comments = utils.read('data/fetched_comments.json')
-        metadata = utils.read('data/fetched_metadata.json')
+        comments = get_storage().read(COMMENTS_PATH)
+        metadata = get_storage().read(METADATA_PATH)
         print(f'metadata: {len(metadata)}')
         print(f'comments: {len(comments)}')
     except Exception as e:
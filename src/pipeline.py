@@ -0,0 +1,166 @@
+"""Streaming run mode: discovered URLs flow straight into the metadata and comment fetchers"""
+
+import asyncio
+import concurrent.futures
+import statistics
+import threading
+import time
+
+import aiohttp
+
+from async_video_processor import AsyncProcessComments, AsyncProcessMetaData
+from config import ScraperConfig
+from join import IncrementalJoin
+from profiler import profiled
+from retry import RetryScheduler
+from url_processor import url_scraper
+
+
+class StreamingPipeline:
+    """
+    Runs URL discovery, metadata and comment fetching and merging concurrently.
+
+    Discovery threads hand every new URL to an asyncio loop running on its own
+    thread, where metadata and comment workers pick it up right away. Failed
+    fetches are retried through a RetryScheduler per fetcher. An incremental
+    join merges a URL as soon as both halves arrive and merged records are
+    handed to emit every ScraperConfig.PIPELINE_FLUSH_INTERVAL seconds, on a
+    writer thread so that storing them does not stall the fetchers.
+
+    Parameters
+    ----------
+    existing_urls : list | VideoIdIndex
+        Passed to url_scraper to skip known videos.
+    driver_pool : DriverPool
+        The pool the discovery drivers are borrowed from.
+    emit : callable
+        Called with a dict of merged records (keys: URLs | values: metadata + comments),
+        one call at a time on the writer thread.
+    metadata_controller, comments_controller : ConcurrencyController, optional
+        Adaptive limits on requests in flight, by default None
+    """
+
+    def __init__(self, existing_urls, driver_pool, emit, metadata_controller=None, comments_controller=None) -> None:
+        self.existing_urls = existing_urls
+        self.driver_pool = driver_pool
+        self.emit = emit
+        self.metadata_fetcher = AsyncProcessMetaData([], metadata_controller)
+        self.comments_fetcher = AsyncProcessComments([], controller=comments_controller)
+        self.discovered = []
+        # touched only on the asyncio loop
+        self.join = IncrementalJoin(emit=self._merged)
+        self.metadata_retries = RetryScheduler(stream=True)
+        self.comments_retries = RetryScheduler(stream=True)
+        self.merged = {}
+        self.latencies = []
+        self._discovered_at = {}
+        self._buffer = {}
+        self._loop = None
+        self._queue = None
+        self._ready = threading.Event()
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._writes = []
+
+    def _submit(self, url:str):
+        """Called from the discovery threads for every new URL"""
+        self.discovered.append(url)
+        self._discovered_at[url] = time.monotonic()
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, url)
+
+    def _merged(self, url:str, record:dict):
+        """Called by the join for a URL whose metadata and comments both arrived"""
+        self.merged[url] = record
+        self._buffer[url] = record
+        self.latencies.append(time.monotonic() - self._discovered_at[url])
+        if len(self._buffer) >= ScraperConfig.PIPELINE_FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        """Hands the buffered merged records to emit on the writer thread"""
+        if self._buffer:
+            records, self._buffer = self._buffer, {}
+            self._writes = [write for write in self._writes if not write.done() or write.exception()]
+            self._writes.append(self._writer.submit(profiled, self.emit, records))
+
+    async def _fetch_metadata(self, session:aiohttp.ClientSession, url:str):
+        metadata = await self.metadata_fetcher._fetch_data(session, url)
+        self.join.add_metadata(url, metadata)
+
+    async def _fetch_comments(self, session:aiohttp.ClientSession, url:str):
+        comments = await self.comments_fetcher._fetch_data(session, url)
+        if comments:
+            self.join.add_comments(url, comments)
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(ScraperConfig.PIPELINE_FLUSH_INTERVAL)
+            self._flush()
+
+    async def _consume(self):
+        """Fans discovered URLs out to the metadata and comment workers until the end of the stream"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        worker_count = max(ScraperConfig.ASYNC_CONCURRENCY // 2, 1)
+        flusher = asyncio.create_task(self._flusher())
+        async with self.metadata_fetcher._create_session() as session:
+            fetch_metadata = lambda url: self._fetch_metadata(session, url)
+            fetch_comments = lambda url: self._fetch_comments(session, url)
+            workers = [asyncio.create_task(self.metadata_fetcher._worker(self.metadata_retries, fetch_metadata, 'pipeline_metadata'))
+                       for _ in range(worker_count)]
+            workers += [asyncio.create_task(self.comments_fetcher._worker(self.comments_retries, fetch_comments, 'pipeline_comments'))
+                        for _ in range(worker_count)]
+            while (url := await self._queue.get()) is not None:
+                self.join.add_urls([url])
+                self.metadata_retries.add(url)
+                self.comments_retries.add(url)
+            self.metadata_retries.close()
+            self.comments_retries.close()
+            try:
+                await asyncio.wait_for(asyncio.gather(*workers), timeout=ScraperConfig.PIPELINE_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        flusher.cancel()
+        self._flush()
+
+    def _consume_loop(self):
+        """Runs the consumers on an event loop of the consumer thread"""
+        asyncio.run(self._consume())
+
+    def run(self):
+        """
+        Runs one discovery round with streaming consumers.
+
+        Returns
+        -------
+        dict
+            keys: URLs | values: metadata + comments, all records merged in this round
+        """
+        consumer = threading.Thread(target=profiled, args=(self._consume_loop,), daemon=True)
+        consumer.start()
+        self._ready.wait()
+        try:
+            url_scraper(self.existing_urls, driver_pool=self.driver_pool, on_url=self._submit)
+        finally:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+            consumer.join()
+            self._writer.shutdown(wait=True)
+        # errors of emit are raised once every record is written
+        for write in self._writes:
+            write.result()
+        return self.merged
+
+    def left_overs(self) -> tuple:
+        """
+        Returns what could not be merged in this round.
+
+        Returns
+        -------
+        tuple
+            (URLs without any data, metadata without comments, comments without metadata)
+        """
+        return self.join.unprocessed(), self.join.metadata(), self.join.comments()
+
+    def median_latency(self) -> float:
+        """Median seconds from discovering a URL to emitting its merged record"""
+        return statistics.median(self.latencies) if self.latencies else 0
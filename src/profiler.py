@@ -0,0 +1,288 @@
+"""Opt-in profiling of the scraper stages and their worker processes
+
+Every stage of a profiled run writes into profiles/<run>/:
+    <stage>-<pid>.prof          cProfile stats, loadable with pstats or snakeviz
+    <stage>-<pid>-memory.txt    top allocation sites since the stage first ran
+    <stage>-<pid>.json          calls, wall and CPU time and peak traced memory
+Worker processes started within a stage are profiled as <stage>.<function>,
+and so are the worker threads of the main process, whose profiles are
+<stage>.<function>-<pid>-<thread>: cProfile only sees the thread that enables
+it before Python 3.12.
+report() sums the stages up across processes into summary.txt:
+    python3 src/profiler.py profiles/<run>
+When profiling is off a stage costs an environment lookup.
+"""
+
+import contextlib
+import cProfile
+import glob
+import io
+import json
+import multiprocessing.util
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from config import ScraperConfig
+
+# set in the environment of a profiled run, inherited by its worker processes
+DIRECTORY_ENV = 'SCRAPER_PROFILE_DIR'
+STAGE_ENV = 'SCRAPER_PROFILE_STAGE'
+OWNER_ENV = 'SCRAPER_PROFILE_PID'
+
+# seconds between two reports of a worker profile, the last one is written at exit
+WORKER_WRITE_INTERVAL = 1
+
+# keys: (pid, stage) or (pid, stage, thread ID) | values: StageProfile
+_profiles = {}
+# (pid, stage) of the stage running in the main process
+_active = None
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    """Traced allocations without the ones of tracemalloc and the import system"""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+
+
+class StageProfile:
+    """
+    Profile of one stage in one process, accumulated over every time the stage runs.
+
+    Parameters
+    ----------
+    directory : str
+        The run-scoped profile directory.
+    name : str
+        The stage name.
+    thread : int, optional
+        Native ID of the thread of a thread profile, by default None
+    """
+
+    def __init__(self, directory:str, name:str, thread:int=None) -> None:
+        self.name = name
+        self.thread = thread
+        self.path = os.path.join(directory, f'{name}-{os.getpid()}' + (f'-{thread}' if thread else ''))
+        self.profiler = cProfile.Profile()
+        # held while a thread profiles a call, so that the stage writes idle thread profiles only
+        self.lock = threading.Lock()
+        self.baseline = _snapshot()
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak = 0
+        self.written_at = 0.0
+
+    @contextlib.contextmanager
+    def measure(self):
+        """Profiles the enclosed block. CPU time is the one of the whole process,
+        or of the thread for thread profiles"""
+        clock = time.thread_time if self.thread else time.process_time
+        tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), clock()
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+            self.wall += time.perf_counter() - wall
+            self.cpu += clock() - cpu
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            self.calls += 1
+
+    def write(self):
+        """Writes the cProfile stats, the top allocation sites and the timings"""
+        self.profiler.dump_stats(self.path + '.prof')
+        allocations = _snapshot().compare_to(self.baseline, 'lineno')
+        with open(self.path + '-memory.txt', 'w') as file:
+            for statistic in allocations[:ScraperConfig.PROFILE_TOP]:
+                file.write(f'{statistic}\n')
+        with open(self.path + '.json', 'w') as file:
+            json.dump({'stage': self.name, 'pid': os.getpid(), 'thread': self.thread, 'calls': self.calls,
+                       'wall': round(self.wall, 4), 'cpu': round(self.cpu, 4),
+                       'peak_mb': round(self.peak / 2 ** 20, 2)}, file)
+        self.written_at = time.monotonic()
+
+
+def _profile(directory:str, name:str) -> StageProfile:
+    key = (os.getpid(), name)
+    if key not in _profiles:
+        _profiles[key] = StageProfile(directory, name)
+    return _profiles[key]
+
+def _thread_profile(directory:str, name:str) -> StageProfile:
+    key = (os.getpid(), name, threading.get_ident())
+    if key not in _profiles:
+        _profiles[key] = StageProfile(directory, name, threading.get_native_id())
+    return _profiles[key]
+
+def start(directory:str) -> str:
+    """
+    Turns profiling on for this process and the worker processes it starts.
+
+    Parameters
+    ----------
+    directory : str
+        The run-scoped profile directory, created if missing.
+
+    Returns
+    -------
+    str
+        The absolute path of the directory.
+    """
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    os.environ[DIRECTORY_ENV] = directory
+    os.environ[OWNER_ENV] = str(os.getpid())
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(ScraperConfig.PROFILE_TRACEMALLOC_FRAMES)
+    return directory
+
+def stop():
+    """Turns profiling off"""
+    for variable in (DIRECTORY_ENV, STAGE_ENV, OWNER_ENV):
+        os.environ.pop(variable, None)
+    _profiles.clear()
+    tracemalloc.stop()
+
+@contextlib.contextmanager
+def profile_stage(name:str):
+    """
+    Profiles the enclosed stage of the main process. Nested stages are
+    counted in the outer one.
+
+    Parameters
+    ----------
+    name : str
+        The stage name, also the prefix of the profiles of its worker processes.
+    """
+    global _active
+    directory = os.environ.get(DIRECTORY_ENV)
+    if directory is None or _active is not None:
+        yield
+        return
+    profile = _profile(directory, name)
+    _active = (os.getpid(), name)
+    os.environ[STAGE_ENV] = name
+    try:
+        with profile.measure():
+            yield
+    finally:
+        _active = None
+        os.environ.pop(STAGE_ENV, None)
+        profile.write()
+        # worker threads still in a call write their profile when it returns
+        for key, thread_profile in list(_profiles.items()):
+            if len(key) == 3 and key[0] == os.getpid() and thread_profile.name.startswith(f'{name}.') \
+                    and thread_profile.lock.acquire(blocking=False):
+                try:
+                    thread_profile.write()
+                finally:
+                    thread_profile.lock.release()
+
+def profiled(function, *args, **kwargs):
+    """
+    Calls function(*args, **kwargs). In a worker process of a profiled run, or
+    in a worker thread of a profiled stage, the call is profiled as
+    <stage>.<function name>. Submit it to process and thread pools, or make it
+    the target of threads, in place of function.
+
+    Parameters
+    ----------
+    function : callable
+        A picklable function or bound method.
+
+    Returns
+    -------
+    The result of the function.
+    """
+    directory = os.environ.get(DIRECTORY_ENV)
+    if directory is None:
+        return function(*args, **kwargs)
+    if os.environ.get(OWNER_ENV) == str(os.getpid()):
+        return _profiled_thread(directory, function, *args, **kwargs)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(ScraperConfig.PROFILE_TRACEMALLOC_FRAMES)
+    name = f'{os.environ.get(STAGE_ENV, "worker")}.{function.__name__}'
+    is_new = (os.getpid(), name) not in _profiles
+    profile = _profile(directory, name)
+    if is_new:
+        # pool workers exit without atexit handlers, finalizers still run
+        multiprocessing.util.Finalize(profile, profile.write, exitpriority=10)
+    try:
+        with profile.measure():
+            return function(*args, **kwargs)
+    finally:
+        if time.monotonic() - profile.written_at >= WORKER_WRITE_INTERVAL:
+            profile.write()
+
+def _profiled_thread(directory:str, function, *args, **kwargs):
+    """Profiles a call on a worker thread of the main process in the stage that is running"""
+    active = _active
+    # from Python 3.12 on the profile of the stage sees every thread
+    if active is None or threading.current_thread() is threading.main_thread() or sys.version_info >= (3, 12):
+        return function(*args, **kwargs)
+    profile = _thread_profile(directory, f'{active[1]}.{function.__name__}')
+    with profile.lock:
+        try:
+            with profile.measure():
+                return function(*args, **kwargs)
+        finally:
+            if _active != active or time.monotonic() - profile.written_at >= WORKER_WRITE_INTERVAL:
+                profile.write()
+
+
+def report(directory:str) -> str:
+    """
+    Sums the profiles of a run up per stage and writes them to directory/summary.txt.
+
+    Parameters
+    ----------
+    directory : str
+        The run-scoped profile directory.
+
+    Returns
+    -------
+    str
+        The summary: wall/CPU split per stage and the top functions by cumulative time.
+    """
+    stages = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path) as file:
+            timing = json.load(file)
+        stage = stages.setdefault(timing['stage'], {'processes': 0, 'threads': 0, 'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                    'peak_mb': 0.0, 'profiles': []})
+        stage['threads' if timing.get('thread') else 'processes'] += 1
+        stage['calls'] += timing['calls']
+        stage['wall'] += timing['wall']
+        stage['cpu'] += timing['cpu']
+        stage['peak_mb'] = max(stage['peak_mb'], timing['peak_mb'])
+        stage['profiles'].append(path[:-len('.json')] + '.prof')
+
+    output = io.StringIO()
+    output.write(f'{"stage":<40} {"procs":>5} {"thrds":>5} {"calls":>7} {"wall s":>9} {"cpu s":>9} {"cpu %":>6} {"peak MB":>8}\n')
+    for name, stage in stages.items():
+        share = stage['cpu'] / stage['wall'] * 100 if stage['wall'] else 0
+        output.write(f'{name:<40} {stage["processes"]:>5} {stage["threads"]:>5} {stage["calls"]:>7} {stage["wall"]:>9.2f} '
+                     f'{stage["cpu"]:>9.2f} {share:>6.0f} {stage["peak_mb"]:>8.1f}\n')
+    for name, stage in stages.items():
+        profiles = [path for path in stage['profiles'] if os.path.exists(path)]
+        if not profiles:
+            continue
+        output.write(f'\n{"-"*5}{name}{"-"*5}\n')
+        stats = pstats.Stats(*profiles, stream=output)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(ScraperConfig.PROFILE_TOP)
+    summary = output.getvalue()
+    with open(os.path.join(directory, 'summary.txt'), 'w') as file:
+        file.write(summary)
+    return summary
+
+
+if __name__ == '__main__':
+    print(report(sys.argv[1]))
@@ -0,0 +1,147 @@
+"""Token-bucket rate limiting shared by processes, threads and event loops"""
+
+import fcntl
+import os
+import struct
+import threading
+import time
+
+from config import ScraperConfig
+
+BUCKET = struct.Struct('<dd')
+
+
+def endpoint_for(url:str) -> str:
+    """
+    Returns the rate limit endpoint a request URL belongs to.
+
+    Parameters
+    ----------
+    url : str
+
+    Returns
+    -------
+    str
+        'comments' for the comment API, 'video' otherwise.
+    """
+    return 'comments' if '/api/comment/list/' in url else 'video'
+
+
+class RateLimiter:
+    """
+    Per-endpoint token buckets kept in a small file and updated under an
+    exclusive file lock, so every process on the host shares the same budget.
+    flock excludes open files, not threads: the threads of a process share
+    the file and take a thread lock around it.
+    Each call reserves a token and returns how long to wait for it: threads
+    sleep, coroutines await, nobody blocks while holding the lock.
+
+    Parameters
+    ----------
+    path : str, optional
+        The bucket file, by default ScraperConfig.RATE_LIMIT_PATH
+    rates : dict, optional
+        keys: endpoints | values: (requests per second, burst),
+        by default ScraperConfig.RATE_LIMITS
+    """
+
+    def __init__(self, path:str=None, rates:dict=None) -> None:
+        self.path = path or ScraperConfig.RATE_LIMIT_PATH
+        self.rates = rates or ScraperConfig.RATE_LIMITS
+        self.endpoints = sorted(self.rates)
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._lock_pid = os.getpid()
+
+    def __getstate__(self):
+        return {'path': self.path, 'rates': self.rates}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['rates'])
+
+    def _thread_lock(self) -> threading.Lock:
+        """Lock of the threads of the current process, a forked child starts with a new one
+        in case another thread held it during the fork"""
+        if self._lock_pid != os.getpid():
+            self._lock = threading.Lock()
+            self._lock_pid = os.getpid()
+        return self._lock
+
+    def _handle(self):
+        """Opens the bucket file in the current process, initializing full buckets if it is new.
+        Called with the thread lock held"""
+        if self._file is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT), 'r+b')
+            self._pid = os.getpid()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._file.fileno()).st_size != BUCKET.size * len(self.endpoints):
+                    self._file.truncate(0)
+                    now = time.time()
+                    for endpoint in self.endpoints:
+                        self._file.write(BUCKET.pack(self.rates[endpoint][1], now))
+                    self._file.flush()
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        return self._file
+
+    def reserve(self, endpoint:str) -> float:
+        """
+        Takes a token from the bucket of an endpoint.
+
+        Parameters
+        ----------
+        endpoint : str
+            One of the endpoints in rates.
+
+        Returns
+        -------
+        float
+            Seconds to wait before sending the request.
+        """
+        rate, burst = self.rates[endpoint]
+        offset = self.endpoints.index(endpoint) * BUCKET.size
+        with self._thread_lock():
+            file = self._handle()
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                tokens, updated = BUCKET.unpack(os.pread(file.fileno(), BUCKET.size, offset))
+                now = time.time()
+                tokens = min(burst, tokens + (now - updated) * rate) - 1
+                os.pwrite(file.fileno(), BUCKET.pack(tokens, now), offset)
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        return max(0, -tokens / rate)
+
+    def acquire(self, endpoint:str):
+        """Blocks the calling thread until a request to the endpoint may be sent"""
+        time.sleep(self.reserve(endpoint))
+
+    async def acquire_async(self, endpoint:str):
+        """Waits without blocking the event loop until a request to the endpoint may be sent"""
+        # asyncio is imported by the async engine, not by every user of the limiter
+        import asyncio
+
+        await asyncio.sleep(self.reserve(endpoint))
+
+
+_limiter = None
+
+def get_rate_limiter():
+    """
+    Returns the shared rate limiter, or None if ScraperConfig.RATE_LIMITING is off.
+
+    Returns
+    -------
+    RateLimiter
+    """
+    global _limiter
+    if not ScraperConfig.RATE_LIMITING:
+        return None
+    if _limiter is None:
+        _limiter = RateLimiter()
+    return _limiter
@@ -0,0 +1,182 @@
+"""Stats refresh of known videos, scheduled by age and growth"""
+
+import asyncio
+import heapq
+import time
+from datetime import datetime
+
+from async_video_processor import AsyncProcessMetaData
+from config import ScraperConfig
+from retry import RetryScheduler
+
+# metadata fields that change after a video is collected
+STATS = ('Views', 'Likes', 'Saved', 'Comment Count', 'Share Count')
+
+# record fields the refresh schedule is computed from
+SCHEDULE_FIELDS = ('Date posted', 'Date Collected', *STATS)
+
+# snapshots per video the refresh schedule is computed from, the last two observations
+SCHEDULE_SNAPSHOTS = 2
+
+
+def snapshot(metadata:dict, collected_at:float) -> dict:
+    """
+    Takes the stats of a video out of its metadata.
+
+    Parameters
+    ----------
+    metadata : dict
+        The video metadata information.
+    collected_at : float
+        Epoch seconds of the fetch.
+
+    Returns
+    -------
+    dict
+        The stats fields and 'Collected At'.
+    """
+    return {**{field: metadata[field] for field in STATS}, 'Collected At': collected_at}
+
+def _timestamp(date:str) -> float:
+    """Epoch seconds of a 'mm/dd/YYYY' date"""
+    return datetime.strptime(date, '%m/%d/%Y').timestamp()
+
+
+class RefreshScheduler:
+    """
+    Priority queue of known videos ordered by the time their stats are due.
+
+    A video is due one interval after its last observation (the record itself,
+    then its snapshots). The interval is REFRESH_BASE_INTERVAL scaled up with
+    the square root of the video age in days and down with the relative view
+    growth per day between the last two observations, within
+    REFRESH_MIN_INTERVAL and REFRESH_MAX_INTERVAL.
+
+    Parameters
+    ----------
+    records : dict
+        keys: URLs | values: records of the database, SCHEDULE_FIELDS are enough
+    snapshots : dict
+        keys: URLs | values: stats snapshots in the order they were collected,
+        the latest SCHEDULE_SNAPSHOTS are enough
+    """
+
+    def __init__(self, records:dict, snapshots:dict) -> None:
+        self._heap = []
+        for url, record in records.items():
+            try:
+                due = self.due_time(record, snapshots.get(url, []))
+            except (KeyError, TypeError, ValueError):
+                continue
+            self._heap.append((due, url))
+        heapq.heapify(self._heap)
+
+    def interval(self, record:dict, history:list) -> float:
+        """
+        Seconds between two refreshes of a video.
+
+        Parameters
+        ----------
+        record : dict
+            The record of the video in the database.
+        history : list
+            Its stats snapshots.
+
+        Returns
+        -------
+        float
+        """
+        observations = [(_timestamp(record['Date Collected']), record['Views'])]
+        observations += [(item['Collected At'], item['Views']) for item in history]
+        (previous_time, previous_views), (last_time, last_views) = observations[-2:] if len(observations) > 1 else observations * 2
+        days = max((last_time - previous_time) / 86400, 1 / 24)
+        growth = max(last_views - previous_views, 0) / max(previous_views, 1) / days
+        age = max((last_time - _timestamp(record['Date posted'])) / 86400, 1)
+        interval = ScraperConfig.REFRESH_BASE_INTERVAL * age ** 0.5 / (1 + 10 * growth)
+        return min(max(interval, ScraperConfig.REFRESH_MIN_INTERVAL), ScraperConfig.REFRESH_MAX_INTERVAL)
+
+    def due_time(self, record:dict, history:list) -> float:
+        """Epoch seconds when the stats of a video are due"""
+        last_time = history[-1]['Collected At'] if history else _timestamp(record['Date Collected'])
+        return last_time + self.interval(record, history)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def pop_due(self, budget:int=None, now:float=None) -> list:
+        """
+        Takes the videos that are due, most overdue first.
+
+        Parameters
+        ----------
+        budget : int, optional
+            Maximum number of videos, by default all due videos
+        now : float, optional
+            Epoch seconds, by default the current time
+
+        Returns
+        -------
+        list
+            URLs of the videos to refresh.
+        """
+        now = now or time.time()
+        urls = []
+        while self._heap and self._heap[0][0] <= now and (budget is None or len(urls) < budget):
+            urls.append(heapq.heappop(self._heap)[1])
+        return urls
+
+
+class StatsRefresher(AsyncProcessMetaData):
+    """
+    Re-fetches the metadata of known videos on the async engine, sharing the
+    rate limiter and the concurrency controller with new-URL scraping.
+    Cached pages are revalidated instead of being served as fresh.
+
+    Parameters
+    ----------
+    url_list : list
+        URLs of the videos to refresh.
+    controller : ConcurrencyController, optional
+        Adaptive limit on requests in flight, by default None
+    """
+
+    revalidate = True
+
+    async def _refresh_url(self, session, url:str, results:dict):
+        results[url] = await self._fetch_data(session, url)
+
+    async def _refresh(self, results:dict):
+        # refreshes spend little of the request budget on videos that keep failing
+        self.retries = RetryScheduler(self.url_list, max_attempts=2)
+        worker_count = min(ScraperConfig.ASYNC_CONCURRENCY, len(self.url_list))
+        async with self._create_session() as session:
+            process = lambda url: self._refresh_url(session, url, results)
+            await asyncio.gather(*[self._worker(self.retries, process, 'refresh') for _ in range(worker_count)])
+
+    def get_snapshots(self) -> dict:
+        """
+        Fetches the stats of the videos in url_list until METADATA_SCRAPER_TIMEOUT.
+
+        Returns
+        -------
+        dict
+            keys: URLs | values: stats snapshots
+        """
+        results = {}
+        try:
+            asyncio.run(asyncio.wait_for(self._refresh(results), timeout=ScraperConfig.METADATA_SCRAPER_TIMEOUT))
+        except asyncio.TimeoutError:
+            pass
+        collected_at = time.time()
+        return {url: snapshot(metadata, collected_at) for url, metadata in results.items()}
+
+
+if __name__ == '__main__':
+    # refresh mode: refreshes the stats of every due video and exits
+    from scraper import Scraper
+
+    scraper = Scraper()
+    try:
+        scraper.refresh_run()
+    finally:
+        scraper.close()
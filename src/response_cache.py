@@ -0,0 +1,372 @@
+"""Content-addressed on-disk cache of video pages and comment pages"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from config import ScraperConfig
+from rate_limiter import endpoint_for
+from storage import video_id
+
+
+def cache_key(url:str) -> str:
+    """
+    Returns the cache key of a request URL: endpoint, video ID and cursor.
+
+    Parameters
+    ----------
+    url : str
+        A video URL or a comment API URL.
+
+    Returns
+    -------
+    str
+        e.g. 'comments:7375775673576705312:50', or None if the URL has no video ID.
+    """
+    if endpoint_for(url) == 'comments':
+        query = parse_qs(urlparse(url).query)
+        if 'aweme_id' not in query:
+            return None
+        return f"comments:{query['aweme_id'][0]}:{query.get('cursor', ['0'])[0]}"
+    identifier = video_id(url)
+    return f'video:{identifier}:0' if identifier else None
+
+
+class CachedResponse:
+    """A cached body served in place of a requests.Response"""
+
+    status_code = 200
+
+    def __init__(self, content:bytes) -> None:
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache:
+    """
+    Responses stored once per content hash under directory/objects, with an
+    SQLite index mapping each key (endpoint, video ID, cursor) to its body,
+    validators and timestamps. Entries older than the endpoint TTL are stale:
+    they are revalidated with If-None-Match / If-Modified-Since when the server
+    sent validators, and refetched otherwise. Least recently used entries are
+    evicted once the bodies exceed max_mb. Every process and thread opens its
+    own connection, so the cache can be shared by all the engines.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The cache directory, by default ScraperConfig.RESPONSE_CACHE_DIR
+    max_mb : int, optional
+        Size of the stored bodies before eviction, by default ScraperConfig.RESPONSE_CACHE_MAX_MB
+    ttls : dict, optional
+        keys: endpoints | values: seconds an entry is fresh,
+        by default ScraperConfig.RESPONSE_CACHE_TTL
+    """
+
+    def __init__(self, directory:str=None, max_mb:int=None, ttls:dict=None) -> None:
+        self.directory = directory or ScraperConfig.RESPONSE_CACHE_DIR
+        self.max_mb = max_mb or ScraperConfig.RESPONSE_CACHE_MAX_MB
+        self.ttls = ttls or ScraperConfig.RESPONSE_CACHE_TTL
+        self._local = threading.local()
+        self._puts = 0
+        self._create_tables()
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'max_mb': self.max_mb, 'ttls': self.ttls}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['max_mb'], state['ttls'])
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current process and thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.join(self.directory, 'objects'), exist_ok=True)
+            connection = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'),
+                                         timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _create_tables(self):
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                           'key TEXT PRIMARY KEY, url TEXT, digest TEXT NOT NULL, '
+                           'etag TEXT, last_modified TEXT, stored_at REAL, accessed_at REAL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+        connection.execute('CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, size INTEGER)')
+
+    def _object_path(self, digest:str) -> str:
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def lookup(self, url:str) -> dict:
+        """
+        Looks up the cached response of a URL, fresh or stale.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        dict
+            keys: 'body', 'etag', 'last_modified', 'fresh', or None if nothing is cached.
+        """
+        key = cache_key(url)
+        if key is None:
+            return None
+        connection = self._connection()
+        row = connection.execute('SELECT digest, etag, last_modified, stored_at FROM entries WHERE key = ?',
+                                 (key,)).fetchone()
+        if row is None:
+            return None
+        digest, etag, last_modified, stored_at = row
+        try:
+            with open(self._object_path(digest), 'rb') as file:
+                body = file.read()
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        connection.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+        return {'body': body,
+                'etag': etag,
+                'last_modified': last_modified,
+                'fresh': now - stored_at < self.ttls[key.split(':')[0]]}
+
+    def validators(self, entry:dict) -> dict:
+        """Conditional request headers for a stale entry"""
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url:str, body:bytes, headers=None):
+        """
+        Stores the body of a successful response.
+
+        Parameters
+        ----------
+        url : str
+            The requested URL.
+        body : bytes
+            The response body.
+        headers : mapping, optional
+            The response headers, validators are kept for revalidation, by default None
+        """
+        key = cache_key(url)
+        if key is None:
+            return
+        headers = headers or {}
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'wb') as file:
+                file.write(body)
+            os.replace(temp_path, path)
+        now = time.time()
+        connection = self._connection()
+        connection.execute('INSERT OR IGNORE INTO objects (digest, size) VALUES (?, ?)', (digest, len(body)))
+        connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (key, url, digest, headers.get('ETag'), headers.get('Last-Modified'), now, now))
+        self._puts += 1
+        if self._puts % 100 == 0:
+            self.evict()
+
+    def refresh(self, url:str):
+        """Marks the entry of a URL fresh again after a 304 Not Modified"""
+        key = cache_key(url)
+        if key is not None:
+            self._connection().execute('UPDATE entries SET stored_at = ? WHERE key = ?', (time.time(), key))
+
+    def expire(self, url:str):
+        """Marks the entry of a URL stale, e.g. a page that could not be parsed.
+        The body stays available for offline re-parsing until it is evicted"""
+        key = cache_key(url)
+        if key is not None:
+            self._connection().execute('UPDATE entries SET stored_at = 0 WHERE key = ?', (key,))
+
+    def evict(self):
+        """Removes least recently used entries until the bodies fit in max_mb"""
+        connection = self._connection()
+        limit = self.max_mb * 2 ** 20
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+        if total <= limit:
+            return
+        rows = connection.execute('SELECT key FROM entries ORDER BY accessed_at').fetchall()
+        for start in range(0, len(rows), 100):
+            keys = [row[0] for row in rows[start:start + 100]]
+            connection.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in keys])
+            orphans = connection.execute('SELECT digest, size FROM objects WHERE digest NOT IN '
+                                         '(SELECT digest FROM entries)').fetchall()
+            for digest, size in orphans:
+                connection.execute('DELETE FROM objects WHERE digest = ?', (digest,))
+                try:
+                    os.remove(self._object_path(digest))
+                except FileNotFoundError:
+                    pass
+                total -= size
+            if total <= limit:
+                return
+
+    def entries(self, endpoint:str):
+        """
+        Iterates over the cached responses of an endpoint, fresh or stale.
+
+        Parameters
+        ----------
+        endpoint : str
+            'video' or 'comments'
+
+        Yields
+        ------
+        tuple
+            (video ID, cursor, requested URL, body)
+        """
+        rows = self._connection().execute('SELECT key, url, digest FROM entries WHERE key LIKE ?',
+                                          (f'{endpoint}:%',)).fetchall()
+        for key, url, digest in rows:
+            _, identifier, cursor = key.split(':')
+            try:
+                with open(self._object_path(digest), 'rb') as file:
+                    yield int(identifier), int(cursor), url, file.read()
+            except FileNotFoundError:
+                continue
+
+    def close(self):
+        """Closes the connection of the current thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+
+
+_cache = None
+_cache_pid = None
+
+def get_response_cache():
+    """
+    Returns the response cache of the current process, or None if
+    ScraperConfig.RESPONSE_CACHE is off.
+
+    Returns
+    -------
+    ResponseCache
+    """
+    global _cache, _cache_pid
+    if not ScraperConfig.RESPONSE_CACHE:
+        return None
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = ResponseCache()
+        _cache_pid = os.getpid()
+    return _cache
+
+def expire(url:str):
+    """Marks the cached response of a URL stale, if the cache is on"""
+    cache = get_response_cache()
+    if cache is not None:
+        cache.expire(url)
+
+def reparse(cache:ResponseCache) -> tuple:
+    """
+    Rebuilds metadata and comments from the cached responses without network traffic.
+    Comment pages of a video are read in cursor order from cursor 0 until a gap,
+    an empty page or ScraperConfig.COMMENT_COUNT comments.
+
+    Parameters
+    ----------
+    cache : ResponseCache
+
+    Returns
+    -------
+    tuple
+        (metadata, comments), both keyed by video URL. Comments are only
+        returned for videos whose page is cached, pages that still fail to
+        parse are left out.
+    """
+    from extractor import extract_video_info
+
+    pattern = r'comment:\s*(.*)'
+    metadata = {}
+    video_urls = {}
+    for identifier, _, url, body in cache.entries('video'):
+        video_urls[identifier] = url
+        try:
+            video_info = extract_video_info(body)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            continue
+        if video_info:
+            metadata[url] = video_info
+
+    pages = {}
+    for identifier, cursor, _, body in cache.entries('comments'):
+        pages.setdefault(identifier, {})[cursor] = body
+
+    comments = {}
+    for identifier, video_pages in pages.items():
+        if identifier not in video_urls:
+            continue
+        post_comments = []
+        cursor_index = 0
+        while len(post_comments) < ScraperConfig.COMMENT_COUNT and cursor_index in video_pages:
+            try:
+                comment_data = json.loads(video_pages[cursor_index]).get('comments') or []
+                page = [re.search(pattern, comment['share_info']['desc']).group(1) for comment in comment_data]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                break
+            if not page:
+                break
+            post_comments.extend(page)
+            cursor_index += 50
+        if post_comments:
+            comments[video_urls[identifier]] = post_comments
+    return metadata, comments
+
+def reparse_fetched(storage, cache:ResponseCache=None) -> tuple:
+    """
+    Replaces the fetched metadata and comments of storage with the cached
+    responses of the videos that are not in the database yet, so the next
+    merge does not add the stored videos again.
+
+    Parameters
+    ----------
+    storage : JsonStorage | SQLiteStorage
+    cache : ResponseCache, optional
+        by default the cache under ScraperConfig.RESPONSE_CACHE_DIR
+
+    Returns
+    -------
+    tuple
+        (metadata, comments) written, both keyed by video URL.
+    """
+    from storage import COMMENTS_PATH, METADATA_PATH
+
+    metadata, comments = reparse(cache or ResponseCache())
+    new_urls = set(storage.filter_new(list(metadata.keys() | comments.keys())))
+    metadata = {url: video_info for url, video_info in metadata.items() if url in new_urls}
+    comments = {url: post_comments for url, post_comments in comments.items() if url in new_urls}
+    storage.write(METADATA_PATH, metadata)
+    storage.write(COMMENTS_PATH, comments)
+    return metadata, comments
+
+
+if __name__ == '__main__':
+    # offline re-parse: replaces the fetched metadata and comments with the cached responses
+    from storage import get_storage
+
+    storage = get_storage()
+    metadata, comments = reparse_fetched(storage)
+    storage.close()
+    print(f'Re-parsed metadata of {len(metadata)} and comments of {len(comments)} videos from the cache')
@@ -0,0 +1,323 @@
+"""Failure classification, a delay queue of failed URLs and per-endpoint circuit breakers"""
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+import utils
+from config import ScraperConfig
+from metrics import CIRCUIT_OPEN, FETCH_FAILURES
+from rate_limiter import endpoint_for
+
+# kinds of failed fetch attempts
+NETWORK = 'network'
+CLIENT = 'client'
+BLOCKED = 'blocked'
+SERVER = 'server'
+PARSE = 'parse'
+
+# statuses TikTok answers with when it throttles or blocks the scraper
+BLOCKED_STATUSES = (403, 429)
+
+
+def classify_status(status:int) -> str:
+    """
+    Returns the failure kind of an HTTP status.
+
+    Parameters
+    ----------
+    status : int
+
+    Returns
+    -------
+    str
+        BLOCKED for 403 and 429, CLIENT for other 4xx, SERVER otherwise.
+    """
+    if status in BLOCKED_STATUSES:
+        return BLOCKED
+    if 400 <= status < 500:
+        return CLIENT
+    return SERVER
+
+
+class FetchError(Exception):
+    """
+    A failed fetch attempt of a URL.
+
+    Parameters
+    ----------
+    kind : str
+        NETWORK, CLIENT, BLOCKED, SERVER or PARSE.
+    reason : str
+        What went wrong, e.g. 'status 429' or 'no video details'.
+    """
+
+    def __init__(self, kind:str, reason:str) -> None:
+        super().__init__(kind, reason)
+        self.kind = kind
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f'{self.kind}: {self.reason}'
+
+    @property
+    def retryable(self) -> bool:
+        """False for client errors, e.g. a deleted video, which fail the same way every time"""
+        return self.kind != CLIENT
+
+    @classmethod
+    def from_status(cls, status:int):
+        """FetchError of a response with an unexpected status"""
+        return cls(classify_status(status), f'status {status}')
+
+
+def as_fetch_error(error:Exception) -> FetchError:
+    """
+    Classifies an exception raised while fetching a URL.
+
+    Parameters
+    ----------
+    error : Exception
+
+    Returns
+    -------
+    FetchError
+        The error itself if it is a FetchError, a NETWORK error for OSErrors
+        (timeouts and the requests exceptions), a PARSE error otherwise.
+    """
+    if isinstance(error, FetchError):
+        return error
+    kind = NETWORK if isinstance(error, OSError) else PARSE
+    return FetchError(kind, f'{type(error).__name__}: {error}')
+
+
+class RetryScheduler:
+    """
+    Hands out the URLs of a batch and takes failed ones back into a delay queue,
+    where each waits out an exponential backoff with jitter while the workers go
+    on with other URLs. URLs are dropped after max_attempts failed attempts, or
+    after a single client error. Not thread-safe: it is driven by one event loop
+    or by the thread that submits to an executor.
+
+    Parameters
+    ----------
+    urls : list, optional
+        The URLs of the batch, by default none
+    stream : bool, optional
+        If True, more URLs are added until close is called, by default False
+    max_attempts : int, optional
+        Attempts per URL, by default ScraperConfig.RETRY_MAX_ATTEMPTS
+    """
+
+    def __init__(self, urls:list=(), stream:bool=False, max_attempts:int=None) -> None:
+        self.max_attempts = max_attempts or ScraperConfig.RETRY_MAX_ATTEMPTS
+        self.closed = not stream
+        self.in_flight = 0
+        # keys: URLs | values: failed attempts
+        self.attempts = collections.Counter()
+        # keys: failure kinds | values: failed attempts
+        self.failures = collections.Counter()
+        # keys: URLs | values: reason of the last failure of the dropped URLs
+        self.dropped = {}
+        self._ready = collections.deque(urls)
+        # (due time, sequence, URL) of the URLs waiting out their backoff
+        self._delayed = []
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        """Number of URLs waiting to be handed out"""
+        return len(self._ready) + len(self._delayed)
+
+    def add(self, url:str):
+        """Adds a URL to the end of the queue"""
+        self._ready.append(url)
+
+    def close(self):
+        """Ends the stream, next reports the end once every URL is done"""
+        self.closed = True
+
+    def next(self) -> tuple:
+        """
+        Hands out the next URL that is due.
+
+        Returns
+        -------
+        tuple
+            (URL, 0) if a URL is due, (None, seconds to wait before asking again)
+            if URLs are in flight or waiting out their backoff, (None, None) once
+            every URL is done.
+        """
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            self._ready.append(heapq.heappop(self._delayed)[2])
+        if self._ready:
+            self.in_flight += 1
+            return self._ready.popleft(), 0
+        if self._delayed:
+            return None, min(self._delayed[0][0] - now, ScraperConfig.RETRY_POLL_INTERVAL)
+        if self.in_flight or not self.closed:
+            return None, ScraperConfig.RETRY_POLL_INTERVAL
+        return None, None
+
+    def done(self, url:str):
+        """Reports a URL handed out by next as processed"""
+        self.in_flight -= 1
+
+    def failed(self, url:str, error:Exception) -> float:
+        """
+        Reports a failed attempt of a URL handed out by next.
+
+        Parameters
+        ----------
+        url : str
+        error : Exception
+            The error of the attempt, classified by as_fetch_error.
+
+        Returns
+        -------
+        float
+            Seconds until the URL is retried, None if it is dropped.
+        """
+        error = as_fetch_error(error)
+        self.in_flight -= 1
+        self.failures[error.kind] += 1
+        FETCH_FAILURES.inc(endpoint_for(url), error.kind)
+        self.attempts[url] += 1
+        if not error.retryable or self.attempts[url] >= self.max_attempts:
+            self.dropped[url] = str(error)
+            return None
+        delay = utils.backoff_delay(self.attempts[url] - 1, ScraperConfig.RETRY_BASE_DELAYS[error.kind], 
+                                    ScraperConfig.RETRY_MAX_DELAY)
+        heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), url))
+        return delay
+
+    def summary(self) -> dict:
+        """
+        Returns the failures of the batch.
+
+        Returns
+        -------
+        dict
+            failures: failed attempts by kind, retried: URLs that failed at least once,
+            dropped: keys: dropped URLs | values: reason of their last failure
+        """
+        return {'failures': dict(self.failures), 'retried': len(self.attempts), 'dropped': dict(self.dropped)}
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breakers of the current process. A circuit opens after
+    ScraperConfig.CIRCUIT_BREAKER_THRESHOLD blocked responses within
+    CIRCUIT_BREAKER_WINDOW seconds and pauses every request to the endpoint for
+    the cooldown. Then a single probe request is let through: a response that is
+    not blocked closes the circuit, a blocked one opens it again for an
+    exponential backoff of the cooldown with jitter, so the probes of many
+    scrapers do not fall into the same storm. Thread-safe, threads sleep and
+    coroutines await the seconds wait returns.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # keys: endpoints | values: times of the recent blocked responses
+        self._blocked = collections.defaultdict(collections.deque)
+        # keys: endpoints | values: time the circuit stops pausing requests
+        self._open_until = {}
+        # keys: endpoints | values: cooldown of the open circuit
+        self._cooldown = {}
+        # keys: endpoints | values: times the circuit opened since it was closed
+        self._trips = {}
+        # keys: endpoints | values: time the probe request was let through
+        self._probe = {}
+
+    def wait(self, endpoint:str) -> float:
+        """
+        Checks whether a request to the endpoint may be sent.
+
+        Parameters
+        ----------
+        endpoint : str
+
+        Returns
+        -------
+        float
+            0 if the request may be sent, otherwise seconds to wait before asking again.
+        """
+        with self._lock:
+            open_until = self._open_until.get(endpoint)
+            if open_until is None:
+                return 0
+            now = time.monotonic()
+            if now < open_until:
+                return open_until - now
+            # half open: one probe at a time, another one if its response never comes
+            probe = self._probe.get(endpoint)
+            if probe is None or now - probe > self._cooldown[endpoint]:
+                self._probe[endpoint] = now
+                return 0
+            return ScraperConfig.RETRY_POLL_INTERVAL
+
+    def record(self, endpoint:str, status:int):
+        """Reports the status of a response from the endpoint"""
+        blocked = status in BLOCKED_STATUSES
+        with self._lock:
+            now = time.monotonic()
+            open_until = self._open_until.get(endpoint)
+            if open_until is not None:
+                # responses to requests sent before the circuit opened do not count
+                if now < open_until or endpoint not in self._probe:
+                    return
+                if blocked:
+                    self._open(endpoint, now, 'probe blocked')
+                else:
+                    self._close(endpoint)
+                return
+            if not blocked:
+                return
+            recent = self._blocked[endpoint]
+            recent.append(now)
+            while recent and recent[0] < now - ScraperConfig.CIRCUIT_BREAKER_WINDOW:
+                recent.popleft()
+            if len(recent) >= ScraperConfig.CIRCUIT_BREAKER_THRESHOLD:
+                self._open(endpoint, now, f'{len(recent)} blocked responses')
+
+    def _open(self, endpoint:str, now:float, reason:str):
+        trips = self._trips.get(endpoint, 0)
+        cooldown = utils.backoff_delay(trips, ScraperConfig.CIRCUIT_BREAKER_COOLDOWN, ScraperConfig.CIRCUIT_BREAKER_MAX_COOLDOWN)
+        self._trips[endpoint] = trips + 1
+        self._open_until[endpoint] = now + cooldown
+        self._cooldown[endpoint] = cooldown
+        self._probe.pop(endpoint, None)
+        self._blocked[endpoint].clear()
+        CIRCUIT_OPEN.set(1, endpoint)
+        print(f'Circuit breaker of {endpoint} requests open for {cooldown:.1f} seconds: {reason}')
+
+    def _close(self, endpoint:str):
+        for state in (self._open_until, self._cooldown, self._trips, self._probe):
+            state.pop(endpoint, None)
+        CIRCUIT_OPEN.set(0, endpoint)
+        print(f'Circuit breaker of {endpoint} requests closed')
+
+    def is_open(self, endpoint:str) -> bool:
+        """True while requests to the endpoint are paused or probed"""
+        with self._lock:
+            return endpoint in self._open_until
+
+
+_breaker = None
+
+def get_circuit_breaker():
+    """
+    Returns the circuit breaker of the current process, or None if ScraperConfig.CIRCUIT_BREAKER is off.
+
+    Returns
+    -------
+    CircuitBreaker
+    """
+    global _breaker
+    if not ScraperConfig.CIRCUIT_BREAKER:
+        return None
+    if _breaker is None:
+        _breaker = CircuitBreaker()
+    return _breaker
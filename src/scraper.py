@@ -1,21 +1,69 @@
+import atexit
 import json
 import os
 import time
 from datetime import datetime
 
+import user_agents
 import utils
-from async_video_processor import AsyncProcessComments, AsyncProcessMetaData
+from checkpoint import Checkpoint
+from concurrency import ConcurrencyController
 from config import ScraperConfig
-from parallel_video_processor import ProcessComments, ProcessMetaData
-from url_processor import url_scraper
+from dedupe_index import VideoIdIndex
+from driver_pool import DriverPool
+from join import IncrementalJoin
+from metrics import STAGE_SUCCESS, set_status, start_server
+from profiler import profile_stage, report, start, stop
+from rate_limiter import get_rate_limiter
+from storage import (COMMENTS_PATH, DATABASE_PATH, FULL_DATA_PATH,
+                     FETCHED_PATHS, METADATA_PATH, URLS_PATH, get_storage,
+                     video_id)
+
+# the engines, URL discovery (selenium) and language tagging (langdetect) are
+# imported by the methods that use them, so a run only loads what its modes need
+
+# scraper modes in the order they are tried when the success rate drops
+SCRAPER_MODES = ['async', 'threaded', 'parallel']
+
+
+def next_mode(mode:str) -> str:
+    """Returns the scraper mode to switch to after mode"""
+    return SCRAPER_MODES[(SCRAPER_MODES.index(mode) + 1) % len(SCRAPER_MODES)]
 
 
 class Scraper:
     
     def __init__(self) -> None:
-        self.name = f'runs/{utils.record_now()}.txt' 
-        self.async_metadata = ScraperConfig.ASYNC_METADATA
-        self.async_comments = ScraperConfig.ASYNC_COMMENTS
+        self.name = f'runs/{utils.record_now()}.jsonl' 
+        self.metadata_mode = ScraperConfig.METADATA_MODE
+        self.comments_mode = ScraperConfig.COMMENTS_MODE
+        # adaptive concurrency state carries over across full and left over runs
+        self.metadata_controller = None
+        self.comments_controller = None
+        if ScraperConfig.ADAPTIVE_CONCURRENCY:
+            self.metadata_controller = ConcurrencyController.from_config()
+            self.comments_controller = ConcurrencyController.from_config()
+        self.storage = get_storage()
+        # stage of the scrap loop, an unfinished one is resumed by scrap
+        self.checkpoint = Checkpoint()
+        self.resume_from = self.checkpoint.load() if ScraperConfig.RESUME else {}
+        # tags the comment languages of merged records, its cache lives across runs
+        self.language_tagger = None
+        if ScraperConfig.COMMENT_LANGUAGES:
+            from language import LanguageTagger
+            self.language_tagger = LanguageTagger()
+        # number of new URLs found in the latest run, sizes the stats refresh budget
+        self.discovered_url_count = 0
+        self.driver_pool = None
+        if ScraperConfig.PERSISTENT_DRIVERS or ScraperConfig.RUN_MODE == 'pipelined':
+            self.driver_pool = DriverPool(size=min(ScraperConfig.CPU_COUNT, len(ScraperConfig.HASHTAGS)))
+            atexit.register(self.driver_pool.close)
+        self.metrics_server = start_server() if ScraperConfig.METRICS_SERVER else None
+        # run-scoped profile directory next to runs/, None when profiling is off
+        self.profile_dir = None
+        if ScraperConfig.PROFILING:
+            run = os.path.splitext(os.path.basename(self.name))[0]
+            self.profile_dir = start(os.path.join(ScraperConfig.PROFILE_DIR, run))
         self.initiate_scraper()
 
     def initiate_scraper(self):
@@ -25,109 +73,193 @@ class Scraper:
             os.makedirs(directory)
             
         with open(self.name, 'w') as file:
-            file.write(f'Scraper Run, Date: {datetime.now().strftime("%m/%d/%Y")}\n')
+            file.write(json.dumps({'time': time.time(), 'event': 'start', 
+                                   'message': f'Scraper Run, Date: {datetime.now().strftime("%m/%d/%Y")}',
+                                   'run_mode': ScraperConfig.RUN_MODE, 
+                                   'storage': ScraperConfig.STORAGE_BACKEND}) + '\n')
+        set_status(stage='starting', run_log=self.name, started_at=time.time(), 
+                   target=ScraperConfig.TOTAL_SCRAP_COUNT)
         
-        directory = "data"
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-            
-        # Creating Database
-        with open('data/fetched_urls.json', 'w') as json_file:
-            json.dump([], json_file, indent=4)
-            
-        with open('data/fetched_comments.json', 'w') as json_file:
-            json.dump({}, json_file, indent=4)
-            
-        with open('data/fetched_metadata.json', 'w') as json_file:
-            json.dump({}, json_file, indent=4)
-            
-        with open('data/fetched_full_data.json', 'w') as json_file:
-            json.dump({}, json_file, indent=4)
-        
-        file_path = 'data/database.json'
-        if not os.path.exists(file_path):
-            with open('data/database.json', 'w') as json_file:
-                json.dump({}, json_file, indent=4)
+        # Creating Database, the fetched data is kept when resuming, 
+        # a new run with RESUME only starts its own records over
+        if not ScraperConfig.RESUME:
+            reset = FETCHED_PATHS
+        elif self.resume_from:
+            reset = []
+        else:
+            reset = [FULL_DATA_PATH]
+        self.storage.initialize(reset)
+        # loaded before any worker process starts, so they all share it
+        user_agents.pool()
+        self.url_index = self.load_url_index()
+        # metadata and comments are joined as they arrive, the fetched data is only read here
+        self.join = IncrementalJoin.load(self.storage.read(URLS_PATH), self.storage.read(METADATA_PATH),
+                                         self.storage.read(COMMENTS_PATH))
+    
+    def log(self, event:str, message:str, **fields):
+        """Prints a message and appends it to the run log as a JSON line with its fields"""
+        with open(self.name, 'a') as file:
+            file.write(json.dumps({'time': time.time(), 'event': event, 'message': message, **fields}) + '\n')
+        print(message)
+    
+    def load_url_index(self) -> VideoIdIndex:
+        """Loads the video ID index of the database, rebuilding it if it is missing or out of date"""
+        path = ScraperConfig.URL_INDEX_PATH
+        if os.path.exists(path):
+            url_index = VideoIdIndex(path)
+            if len(url_index) == self.storage.count(DATABASE_PATH):
+                return url_index
+            url_index.close()
+        video_ids = [video_id(url) for url in self.storage.existing_urls()]
+        return VideoIdIndex.create(path, video_ids)
     
     def scrap_urls(self):
-        """Runs the URL scraper and saves it into disk"""
-        # run scraper
-        existing_urls = list(utils.read('data/database.json').keys())
+        """Runs the URL scraper and saves it into disk
+        With RESUME, discovery continues from the URLs that are already saved"""
+        # run scraper, new URLs are checked against the video ID index of the database
+        set_status(stage='urls')
         start_time = time.time()
-        url_scraper(existing_urls)
+        from url_processor import url_scraper
+
+        resume_urls = self.storage.read(URLS_PATH) if ScraperConfig.RESUME else None
+        url_scraper(self.url_index, driver_pool=self.driver_pool, resume_urls=resume_urls)
         end_time = time.time()
         difference = f"{end_time - start_time:.2f}"
         
-        self.url_list = utils.read('data/fetched_urls.json')
-        with open(self.name, 'a') as file:
-            file.write(f'{len(self.url_list)} URLs collected in {difference} seconds\n')
-            print(f'{len(self.url_list)} URLs collected in {difference} seconds')
+        self.url_list = self.storage.read(URLS_PATH)
+        self.join.add_urls(self.url_list)
+        self.discovered_url_count = len(self.url_list)
+        self.log('urls', f'{len(self.url_list)} URLs collected in {difference} seconds',
+                 urls=len(self.url_list), seconds=float(difference))
             
     def scrap_metadata(self, url_list:list):
         """Scraps the metadata and saves it into disk
-        Scraping either asynchronous or in parallel based on success rate
+        Scraping either asynchronous, threaded or in parallel based on success rate
 
         Parameters
         ----------
         url_list : list
             list of URLs to scrap the metadata for
         """
+        set_status(stage='metadata', mode=self.metadata_mode, queued=len(url_list))
         start_time = time.time()
-        if self.async_metadata:
-            scraper = AsyncProcessMetaData(url_list)
+        if self.metadata_mode == 'async':
+            from async_video_processor import AsyncProcessMetaData
+            scraper = AsyncProcessMetaData(url_list, self.metadata_controller)
             method = 'Async Metadata'
+        elif self.metadata_mode == 'threaded':
+            from threaded_video_processor import ThreadedProcessMetaData
+            scraper = ThreadedProcessMetaData(url_list, self.metadata_controller)
+            method = 'Threaded Metadata'
         else:
+            from parallel_video_processor import ProcessMetaData
             scraper = ProcessMetaData(url_list)
             method = 'Parallel Metadata'
+        scraper.on_result = self.join.add_metadata
         scraper.get_metadata()
         end_time = time.time()
         difference = f"{end_time - start_time:.2f}"
-        processed_url_count = len(utils.read('data/fetched_metadata.json'))
+        processed_url_count = sum(self.join.has_metadata(url) for url in url_list)
         success_rate = int(processed_url_count/len(url_list)*100)
         
-        with open(self.name, 'a') as file:
-            file.write(f'{method} processed {processed_url_count} out of {len(url_list)} URLs in {difference} seconds, ')
-            file.write(f'Success Rate: {int(success_rate)}%\n')
-            print(f"{method} processed {processed_url_count} out of {len(url_list)} URLs in {difference} seconds")
-            print(f'Success Rate: {int(success_rate)}%')
-        
+        self.log('metadata', f'{method} processed {processed_url_count} out of {len(url_list)} URLs in {difference} seconds, '
+                 f'Success Rate: {int(success_rate)}%', 
+                 mode=self.metadata_mode, processed=processed_url_count, urls=len(url_list), 
+                 seconds=float(difference), success_rate=success_rate)
+        STAGE_SUCCESS.set(success_rate / 100, 'metadata')
+        self.log_failures(scraper.retries, 'metadata')
+        self.log_controller(self.metadata_controller, 'metadata')
         # if success rate is < threshold, change the scraper
-        if success_rate < ScraperConfig.SUCCESS_RATE_THRESHOLD:
-            self.async_metadata = not self.async_metadata
+        # unless the concurrency controller adapts the current one
+        if success_rate < ScraperConfig.SUCCESS_RATE_THRESHOLD and not self.is_adaptive(self.metadata_mode):
+            self.metadata_mode = next_mode(self.metadata_mode)
             
     def scrap_comments(self, url_list:list):
-        """Scraps the metadata and saves it into disk
-        Scraping either asynchronous or in parallel based on success rate
+        """Scraps the comments and saves it into disk
+        Scraping either asynchronous, threaded or in parallel based on success rate
 
         Parameters
         ----------
         url_list : list
-            list of URLs to scrap the metadata for
+            list of URLs to scrap the comments for
         """
+        set_status(stage='comments', mode=self.comments_mode, queued=len(url_list))
         start_time = time.time()
-        if self.async_comments:
-            scraper = AsyncProcessComments(url_list)
+        if self.comments_mode == 'async':
+            from async_video_processor import AsyncProcessComments
+            # comment counts size the pipelined comment pagination
+            comment_counts = {url: metadata.get('Comment Count') for url in url_list
+                              if (metadata := self.join.metadata_of(url)) is not None}
+            scraper = AsyncProcessComments(url_list, comment_counts, self.comments_controller)
             method = 'Async Comments'
+        elif self.comments_mode == 'threaded':
+            from threaded_video_processor import ThreadedProcessComments
+            scraper = ThreadedProcessComments(url_list, self.comments_controller)
+            method = 'Threaded Comments'
         else:
+            from parallel_video_processor import ProcessComments
             scraper = ProcessComments(url_list)
             method = 'Parallel Comments'
+        scraper.on_result = self.join.add_comments
         scraper.get_comments()
         end_time = time.time()
         difference = f"{end_time - start_time:.2f}"
-        processed_url_count = len(utils.read('data/fetched_comments.json'))
+        processed_url_count = sum(self.join.has_comments(url) for url in url_list)
         success_rate = int(processed_url_count/len(url_list)*100)
         
-        with open(self.name, 'a') as file:
-            file.write(f'{method} processed {processed_url_count} out of {len(url_list)} URLs in {difference} seconds, ')
-            file.write(f'Success Rate: {int(success_rate)}%\n')
-            print(f"{method} processed {processed_url_count} out of {len(url_list)} URLs in {difference} seconds")
-            print(f'Success Rate: {int(success_rate)}%')
-            
+        self.log('comments', f'{method} processed {processed_url_count} out of {len(url_list)} URLs in {difference} seconds, '
+                 f'Success Rate: {int(success_rate)}%', 
+                 mode=self.comments_mode, processed=processed_url_count, urls=len(url_list), 
+                 seconds=float(difference), success_rate=success_rate)
+        STAGE_SUCCESS.set(success_rate / 100, 'comments')
+        self.log_failures(scraper.retries, 'comments')
+        self.log_controller(self.comments_controller, 'comments')
         # if success rate is < threshold, change the scraper
-        if success_rate < ScraperConfig.SUCCESS_RATE_THRESHOLD:
-            self.async_comments = not self.async_comments
+        # unless the concurrency controller adapts the current one
+        if success_rate < ScraperConfig.SUCCESS_RATE_THRESHOLD and not self.is_adaptive(self.comments_mode):
+            self.comments_mode = next_mode(self.comments_mode)
+    
+    def is_adaptive(self, mode:str) -> bool:
+        """True if the concurrency controller drives the given scraper mode"""
+        return ScraperConfig.ADAPTIVE_CONCURRENCY and mode in ('async', 'threaded')
+    
+    def log_failures(self, retries, stage:str):
+        """Writes the failed fetch attempts of a stage by kind and the reason every dropped URL failed for to the run log"""
+        if retries is None or not retries.failures:
+            return
+        summary = retries.summary()
+        self.log('failures', f'{stage} failures: {summary["failures"]}, {summary["retried"]} URLs retried, '
+                 f'{len(summary["dropped"])} dropped', stage=stage, **summary)
+    
+    def log_controller(self, controller:ConcurrencyController, stage:str):
+        """Writes the state of a concurrency controller to the run log"""
+        if controller is None:
+            return
+        snapshot = controller.snapshot()
+        self.log('concurrency', f'Concurrency: {snapshot}', stage=stage, **snapshot)
+        set_status(**{f'{stage}_concurrency': snapshot})
+        
+    def store_records(self, full_data:dict) -> int:
+        """Adds merged records to the database and to the data pulled in the current run
+
+        Parameters
+        ----------
+        full_data : dict --> keys: URLs | values: metadata + comments
+
+        Returns
+        -------
+        int
+            number of URLs that were not in the database
+        """
+        if self.language_tagger is not None:
+            self.language_tagger.tag_records(full_data)
+        new_data_count = self.storage.update_database(full_data)
         
-    def update_database(self, full_data:dict):
+        # add to the data that is pulled in the current run 
+        self.storage.append(FULL_DATA_PATH, full_data)
+        return new_data_count
+    
+    def update_database(self, full_data:dict, stored:bool=False):
         """Updates the database with collected full data information
         Reports back the left over data in URLs, Metadata, and Comments database
 
@@ -136,42 +268,36 @@ class Scraper:
         full_data : dict --> keys: URLs | values: metadata + comments
             complete fetched data in where all the URLs have both comments and 
             metadata information
+        stored : bool, optional
+            if True, the records were already stored with store_records
         """
-        with open(self.name, 'a') as file:
-            file.write(f'{len(full_data)} new URLs processed\n')
-            print(f'{len(full_data)} new URLs processed')
+        self.log('merged', f'{len(full_data)} new URLs processed', merged=len(full_data))
             
         if len(full_data):
-            with open('data/database.json', 'r') as file:
-                database = json.load(file)
-                
-            # new urls that does not exist in the database
-            new_data = set(full_data.keys()).difference(set(database.keys()))
-            
             # add new urls to the database
-            database = database | full_data
-            utils.write('data/database.json', database)
-            print(f'{len(new_data)} new data added')
-            
-            # update the data that is pulled in the current run 
-            current_run = utils.read('data/fetched_full_data.json')
-            current_run = current_run | full_data
-            utils.write('data/fetched_full_data.json', current_run)
+            if not stored:
+                new_data_count = self.store_records(full_data)
+                print(f'{new_data_count} new data added')
+            self.url_index.grow(len(full_data))
+            for url in full_data:
+                self.url_index.add(video_id(url))
             
-        # calculate the data that are left over
-        metadata = utils.read('data/fetched_metadata.json')
-        comments = utils.read('data/fetched_comments.json')
-        urls = utils.read('data/fetched_urls.json')
-        with open(self.name, 'a') as file:
-            file.write(f'Left overs -> {len(urls)} URLs, {len(metadata)} Metadata, {len(comments)} Comments\n')
-            print(f'Left overs -> {len(urls)} URLs, {len(metadata)} Metadata, {len(comments)} Comments')
+        # the data that are left over
+        urls = len(self.join.urls)
+        metadata = len(self.join.pending_metadata)
+        comments = len(self.join.pending_comments)
+        self.log('left_overs', f'Left overs -> {urls} URLs, {metadata} Metadata, {comments} Comments',
+                 urls=urls, metadata=metadata, comments=comments)
+        set_status(left_overs={'urls': urls, 'metadata': metadata, 'comments': comments})
         
     def merge_results(self, clear:bool=False) -> dict:
         """After metadata and comments information is collected
         URLs that have both information are merged and removed from 
         comments and metadata database. Unprocessed URLs are kept in each database
         for future run. After this method call, either url, metadata, and comments
-        database all have unique URLs among each other or they are cleared
+        database all have unique URLs among each other or they are cleared.
+        The records were merged by the join as their halves arrived, 
+        so the fetched data is not read
 
         Parameters
         ----------
@@ -184,53 +310,45 @@ class Scraper:
             complete fetched data in where all the URLs have both comments and 
             metadata information
         """
-        metadata = utils.read('data/fetched_metadata.json')
-        comments = utils.read('data/fetched_comments.json')
-        urls = utils.read('data/fetched_urls.json')
-        
-        # urls that have all information
-        complete = set(metadata.keys()) & set(comments.keys())
-        
-        # urls that have either metadata or comment information
-        union = set(metadata.keys()) | set(comments.keys())
-        
-        # urls that have no information
-        unprocessed_urls = list(set(urls).difference(union))
-        
-        # process urls that have full information
-        full_data = {}
-        for url in complete: 
-            metadata[url]['Comments'] = comments[url]
-            full_data[url] = metadata[url]
-            if not clear:
-                del metadata[url]
-                del comments[url]
+        full_data, merged_urls = self.join.take_merged()
         
         if clear: 
             # clean up metadata and comment database 
-            utils.write('data/fetched_metadata.json', {})
-            utils.write('data/fetched_comments.json', {})
-            utils.write('data/fetched_urls.json', [])
+            self.storage.write(METADATA_PATH, {})
+            self.storage.write(COMMENTS_PATH, {})
+            self.storage.write(URLS_PATH, [])
+            self.join.clear()
             self.url_list = []
         else: 
             # update metadata and comments 
-            utils.write('data/fetched_metadata.json', metadata)
-            utils.write('data/fetched_comments.json', comments)
-            utils.write('data/fetched_urls.json', unprocessed_urls)
-            self.url_list = unprocessed_urls
+            if ScraperConfig.RESUME:
+                # the fetched data kept every result, only the merged ones leave it
+                self.storage.remove(METADATA_PATH, merged_urls)
+                self.storage.remove(COMMENTS_PATH, merged_urls)
+            else:
+                # every scraper call started the fetched data over, the join holds the rest
+                self.storage.write(METADATA_PATH, self.join.metadata())
+                self.storage.write(COMMENTS_PATH, self.join.comments())
+            # urls that have no information
+            self.url_list = self.join.unprocessed()
+            self.storage.write(URLS_PATH, self.url_list)
         return full_data
     
     def update_missing_data(self): 
         """Updates the URLs that have metadata information but not comments (missing_comment_urls)
-        as well as URL that have comments but not metadata information (missing_metadata_urls)"""
-        metadata = utils.read('data/fetched_metadata.json')
-        comments = utils.read('data/fetched_comments.json')
-        
+        as well as URL that have comments but not metadata information (missing_metadata_urls)
+        from the pending indexes of the join"""
         # urls that have metadata but not comments
-        self.missing_comment_urls = list(set(metadata.keys()).difference(set(comments.keys())))
+        self.missing_comment_urls = self.join.missing_comments()
         # urls that have comments but not metadata
-        self.missing_metadata_urls = list(set(comments.keys()).difference(set(metadata.keys())))
+        self.missing_metadata_urls = self.join.missing_metadata()
+    
     
+    def pause(self, seconds:float):
+        """Fixed break between methods and runs, skipped when the rate limiter 
+        already paces every request"""
+        if get_rate_limiter() is None:
+            time.sleep(seconds)
     
     def full_run(self):
         """Full run of the scraper with the following steps:
@@ -240,24 +358,107 @@ class Scraper:
         4 - merge results
         5 - update database"""
         print('initiating url collection')
-        self.scrap_urls()
-        time.sleep(ScraperConfig.METHOD_BREAK)
+        self.checkpoint.save(stage='urls')
+        with profile_stage('full.urls'):
+            self.scrap_urls()
+        self.pause(ScraperConfig.METHOD_BREAK)
         if self.url_list:
             print('initiating metada scraping')
-            self.scrap_metadata(self.url_list)
-            time.sleep(ScraperConfig.METHOD_BREAK)
+            self.checkpoint.save(stage='metadata')
+            with profile_stage('full.metadata'):
+                self.scrap_metadata(self.url_list)
+            self.pause(ScraperConfig.METHOD_BREAK)
             
             print('initiating comment scraping')
-            self.scrap_comments(self.url_list)
-            time.sleep(ScraperConfig.METHOD_BREAK)
+            self.checkpoint.save(stage='comments')
+            with profile_stage('full.comments'):
+                self.scrap_comments(self.url_list)
+            self.pause(ScraperConfig.METHOD_BREAK)
             
-            full_data = self.merge_results() 
-            self.update_database(full_data)
+            self.checkpoint.save(stage='merge')
+            with profile_stage('full.merge'):
+                full_data = self.merge_results() 
+                self.update_database(full_data)
         else:
-            with open(self.name, 'a') as file:
-                file.write(f'No new URLs acquired\n')
-                print(f'No new URLs acquired')
+            self.log('urls', 'No new URLs acquired', urls=0)
             
+    def pipelined_run(self):
+        """Streaming alternative to full_run: URLs are fetched and merged while 
+        discovery is still running, merged records are stored as they complete.
+        What cannot be merged is kept for the left over runs"""
+        from pipeline import StreamingPipeline
+
+        print('initiating pipelined run')
+        set_status(stage='pipeline')
+        self.checkpoint.save(stage='pipeline')
+        start_time = time.time()
+        pipeline = StreamingPipeline(self.url_index, self.driver_pool, self.store_records,
+                                     self.metadata_controller, self.comments_controller)
+        with profile_stage('pipeline'):
+            full_data = pipeline.run()
+        difference = f"{time.time() - start_time:.2f}"
+        
+        # left overs join the ones of earlier runs, halves that complete 
+        # each other are merged by the next left over run
+        unprocessed_urls, metadata, comments = pipeline.left_overs()
+        self.join.add_urls(unprocessed_urls)
+        for url, value in metadata.items():
+            self.join.add_metadata(url, value)
+        for url, value in comments.items():
+            self.join.add_comments(url, value)
+        self.storage.write(METADATA_PATH, self.join.metadata())
+        self.storage.write(COMMENTS_PATH, self.join.comments())
+        self.url_list = self.join.unprocessed()
+        self.storage.write(URLS_PATH, self.url_list)
+        self.discovered_url_count = len(pipeline.discovered)
+        
+        self.log('pipeline', f'Pipeline discovered {len(pipeline.discovered)} URLs and merged {len(full_data)} in {difference} seconds, '
+                 f'median latency {pipeline.median_latency():.2f} seconds',
+                 discovered=len(pipeline.discovered), merged=len(full_data), seconds=float(difference),
+                 median_latency=pipeline.median_latency())
+        self.log_failures(pipeline.metadata_retries, 'metadata')
+        self.log_failures(pipeline.comments_retries, 'comments')
+        self.log_controller(self.metadata_controller, 'metadata')
+        self.log_controller(self.comments_controller, 'comments')
+        self.update_database(full_data, stored=True)
+    
+    def refresh_budget(self) -> int:
+        """Number of stats refreshes that keeps them at REFRESH_SHARE of the 
+        video page requests of the latest run"""
+        share = ScraperConfig.REFRESH_SHARE
+        return max(ScraperConfig.REFRESH_MIN_BUDGET, int(self.discovered_url_count * share / (1 - share)))
+    
+    def refresh_run(self, budget:int=None):
+        """Re-fetches the metadata of the known videos that are due, most overdue first,
+        and appends their stats as time-stamped snapshots. The records are not modified
+
+        Parameters
+        ----------
+        budget : int, optional
+            maximum number of videos to refresh, by default every due video
+        """
+        from refresh import (SCHEDULE_FIELDS, SCHEDULE_SNAPSHOTS,
+                             RefreshScheduler, StatsRefresher)
+
+        scheduler = RefreshScheduler(self.storage.read_fields(SCHEDULE_FIELDS),
+                                     self.storage.read_snapshots(SCHEDULE_SNAPSHOTS))
+        url_list = scheduler.pop_due(budget)
+        if not url_list:
+            self.log('refresh', 'No videos due for a stats refresh', due=0)
+            return
+        print('initiating stats refresh')
+        set_status(stage='refresh', queued=len(url_list))
+        self.checkpoint.save(stage='refresh')
+        start_time = time.time()
+        with profile_stage('refresh'):
+            refresher = StatsRefresher(url_list, self.metadata_controller)
+            snapshots = refresher.get_snapshots()
+            self.storage.append_snapshots(snapshots)
+        difference = f"{time.time() - start_time:.2f}"
+        self.log('refresh', f'Stats of {len(snapshots)} out of {len(url_list)} due videos refreshed in {difference} seconds',
+                 refreshed=len(snapshots), due=len(url_list), seconds=float(difference), scheduled=len(scheduler))
+        self.log_failures(refresher.retries, 'refresh')
+    
     def left_over_run(self, clear:bool=False):
         """Scrap only metadata and comments for left over urls
         merge the results and updates the database
@@ -267,83 +468,140 @@ class Scraper:
         clear : bool, optional
             if True, clears the database for urls, metadata, and comments
         """
-        with open(self.name, 'a') as file:
-                file.write(f'\n{"-"*5}Initiating Left Over Run{"-"*5}\n')
-                print(f'\n{"-"*5}Initiating Left Over Run{"-"*5}')
+        self.log('left_over_run', f'\n{"-"*5}Initiating Left Over Run{"-"*5}')
+        set_status(run='left_over')
                 
         self.update_missing_data()
             
         if self.missing_metadata_urls + self.url_list: 
             print('initiating metadata scraping')
-            metadata_old = utils.read('data/fetched_metadata.json')
-            self.scrap_metadata(list(set(self.missing_metadata_urls + self.url_list)))
-            metadata_new = utils.read('data/fetched_metadata.json')
-            metadata = metadata_old | metadata_new 
-            utils.write('data/fetched_metadata.json', metadata)
-            time.sleep(ScraperConfig.METHOD_BREAK)
+            self.checkpoint.save(stage='metadata')
+            with profile_stage('left_over.metadata'):
+                self.scrap_metadata(list(set(self.missing_metadata_urls + self.url_list)))
+            self.pause(ScraperConfig.METHOD_BREAK)
         
         if self.missing_comment_urls + self.url_list:
             print('initiating comment scraping')
-            comments_old = utils.read('data/fetched_comments.json')
-            self.scrap_comments(list(set(self.missing_comment_urls + self.url_list)))
-            comments_new = utils.read('data/fetched_comments.json')
-            comments = comments_old | comments_new
-            utils.write('data/fetched_comments.json', comments)
-            time.sleep(ScraperConfig.METHOD_BREAK)
+            self.checkpoint.save(stage='comments')
+            with profile_stage('left_over.comments'):
+                self.scrap_comments(list(set(self.missing_comment_urls + self.url_list)))
+            self.pause(ScraperConfig.METHOD_BREAK)
+        
+        self.checkpoint.save(stage='merge')
+        with profile_stage('left_over.merge'):
+            full_data = self.merge_results(clear)
+            self.update_database(full_data)
         
-        full_data = self.merge_results(clear)
-        self.update_database(full_data)
+    def resume(self):
+        """Finishes the run interrupted at the checkpoint. The fetched data was kept, 
+        so discovery continues from the saved URLs and only the URLs missing 
+        metadata or comments are fetched again
+
+        Returns
+        -------
+        int
+            index of the left over run to continue with, None if there is nothing to resume
+        """
+        checkpoint, self.resume_from = self.resume_from, {}
+        if not checkpoint:
+            return None
+        run, stage = checkpoint.get('run'), checkpoint.get('stage')
+        self.log('resume', f'Resuming the {run} run of {checkpoint.get("run_log")} interrupted at the {stage} stage',
+                 **checkpoint)
+        set_status(resumed_from=checkpoint)
+        self.url_list = self.join.unprocessed()
+        if run == 'left_over':
+            return checkpoint.get('left_over', 0)
+        if stage == 'urls':
+            with profile_stage('full.urls'):
+                self.scrap_urls()
+            self.url_list = self.join.unprocessed()
+        if stage in ('urls', 'metadata', 'comments', 'merge'):
+            # fetches what the full run is missing and merges it
+            self.left_over_run()
+        # in-flight pipeline results and stats refreshes are not kept, 
+        # the left over runs pick up from the fetched data
+        return 0
         
     def scrap(self):
         """Main scraper method
-        Runs the scraper until desired total number of URLs are fully processed"""
+        Runs the scraper until desired total number of URLs are fully processed.
+        An interrupted run is resumed from its checkpoint first"""
         start_time = time.time()
-        all_data = utils.read('data/fetched_full_data.json')
+        first_left_over = self.resume()
+        all_data = self.storage.read(FULL_DATA_PATH)
         
         def perform_left_over_run(clear=False):
             nonlocal all_data
             self.left_over_run(clear=clear)
-            all_data = utils.read('data/fetched_full_data.json')
+            all_data = self.storage.read(FULL_DATA_PATH)
             if len(all_data) >= ScraperConfig.TOTAL_SCRAP_COUNT:
                 return True
-            time.sleep(ScraperConfig.RUN_BREAK)
+            self.pause(ScraperConfig.RUN_BREAK)
             return False
           
         outer_break = False  
         while len(all_data) < ScraperConfig.TOTAL_SCRAP_COUNT and not outer_break:
-            with open(self.name, 'a') as file:
-                file.write(f'\n{"-"*5}Initiating Full Run{"-"*5}\n')
-                print(f'\n{"-"*5}Initiating Full Run{"-"*5}')
-            self.full_run()
-            all_data = utils.read('data/fetched_full_data.json')
-            
-            # if enough data is collected after full run, break
-            if len(all_data) >= ScraperConfig.TOTAL_SCRAP_COUNT:
-                break
-            time.sleep(ScraperConfig.RUN_BREAK)
+            # a resumed run goes on with its left over runs
+            if first_left_over is None:
+                self.log('full_run', f'\n{"-"*5}Initiating Full Run{"-"*5}')
+                set_status(run='full', collected=len(all_data))
+                self.checkpoint.save(run='full', left_over=None, run_log=self.name)
+                if ScraperConfig.RUN_MODE == 'pipelined':
+                    self.pipelined_run()
+                else:
+                    self.full_run()
+                if ScraperConfig.REFRESH_STATS:
+                    self.refresh_run(self.refresh_budget())
+                all_data = self.storage.read(FULL_DATA_PATH)
+                
+                # if enough data is collected after full run, break
+                if len(all_data) >= ScraperConfig.TOTAL_SCRAP_COUNT:
+                    break
+                self.pause(ScraperConfig.RUN_BREAK)
+                first_left_over = 0
             
             # start left over run 
-            for i in range(ScraperConfig.LEFT_OVER_RUN_COUNT):
+            for i in range(first_left_over, ScraperConfig.LEFT_OVER_RUN_COUNT):
                 # on the last iteration, clear database
                 clear_database = i == ScraperConfig.LEFT_OVER_RUN_COUNT - 1
+                self.checkpoint.save(run='left_over', left_over=i, stage='metadata', run_log=self.name)
                 # if enough data is collected, break the inner and outer loop
                 if perform_left_over_run(clear=clear_database):
                     outer_break = True
                     break
+            first_left_over = None
                 
-            with open(self.name, 'a') as file:
-                file.write(f'TOTAL {len(all_data)} URLs processed so far\n')
-                print(f'TOTAL {len(all_data)} URLs processed so far')
-            all_data = utils.read('data/fetched_full_data.json')
-        all_data = utils.read('data/fetched_full_data.json')
+            self.log('total', f'TOTAL {len(all_data)} URLs processed so far', collected=len(all_data))
+            set_status(collected=len(all_data))
+            all_data = self.storage.read(FULL_DATA_PATH)
+        all_data = self.storage.read(FULL_DATA_PATH)
+        self.checkpoint.clear()
         end_time = time.time()
         difference = f"{end_time - start_time:.2f}"
-        with open(self.name, 'a') as file:
-            file.write(f'In total {len(all_data)} URLs processed in {difference} seconds\n')
-            print(f'In total {len(all_data)} URLs processed in {difference} seconds')
+        self.log('done', f'In total {len(all_data)} URLs processed in {difference} seconds', 
+                 collected=len(all_data), seconds=float(difference))
+        set_status(stage='done', collected=len(all_data))
+
+    def close(self):
+        """Shuts down the Chrome drivers and the storage backend, 
+        and sums up the profiles of the run"""
+        if self.driver_pool is not None:
+            self.driver_pool.close()
+        self.storage.close()
+        if self.language_tagger is not None:
+            self.language_tagger.close()
+        if self.profile_dir is not None:
+            report(self.profile_dir)
+            stop()
+            self.log('profile', f'Profiles written to {self.profile_dir}', directory=self.profile_dir)
+            self.profile_dir = None
 
 if __name__ == '__main__': 
     scraper = Scraper()
-    scraper.scrap()
+    try:
+        scraper.scrap()
+    finally:
+        scraper.close()
 
 
@@ -0,0 +1,868 @@
+"""Storage backends for the database and the fetched data of a run"""
+
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import utils
+from comment_store import LOOKUP_CHUNK, CommentStore
+from config import ScraperConfig
+from journal import ResultJournal
+from metrics import STORAGE_WRITE
+
+URLS_PATH = 'data/fetched_urls.json'
+METADATA_PATH = 'data/fetched_metadata.json'
+COMMENTS_PATH = 'data/fetched_comments.json'
+FULL_DATA_PATH = 'data/fetched_full_data.json'
+DATABASE_PATH = 'data/database.json'
+SNAPSHOTS_PATH = 'data/snapshots.jsonl'
+
+# fetched data that is reset at the beginning of every scraper run
+FETCHED_PATHS = {URLS_PATH: [], COMMENTS_PATH: {}, METADATA_PATH: {}, FULL_DATA_PATH: {}}
+
+
+def video_id(url:str):
+    """
+    Extracts the numeric video ID from a video URL.
+
+    Parameters
+    ----------
+    url : str
+        The video URL, e.g. https://www.tiktok.com/@user/video/7375775673576705312
+
+    Returns
+    -------
+    int
+        The video ID, or None if the URL does not end with one.
+    """
+    tail = url.rstrip('/').split('/')[-1]
+    return int(tail) if tail.isdigit() else None
+
+
+class JsonStorage:
+    """
+    Keeps the database and the fetched data in JSON files under data/.
+    With ScraperConfig.COMMENT_STORE, the fetched comments and the comments
+    of the database records are kept in the comment store of an SQLite file
+    instead, ScraperConfig.COMMENT_STORE_PATH: database.json holds the records
+    without 'Comments' and fetched_comments.json is no longer written. read
+    joins them back in.
+    """
+
+    def __init__(self) -> None:
+        self._known_urls = None
+        self.comment_db = None
+        if ScraperConfig.COMMENT_STORE:
+            self.comment_db = SQLiteStorage(ScraperConfig.COMMENT_STORE_PATH, comment_store=True)
+
+    def initialize(self, reset=FETCHED_PATHS):
+        """
+        Creates the data directory, the missing fetched data files and the database.
+
+        Parameters
+        ----------
+        reset : iterable, optional
+            Fetched data paths emptied even if they exist, by default all of them
+        """
+        if not os.path.exists('data'):
+            os.makedirs('data')
+        for path, empty in FETCHED_PATHS.items():
+            if path == COMMENTS_PATH and self.comment_db is not None:
+                self.comment_db.initialize([path] if path in reset else [])
+                continue
+            if path in reset or not os.path.exists(path):
+                utils.write(path, empty)
+        if not os.path.exists(DATABASE_PATH):
+            utils.write(DATABASE_PATH, {})
+
+    def read(self, path:str):
+        """Reads the fetched data or the database stored at path"""
+        if self.comment_db is not None and path == COMMENTS_PATH:
+            return self.comment_db.read(path)
+        data = utils.read(path)
+        if self.comment_db is not None and path == DATABASE_PATH:
+            self._join_comments(data)
+        return data
+
+    def _join_comments(self, records:dict, urls:list=None):
+        """Puts the stored comments back into records, records stored before the
+        comment store keep their own"""
+        comments = self.comment_db.read_comments(urls)
+        for url, record in records.items():
+            if url in comments:
+                record['Comments'] = comments[url]
+
+    def write(self, path:str, data):
+        """Replaces the fetched data or the database stored at path"""
+        if self.comment_db is not None and path == COMMENTS_PATH:
+            self.comment_db.write(path, data)
+            return
+        with STORAGE_WRITE.time(os.path.basename(path)):
+            if self.comment_db is not None and path == DATABASE_PATH:
+                data = self.comment_db.store_comments(data, replace=True)
+            utils.write(path, data)
+
+    def append(self, path:str, data:dict):
+        """Adds entries to the fetched data stored at path, through its journal
+        instead of rewriting the file when RESULT_STORAGE is 'journal'"""
+        if self.comment_db is not None and path == COMMENTS_PATH:
+            self.comment_db.append(path, data)
+            return
+        if ScraperConfig.RESULT_STORAGE != 'journal':
+            with STORAGE_WRITE.time(os.path.basename(path)):
+                utils.write(path, utils.read(path) | data)
+            return
+        journal = ResultJournal(path)
+        for url, value in data.items():
+            journal.append(url, value)
+        journal.close()
+
+    def count(self, path:str) -> int:
+        """Number of entries stored at path"""
+        if self.comment_db is not None and path == COMMENTS_PATH:
+            return self.comment_db.count(path)
+        return len(utils.read(path))
+
+    def remove(self, path:str, urls:list):
+        """Removes the entries of the given URLs from the fetched data stored at path"""
+        if self.comment_db is not None and path == COMMENTS_PATH:
+            self.comment_db.remove(path, urls)
+            return
+        urls = set(urls)
+        data = utils.read(path)
+        if isinstance(data, list):
+            data = [url for url in data if url not in urls]
+        else:
+            data = {url: value for url, value in data.items() if url not in urls}
+        with STORAGE_WRITE.time(os.path.basename(path)):
+            utils.write(path, data)
+
+    def video_comments(self, url:str) -> list:
+        """
+        Comments of a single database record, without loading the database
+        when they are in the comment store.
+
+        Parameters
+        ----------
+        url : str
+            The video URL.
+
+        Returns
+        -------
+        list
+            The comments, None if the URL is not in the database.
+        """
+        if self.comment_db is not None:
+            comments = self.comment_db.read_comments([url])
+            if url in comments:
+                return comments[url]
+        return utils.read(DATABASE_PATH).get(url, {}).get('Comments')
+
+    def open_sink(self, path:str, compact_every:int=None):
+        """
+        Returns the sink the video processors append their results to.
+
+        Parameters
+        ----------
+        path : str
+            The fetched data the results belong to.
+        compact_every : int, optional
+            Number of results between journal compactions, by default None
+
+        Returns
+        -------
+        ResultJournal | SQLiteResultSink
+            The journal of the file, or None if every result rewrites the file.
+            The sink of the comment store for the fetched comments.
+        """
+        if self.comment_db is not None and path == COMMENTS_PATH:
+            return self.comment_db.open_sink(path, compact_every)
+        if ScraperConfig.RESULT_STORAGE == 'journal':
+            return ResultJournal(path, compact_every=compact_every)
+        return None
+
+    def existing_urls(self) -> set:
+        """All URLs stored in the database"""
+        return set(utils.read(DATABASE_PATH).keys())
+
+    def filter_new(self, urls:list) -> list:
+        """
+        Filters out the URLs that already exist in the database.
+        The database keys are loaded once per storage instance.
+
+        Parameters
+        ----------
+        urls : list
+            Candidate video URLs.
+
+        Returns
+        -------
+        list
+            The URLs that are not in the database, in the given order.
+        """
+        if self._known_urls is None:
+            self._known_urls = self.existing_urls()
+        return [url for url in urls if url not in self._known_urls]
+
+    def update_database(self, full_data:dict) -> int:
+        """
+        Adds the merged records to the database.
+
+        Parameters
+        ----------
+        full_data : dict --> keys: URLs | values: metadata + comments
+
+        Returns
+        -------
+        int
+            Number of URLs that did not exist in the database.
+        """
+        database = utils.read(DATABASE_PATH)
+        new_data = set(full_data.keys()).difference(set(database.keys()))
+        with STORAGE_WRITE.time(os.path.basename(DATABASE_PATH)):
+            if self.comment_db is not None:
+                full_data = self.comment_db.store_comments(full_data)
+            utils.write(DATABASE_PATH, database | full_data)
+        self._known_urls = None
+        return len(new_data)
+
+    def iter_records(self, after:int=0, chunk_size:int=1000):
+        """
+        Iterates over the database in chunks, in the order the records were added.
+        The JSON database is loaded once, records added later come after the
+        existing ones since new keys are appended to the dict.
+
+        Parameters
+        ----------
+        after : int, optional
+            Cursor returned with an earlier chunk, only later records are read, by default 0
+        chunk_size : int, optional
+            Number of records per chunk, by default 1000
+
+        Yields
+        ------
+        tuple
+            (cursor, chunk) --> chunk: keys: URLs | values: records
+        """
+        items = list(utils.read(DATABASE_PATH).items())
+        for start in range(after, len(items), chunk_size):
+            chunk = dict(items[start:start + chunk_size])
+            if self.comment_db is not None:
+                self._join_comments(chunk, list(chunk))
+            yield start + len(chunk), chunk
+
+    def append_snapshots(self, snapshots:dict):
+        """
+        Appends time-stamped stats snapshots, one JSON line each.
+
+        Parameters
+        ----------
+        snapshots : dict --> keys: URLs | values: stats with 'Collected At'
+        """
+        with open(SNAPSHOTS_PATH, 'a') as file:
+            for url, snapshot in snapshots.items():
+                file.write(json.dumps({'url': url, **snapshot}) + '\n')
+
+    def read_fields(self, fields:tuple) -> dict:
+        """
+        Reads some fields of every database record, without joining the comments.
+
+        Parameters
+        ----------
+        fields : tuple
+            Record fields, fields a record lacks are left out.
+
+        Returns
+        -------
+        dict
+            keys: URLs | values: dicts of the fields
+        """
+        return {url: {field: record[field] for field in fields if field in record}
+                for url, record in utils.read(DATABASE_PATH).items()}
+
+    def read_snapshots(self, last:int=None) -> dict:
+        """
+        Reads the stats snapshots of the database.
+
+        Parameters
+        ----------
+        last : int, optional
+            Number of the latest snapshots read per video, by default all
+
+        Returns
+        -------
+        dict
+            keys: URLs | values: snapshots in the order they were collected
+        """
+        snapshots = {}
+        if not os.path.exists(SNAPSHOTS_PATH):
+            return snapshots
+        with open(SNAPSHOTS_PATH) as file:
+            for line in file:
+                try:
+                    snapshot = json.loads(line)
+                except ValueError:
+                    continue
+                history = snapshots.setdefault(snapshot.pop('url'), collections.deque(maxlen=last))
+                history.append(snapshot)
+        return {url: list(history) for url, history in snapshots.items()}
+
+    def close(self):
+        """Closes the comment store, nothing to release for JSON files"""
+        if self.comment_db is not None:
+            self.comment_db.close()
+
+
+class SQLiteResultSink:
+    """
+    Writes the results of a fetch batch into an SQLite table.
+
+    Follows the ResultJournal interface so the video processors can use either.
+    Results are committed in batches of ScraperConfig.SQLITE_BATCH_SIZE, or one
+    by one when the sink is shared by several processes. The first result of a
+    batch replaces the table, like a batch that rewrites the JSON file.
+
+    Parameters
+    ----------
+    storage : SQLiteStorage
+        The storage that owns the table.
+    path : str
+        The fetched data the results belong to.
+    batch_size : int, optional
+        Number of results per transaction, by default ScraperConfig.SQLITE_BATCH_SIZE
+    """
+
+    def __init__(self, storage, path:str, batch_size:int=None) -> None:
+        self.storage = storage
+        self.path = path
+        self.batch_size = batch_size or ScraperConfig.SQLITE_BATCH_SIZE
+        self.batch_id = None
+        self._buffer = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffer'] = []
+        return state
+
+    def begin_batch(self):
+        """Marks the start of a fetch batch"""
+        self.batch_id = f'{os.getpid()}-{time.time()}'
+        table = self.storage.TABLES[self.path]
+        with self.storage.transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO batches (name, batch_id, pending_reset) VALUES (?, ?, 1)',
+                               (table, self.batch_id))
+
+    def append(self, key:str, value):
+        """Buffers a single fetched result and commits full batches"""
+        self._buffer.append((key, value))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Commits the buffered results in a single transaction"""
+        if not self._buffer:
+            return
+        table = self.storage.TABLES[self.path]
+        with STORAGE_WRITE.time(os.path.basename(self.path)), self.storage.transaction() as connection:
+            if self.batch_id is not None:
+                reset = connection.execute('UPDATE batches SET pending_reset = 0 '
+                                           'WHERE name = ? AND batch_id = ? AND pending_reset = 1',
+                                           (table, self.batch_id))
+                if reset.rowcount:
+                    self.storage._clear(connection, table)
+            self.storage._upsert(connection, table, self._buffer)
+        self._buffer = []
+
+    def close(self):
+        """Commits the remaining results"""
+        self.flush()
+
+    def compact(self):
+        """Commits the remaining results, nothing to fold back for SQLite"""
+        self.flush()
+
+
+class SQLiteStorage:
+    """
+    Keeps the database and the fetched data in a single SQLite file in WAL mode.
+
+    Every JSON path maps to an indexed table, so lookups and upserts no longer
+    load the whole database. Connections are opened per process and thread.
+    With the comment store, the fetched comments and the comments of the
+    records are kept as interned string IDs in the comment store tables.
+
+    Parameters
+    ----------
+    path : str, optional
+        The SQLite file, by default ScraperConfig.SQLITE_PATH
+    comment_store : bool, optional
+        Keep comments in the comment store, by default ScraperConfig.COMMENT_STORE
+    """
+
+    TABLES = {URLS_PATH: 'urls',
+              METADATA_PATH: 'metadata',
+              COMMENTS_PATH: 'comments',
+              FULL_DATA_PATH: 'run_records',
+              DATABASE_PATH: 'records'}
+    # tables whose comments are kept in the comment store, also its namespaces
+    COMMENT_TABLES = ('comments', 'records')
+
+    def __init__(self, path:str=None, comment_store:bool=None) -> None:
+        self.path = path or ScraperConfig.SQLITE_PATH
+        if comment_store is None:
+            comment_store = ScraperConfig.COMMENT_STORE
+        self.comment_store = CommentStore() if comment_store else None
+        self._local = threading.local()
+        self._create_tables()
+
+    def __getstate__(self):
+        return {'path': self.path, 'comment_store': self.comment_store is not None}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.comment_store = CommentStore() if state['comment_store'] else None
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current process and thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def transaction(self):
+        """Context manager running the enclosed statements in a single write transaction"""
+        return _Transaction(self._connection())
+
+    def _create_tables(self):
+        """Creates the tables and their indexes"""
+        with self.transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS urls ('
+                               'position INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               'url TEXT UNIQUE NOT NULL, video_id INTEGER)')
+            for table in ('metadata', 'comments', 'run_records', 'records'):
+                connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                                   'url TEXT PRIMARY KEY, video_id INTEGER, '
+                                   'data TEXT NOT NULL, updated_at REAL NOT NULL)')
+                connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_video_id ON {table} (video_id)')
+            connection.execute('CREATE TABLE IF NOT EXISTS batches ('
+                               'name TEXT PRIMARY KEY, batch_id TEXT, pending_reset INTEGER)')
+            connection.execute('CREATE TABLE IF NOT EXISTS snapshots ('
+                               'url TEXT NOT NULL, collected_at REAL NOT NULL, data TEXT NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS snapshots_url ON snapshots (url, collected_at)')
+            if self.comment_store is not None:
+                CommentStore.create_tables(connection)
+
+    def _split_comments(self, connection:sqlite3.Connection, table:str, items) -> list:
+        """Puts the comments of (url, value) pairs into the comment store and 
+        returns the pairs that are left for the table"""
+        items = list(items)
+        if table == 'comments':
+            self.comment_store.put(connection, table, items)
+            return []
+        self.comment_store.put(connection, table, [(url, record.get('Comments')) for url, record in items])
+        return [(url, {key: value for key, value in record.items() if key != 'Comments'}) for url, record in items]
+
+    def _join_comments(self, connection:sqlite3.Connection, records:dict, urls:list=None):
+        """Puts the stored comments back into records, records stored before the 
+        comment store keep their own"""
+        if urls is None:
+            comments = self.comment_store.read(connection, 'records')
+        else:
+            comments = self.comment_store.get_many(connection, 'records', urls)
+        for url, record in records.items():
+            if url in comments:
+                record['Comments'] = comments[url]
+
+    def _clear(self, connection:sqlite3.Connection, table:str):
+        """Deletes every row of a table and its comments"""
+        connection.execute(f'DELETE FROM {table}')
+        if self.comment_store is not None and table in self.COMMENT_TABLES:
+            self.comment_store.clear(connection, table)
+
+    def _upsert(self, connection:sqlite3.Connection, table:str, items):
+        """Inserts or replaces (url, value) pairs of a table"""
+        if self.comment_store is not None and table in self.COMMENT_TABLES:
+            items = self._split_comments(connection, table, items)
+        now = time.time()
+        connection.executemany(f'INSERT OR REPLACE INTO {table} (url, video_id, data, updated_at) '
+                               'VALUES (?, ?, ?, ?)',
+                               [(url, video_id(url), json.dumps(value), now) for url, value in items])
+
+    def initialize(self, reset=FETCHED_PATHS):
+        """
+        Resets the fetched data, the database is kept.
+
+        Parameters
+        ----------
+        reset : iterable, optional
+            Fetched data paths emptied, by default all of them
+        """
+        with self.transaction() as connection:
+            for path in reset:
+                self._clear(connection, self.TABLES[path])
+
+    def read(self, path:str):
+        """Reads the fetched data or the database stored at path"""
+        table = self.TABLES[path]
+        connection = self._connection()
+        if table == 'urls':
+            return [row[0] for row in connection.execute('SELECT url FROM urls ORDER BY position')]
+        if self.comment_store is not None and table == 'comments':
+            return self.comment_store.read(connection, table)
+        data = {url: json.loads(data) for url, data in connection.execute(f'SELECT url, data FROM {table}')}
+        if self.comment_store is not None and table == 'records':
+            self._join_comments(connection, data)
+        return data
+
+    def write(self, path:str, data):
+        """Replaces the fetched data or the database stored at path"""
+        table = self.TABLES[path]
+        with STORAGE_WRITE.time(os.path.basename(path)), self.transaction() as connection:
+            self._clear(connection, table)
+            if table == 'urls':
+                connection.executemany('INSERT OR IGNORE INTO urls (url, video_id) VALUES (?, ?)',
+                                       [(url, video_id(url)) for url in data])
+            else:
+                self._upsert(connection, table, data.items())
+
+    def append(self, path:str, data:dict):
+        """Upserts entries into the fetched data stored at path in a single transaction"""
+        with STORAGE_WRITE.time(os.path.basename(path)), self.transaction() as connection:
+            self._upsert(connection, self.TABLES[path], data.items())
+
+    def count(self, path:str) -> int:
+        """Number of entries stored at path"""
+        table = self.TABLES[path]
+        if self.comment_store is not None and table == 'comments':
+            return self.comment_store.count(self._connection(), table)
+        return self._connection().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    def remove(self, path:str, urls:list):
+        """Removes the entries of the given URLs from the fetched data stored at path"""
+        table = self.TABLES[path]
+        urls = list(urls)
+        with STORAGE_WRITE.time(os.path.basename(path)), self.transaction() as connection:
+            if self.comment_store is not None and table in self.COMMENT_TABLES:
+                self.comment_store.remove(connection, table, urls)
+            for start in range(0, len(urls), LOOKUP_CHUNK):
+                chunk = urls[start:start + LOOKUP_CHUNK]
+                connection.execute(f'DELETE FROM {table} WHERE url IN ({",".join("?" * len(chunk))})', chunk)
+
+    def video_comments(self, url:str) -> list:
+        """
+        Comments of a single database record, with indexed lookups.
+
+        Parameters
+        ----------
+        url : str
+            The video URL.
+
+        Returns
+        -------
+        list
+            The comments, None if the URL is not in the database.
+        """
+        connection = self._connection()
+        if self.comment_store is not None:
+            comments = self.comment_store.get(connection, 'records', url)
+            if comments is not None:
+                return comments
+        row = connection.execute('SELECT data FROM records WHERE url = ?', (url,)).fetchone()
+        return json.loads(row[0]).get('Comments') if row is not None else None
+
+    def read_comments(self, urls:list=None) -> dict:
+        """
+        Comments of the database records from the comment store.
+
+        Parameters
+        ----------
+        urls : list, optional
+            Only the comments of these URLs, by default all of them
+
+        Returns
+        -------
+        dict
+            keys: URLs | values: comment lists
+        """
+        connection = self._connection()
+        if urls is None:
+            return self.comment_store.read(connection, 'records')
+        return self.comment_store.get_many(connection, 'records', urls)
+
+    def store_comments(self, records:dict, replace:bool=False) -> dict:
+        """
+        Puts the comments of records into the comment store, for the JSON backend.
+
+        Parameters
+        ----------
+        records : dict
+            keys: URLs | values: metadata + comments
+        replace : bool, optional
+            If True, the stored comments of other records are removed, by default False
+
+        Returns
+        -------
+        dict
+            The records without their comments.
+        """
+        with self.transaction() as connection:
+            if replace:
+                self.comment_store.clear(connection, 'records')
+            return dict(self._split_comments(connection, 'records', records.items()))
+
+    def open_sink(self, path:str, compact_every:int=None):
+        """
+        Returns the sink the video processors append their results to.
+
+        Parameters
+        ----------
+        path : str
+            The fetched data the results belong to.
+        compact_every : int, optional
+            Only used by the JSON journal, any value enables batched commits
+            (the sink is owned by a single process), by default None
+
+        Returns
+        -------
+        SQLiteResultSink
+        """
+        return SQLiteResultSink(self, path, batch_size=None if compact_every else 1)
+
+    def existing_urls(self) -> set:
+        """All URLs stored in the database"""
+        return {row[0] for row in self._connection().execute('SELECT url FROM records')}
+
+    def filter_new(self, urls:list) -> list:
+        """
+        Filters out the URLs that already exist in the database with indexed lookups.
+
+        Parameters
+        ----------
+        urls : list
+            Candidate video URLs.
+
+        Returns
+        -------
+        list
+            The URLs that are not in the database, in the given order.
+        """
+        connection = self._connection()
+        return [url for url in urls
+                if connection.execute('SELECT 1 FROM records WHERE url = ?', (url,)).fetchone() is None]
+
+    def update_database(self, full_data:dict) -> int:
+        """
+        Upserts the merged records into the database in a single transaction.
+
+        Parameters
+        ----------
+        full_data : dict --> keys: URLs | values: metadata + comments
+
+        Returns
+        -------
+        int
+            Number of URLs that did not exist in the database.
+        """
+        with STORAGE_WRITE.time(os.path.basename(DATABASE_PATH)), self.transaction() as connection:
+            before = connection.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+            self._upsert(connection, 'records', full_data.items())
+            after = connection.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        return after - before
+
+    def iter_records(self, after:int=0, chunk_size:int=1000):
+        """
+        Iterates over the database in chunks of rows, without loading the whole table.
+        The cursor is the rowid: an upsert gives the row a new rowid, so updated
+        records come after the earlier cursors too.
+
+        Parameters
+        ----------
+        after : int, optional
+            Cursor returned with an earlier chunk, only later records are read, by default 0
+        chunk_size : int, optional
+            Number of records per chunk, by default 1000
+
+        Yields
+        ------
+        tuple
+            (cursor, chunk) --> chunk: keys: URLs | values: records
+        """
+        connection = self._connection()
+        while True:
+            rows = connection.execute('SELECT rowid, url, data FROM records WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                                      (after, chunk_size)).fetchall()
+            if not rows:
+                return
+            after = rows[-1][0]
+            chunk = {url: json.loads(data) for _, url, data in rows}
+            if self.comment_store is not None:
+                self._join_comments(connection, chunk, list(chunk))
+            yield after, chunk
+
+    def append_snapshots(self, snapshots:dict):
+        """
+        Appends time-stamped stats snapshots in a single transaction.
+
+        Parameters
+        ----------
+        snapshots : dict --> keys: URLs | values: stats with 'Collected At'
+        """
+        with self.transaction() as connection:
+            connection.executemany('INSERT INTO snapshots (url, collected_at, data) VALUES (?, ?, ?)',
+                                   [(url, snapshot['Collected At'], json.dumps(snapshot))
+                                    for url, snapshot in snapshots.items()])
+
+    def read_fields(self, fields:tuple) -> dict:
+        """
+        Reads some fields of every database record, extracted by SQLite without
+        decoding the records or joining the comments.
+
+        Parameters
+        ----------
+        fields : tuple
+            Record fields, fields a record lacks are left out.
+
+        Returns
+        -------
+        dict
+            keys: URLs | values: dicts of the fields
+        """
+        columns = ', '.join('json_extract(data, ?)' for _ in fields)
+        paths = [f'$.{json.dumps(field)}' for field in fields]
+        return {url: {field: value for field, value in zip(fields, values) if value is not None}
+                for url, *values in self._connection().execute(f'SELECT url, {columns} FROM records', paths)}
+
+    def read_snapshots(self, last:int=None) -> dict:
+        """
+        Reads the stats snapshots of the database.
+
+        Parameters
+        ----------
+        last : int, optional
+            Number of the latest snapshots read per video, by default all
+
+        Returns
+        -------
+        dict
+            keys: URLs | values: snapshots in the order they were collected
+        """
+        if last is None:
+            rows = self._connection().execute('SELECT url, data FROM snapshots ORDER BY collected_at')
+        else:
+            rows = self._connection().execute('SELECT url, data FROM ('
+                                              'SELECT url, data, collected_at, ROW_NUMBER() OVER '
+                                              '(PARTITION BY url ORDER BY collected_at DESC) AS latest FROM snapshots) '
+                                              'WHERE latest <= ? ORDER BY collected_at', (last,))
+        snapshots = {}
+        for url, data in rows:
+            snapshots.setdefault(url, []).append(json.loads(data))
+        return snapshots
+
+    def close(self):
+        """Closes the connection of the current thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+
+
+class _Transaction:
+    """Runs the enclosed statements in a BEGIN IMMEDIATE transaction"""
+
+    def __init__(self, connection:sqlite3.Connection) -> None:
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.connection.execute('COMMIT')
+        else:
+            self.connection.execute('ROLLBACK')
+        return False
+
+
+_storage = None
+_storage_pid = None
+
+def get_storage():
+    """
+    Returns the storage backend selected by ScraperConfig.STORAGE_BACKEND.
+    The instance is created once per process.
+
+    Returns
+    -------
+    JsonStorage | SQLiteStorage
+    """
+    global _storage, _storage_pid
+    if _storage is None or _storage_pid != os.getpid():
+        if ScraperConfig.STORAGE_BACKEND == 'sqlite':
+            _storage = SQLiteStorage()
+        else:
+            _storage = JsonStorage()
+        _storage_pid = os.getpid()
+    return _storage
+
+def import_json(storage:SQLiteStorage, directory:str='data'):
+    """
+    One-shot import of the existing JSON database and fetched files into SQLite.
+    Missing files are skipped. With the comment store of the JSON backend, the
+    comments are not in the JSON files: they are read from its comment store
+    (ScraperConfig.COMMENT_STORE_PATH in directory) and joined back in.
+
+    Parameters
+    ----------
+    storage : SQLiteStorage
+        The storage to import into.
+    directory : str, optional
+        The directory holding the JSON files, by default 'data'
+    """
+    comment_path = os.path.join(directory, os.path.basename(ScraperConfig.COMMENT_STORE_PATH))
+    comment_db = SQLiteStorage(comment_path, comment_store=True) if os.path.exists(comment_path) else None
+    for path in SQLiteStorage.TABLES:
+        json_path = os.path.join(directory, os.path.basename(path))
+        if path == COMMENTS_PATH and comment_db is not None:
+            # the JSON file is left over from before the comment store, the store is newer
+            data = utils.read(json_path) if os.path.exists(json_path) else {}
+            data |= comment_db.read(COMMENTS_PATH)
+        elif os.path.exists(json_path):
+            data = utils.read(json_path)
+        else:
+            continue
+        if path == DATABASE_PATH:
+            if comment_db is not None:
+                comments = comment_db.read_comments()
+                for url, record in data.items():
+                    if url in comments:
+                        record['Comments'] = comments[url]
+            storage.update_database(data)
+        else:
+            storage.write(path, data)
+        print(f'{len(data)} entries imported from {json_path}')
+    if comment_db is not None:
+        comment_db.close()
+    snapshots_path = os.path.join(directory, os.path.basename(SNAPSHOTS_PATH))
+    if os.path.exists(snapshots_path):
+        with open(snapshots_path) as file:
+            lines = [json.loads(line) for line in file if line.strip()]
+        with storage.transaction() as connection:
+            connection.executemany('INSERT INTO snapshots (url, collected_at, data) VALUES (?, ?, ?)',
+                                   [(line.pop('url'), line['Collected At'], json.dumps(line)) for line in lines])
+        print(f'{len(lines)} snapshots imported from {snapshots_path}')
+
+
+if __name__ == '__main__':
+    import_json(SQLiteStorage())
@@ -0,0 +1,153 @@
+import concurrent.futures
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import user_agents
+import utils
+from config import ScraperConfig
+from extractor import extract_video_info
+from metrics import PARSE_TIME
+from parallel_video_processor import (ProcessComments, ProcessMetaData,
+                                      VideoBatchProcessor)
+from profiler import profiled
+from storage import COMMENTS_PATH, METADATA_PATH, get_storage
+
+
+class ThreadedVideoProcessor(VideoBatchProcessor):
+    """
+    Processes URLs on a thread pool. Each thread keeps its own pooled
+    requests.Session, so connections are reused across URLs, and futures
+    return their results to the calling thread instead of writing to a
+    shared Manager dictionary.
+
+    Parameters
+    ----------
+    url_list : list
+        A list of URLs to be processed.
+    controller : ConcurrencyController, optional
+        Adaptive limit on requests in flight, by default None
+    """
+
+    _local = threading.local()
+    _parse_pool = None
+
+    def __init__(self, url_list, controller=None) -> None:
+        self.url_list = url_list
+        self.controller = controller
+
+    def _session(self) -> requests.Session:
+        """Returns the session of the current thread"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=1)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(user_agents.headers())
+            self._local.session = session
+        return session
+
+    def _send(self, url:str, headers:dict) -> requests.Response:
+        """Sends a GET request on the session of the current thread, admitted by the concurrency controller"""
+        if self.controller is None:
+            return self._session().get(url, headers=headers, timeout=10)
+        with self.controller.slot():
+            start_time = time.monotonic()
+            try:
+                response = self._session().get(url, headers=headers, timeout=self.controller.request_timeout)
+            except requests.Timeout:
+                self.controller.record('timeout')
+                raise
+            except requests.RequestException:
+                self.controller.record('error')
+                raise
+            self.controller.record(response.status_code, time.monotonic() - start_time)
+            return response
+
+    def _parse(self, page:bytes) -> dict:
+        """Extracts the video metadata, on the parse process pool if one is configured"""
+        video_info = None
+        try:
+            with PARSE_TIME.time('video'):
+                if self._parse_pool is not None:
+                    video_info = self._parse_pool.submit(profiled, extract_video_info, page).result()
+                else:
+                    video_info = extract_video_info(page)
+        finally:
+            if not video_info and self.controller is not None:
+                self.controller.record_parse_failure()
+        return video_info
+
+    def _threaded_process(self, url_list:list, path:str, timeout:int):
+        """
+        Processes a list of URLs on ScraperConfig.THREAD_COUNT threads until timeout.
+
+        Parameters
+        ----------
+        url_list : list
+            A list of URLs to be processed.
+        path : str
+            The path where the processed data will be saved.
+        timeout : int
+            Overall timeout in seconds, URLs not processed by then are dropped.
+            Failed URLs are retried through the RetryScheduler of VideoBatchProcessor._scheduled.
+        """
+        sink = get_storage().open_sink(path, compact_every=ScraperConfig.JOURNAL_COMPACT_EVERY)
+        # with RESUME results add to the fetched data instead of replacing it,
+        # without a sink every result rewrites the file with what it already holds
+        if sink and not ScraperConfig.RESUME:
+            sink.begin_batch()
+        results = get_storage().read(path) if ScraperConfig.RESUME and not sink else {}
+        if ScraperConfig.PARSE_PROCESS_COUNT:
+            self._parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=ScraperConfig.PARSE_PROCESS_COUNT)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=ScraperConfig.THREAD_COUNT)
+        try:
+            submit = lambda url: executor.submit(profiled, self._fetch_data, url)
+            for url, fetched_data in self._scheduled(url_list, submit, timeout, 'threaded'):
+                if fetched_data:
+                    results[url] = fetched_data
+                    if sink:
+                        sink.append(url, fetched_data)
+                    else:
+                        utils.write(path, results)
+                    if self.on_result is not None:
+                        self.on_result(url, fetched_data)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if self._parse_pool is not None:
+                self._parse_pool.shutdown(wait=False, cancel_futures=True)
+                self._parse_pool = None
+            if sink:
+                sink.compact()
+
+
+class ThreadedProcessMetaData(ThreadedVideoProcessor, ProcessMetaData):
+
+    def get_metadata(self):
+        """Retrieves metadata for the URLs in the url_list"""
+        self._threaded_process(self.url_list, METADATA_PATH, ScraperConfig.METADATA_SCRAPER_TIMEOUT)
+
+
+class ThreadedProcessComments(ThreadedVideoProcessor, ProcessComments):
+
+    def get_comments(self):
+        """Retrieves comments for the URLs in the url_list"""
+        self._threaded_process(self.url_list, COMMENTS_PATH, ScraperConfig.COMMENT_SCRAPER_TIMEOUT)
+
+
+if __name__ == '__main__':
+    with open('urls.json', 'r') as file:
+        urls = json.load(file)
+    ThreadedProcessMetaData(urls[:10]).get_metadata()
+    ThreadedProcessComments(urls[:10]).get_comments()
+    try:
+        comments = get_storage().read(COMMENTS_PATH)
+        metadata = get_storage().read(METADATA_PATH)
+        print(f'metadata: {len(metadata)}')
+        print(f'comments: {len(comments)}')
+    except Exception as e:
+        print(e)
@@ -1,10 +1,10 @@
 import concurrent.futures
 import multiprocessing
 import re
+import threading
 import time
+from types import SimpleNamespace
 
-from bs4 import BeautifulSoup
-from fake_useragent import UserAgent
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
@@ -12,13 +12,56 @@ from selenium.webdriver.common.keys import Keys
 
 import utils
 from config import ScraperConfig
+from dedupe_index import VideoIdIndex
+from metrics import URLS_DISCOVERED
+from profiler import profiled
+from rate_limiter import get_rate_limiter
+from storage import URLS_PATH, get_storage, video_id
+from user_agents import random_user_agent
 
-ua = UserAgent()
-chrome_options = Options()
-chrome_options.add_argument("--headless")
-chrome_options.add_argument("--no-sandbox")
-chrome_options.add_argument("--disable-dev-shm-usage")
-chrome_options.add_argument("--window-size=1920,1080")
+# arguments of every Chrome driver, besides its user agent
+CHROME_ARGUMENTS = ["--headless", "--no-sandbox", "--disable-dev-shm-usage", "--window-size=1920,1080"]
+
+# Collects video links of ScraperConfig.BASE_URL (passed as the first argument) in the
+# page through a MutationObserver and returns only the links added since the previous call
+LINK_COLLECTOR_SCRIPT = """
+if (!window.__scraperLinks) {
+    const base = arguments[0];
+    const pattern = /^\\/@[^\\/]+\\/(video|photo)\\/\\d+$/;
+    const state = {seen: new Set(), buffer: []};
+    state.collect = (root) => {
+        const anchors = Array.from(root.querySelectorAll('a[href]'));
+        if (root.tagName === 'A') anchors.push(root);
+        for (const anchor of anchors) {
+            const href = anchor.href.split(/[?#]/)[0];
+            if (href.startsWith(base) && pattern.test(href.slice(base.length)) && !state.seen.has(href)) {
+                state.seen.add(href);
+                state.buffer.push(href);
+            }
+        }
+    };
+    state.collect(document);
+    new MutationObserver((mutations) => {
+        for (const mutation of mutations) {
+            for (const node of mutation.addedNodes) {
+                if (node.nodeType === Node.ELEMENT_NODE) state.collect(node);
+            }
+        }
+    }).observe(document.body, {childList: true, subtree: true});
+    window.__scraperLinks = state;
+}
+const links = window.__scraperLinks.buffer;
+window.__scraperLinks.buffer = [];
+return links;
+"""
+
+def create_driver() -> webdriver.Chrome:
+    """Starts a headless Chrome driver with a random user agent"""
+    options = Options()
+    for argument in CHROME_ARGUMENTS:
+        options.add_argument(argument)
+    options.add_argument(f"--user-agent={random_user_agent()}")
+    return webdriver.Chrome(options=options)
 
 def url_verificaiton(url:str) -> bool:   
     """Verifies the URL based on URL structure
@@ -32,10 +75,39 @@ def url_verificaiton(url:str) -> bool:
     bool
         True if the url is verifies, False otherwise
     """
-    pattern = re.compile(r'^https://www\.tiktok\.com/@[^/]+/(video|photo)/\d+$')
+    pattern = re.compile(re.escape(ScraperConfig.BASE_URL) + r'/@[^/]+/(video|photo)/\d+$')
     return bool(pattern.match(url)) 
 
-def fetch_video_urls(url: str, existing_urls: list, shared_video_urls, lock, stop_signal):
+def collect_video_links(driver) -> set:
+    """
+    Collects the video links loaded in the page.
+    In 'incremental' mode only links added since the previous call are returned,
+    otherwise the whole page source is parsed for ScraperConfig.VIDEO_TAG.
+
+    Parameters
+    ----------
+    driver : selenium.webdriver.Chrome
+        The driver showing the hashtag page.
+
+    Returns
+    -------
+    set
+        The video links.
+    """
+    if ScraperConfig.LINK_EXTRACTION == 'incremental':
+        return set(driver.execute_script(LINK_COLLECTOR_SCRIPT, ScraperConfig.BASE_URL))
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(driver.page_source, 'html.parser')
+    videos = soup.find_all('div', {'class': ScraperConfig.VIDEO_TAG}) 
+    return set([video.find('a', href=True)['href'] for video in videos])
+
+def new_discovered_index(urls:list=()) -> VideoIdIndex:
+    """Creates the index of the video IDs discovered in the current run, holding the given URLs"""
+    capacity = 16 * ScraperConfig.URL_SCRAP_COUNT * len(ScraperConfig.HASHTAGS) + len(urls)
+    return VideoIdIndex.create(ScraperConfig.DISCOVERED_INDEX_PATH, [video_id(url) for url in urls], capacity=capacity)
+
+def fetch_video_urls(url: str, existing_urls: list, shared_video_urls, lock, stop_signal, driver=None, discovered=None):
     """
     Fetches video URLs from a given hashtag URL using Selenium to scroll and load more videos.
 
@@ -43,34 +115,47 @@ def fetch_video_urls(url: str, existing_urls: list, shared_video_urls, lock, sto
     ----------
     url : str
         The hashtag URL to scrape videos from.
-    existing_urls : list
-        List of existing video URLs to check against to avoid duplicates.
+    existing_urls : list | VideoIdIndex
+        List of existing video URLs, or the index of their video IDs, to check
+        against to avoid duplicates. If None, new URLs are checked against the
+        storage backend instead.
     shared_video_urls : multiprocessing.Manager().list
         A shared list to store the fetched video URLs.
     lock : multiprocessing.Manager().Lock
         A lock to synchronize access to the shared list.
     stop_signal : multiprocessing.Manager().Value
         A signal to indicate when to stop the scraping process.
+    driver : selenium.webdriver.Chrome, optional
+        A driver borrowed from a DriverPool. It navigates to the hashtag and is
+        left open, by default None (a new driver is started and quit)
+    discovered : VideoIdIndex, optional
+        Index of the video IDs already appended by any worker, replacing the
+        linear scan of shared_video_urls, by default None
     """
-    chrome_options.add_argument(f"--user-agent={ua.random}")
-    driver = webdriver.Chrome(options=chrome_options)
+    owns_driver = driver is None
+    if owns_driver:
+        driver = create_driver()
     driver.get(url)
-    video_urls = set(existing_urls)
+    known_index = existing_urls if isinstance(existing_urls, VideoIdIndex) else None
+    video_urls = set() if known_index is not None else set(existing_urls or [])
+    storage = get_storage()
+    limiter = get_rate_limiter()
+    hashtag = url.rstrip('/').split('/')[-1]
     attempt = 0
     
     while len(shared_video_urls) < ScraperConfig.URL_SCRAP_COUNT:
         if stop_signal.value:
             break
+        # scroll rounds of every driver share the 'scroll' bucket
+        if limiter is not None:
+            limiter.acquire('scroll')
         # Scroll to load more videos
         for _ in range(4):
             driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.END)
             time.sleep(0.5)  
             
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        videos = soup.find_all('div', {'class': ScraperConfig.VIDEO_TAG}) 
-        
         # video URLs scraped
-        video_urls_collected = set([video.find('a', href=True)['href'] for video in videos])
+        video_urls_collected = collect_video_links(driver)
         
         # remove already existing video URLs
         new_videos = video_urls_collected.difference(video_urls)
@@ -78,20 +163,79 @@ def fetch_video_urls(url: str, existing_urls: list, shared_video_urls, lock, sto
         # add new URLs to already existing URLS
         video_urls |= new_videos
         new_videos = [i for i in new_videos if url_verificaiton(i)]
+        if known_index is not None:
+            new_videos = [i for i in new_videos if video_id(i) not in known_index]
+        elif existing_urls is None:
+            new_videos = storage.filter_new(new_videos)
         
         # make sure that anohter process didn't append the same URL 
         with lock:
-            for video_id in new_videos:
-                if video_id not in shared_video_urls:
-                    shared_video_urls.append(video_id)
+            for video_url in new_videos:
+                if discovered is not None:
+                    is_new = discovered.add(video_id(video_url))
+                else:
+                    is_new = video_url not in shared_video_urls
+                if is_new:
+                    shared_video_urls.append(video_url)
+                    URLS_DISCOVERED.inc(hashtag)
                     
             # save the URLs to database
-            utils.write('data/fetched_urls.json', list(shared_video_urls))
-        time.sleep(2)
+            storage.write(URLS_PATH, list(shared_video_urls))
+        if limiter is None:
+            time.sleep(2)
         attempt += 1
-    driver.quit()
+    if owns_driver:
+        driver.quit()
+
+class NotifyingList(list):
+    """List of discovered URLs that hands every appended URL to a callback"""
+
+    def __init__(self, on_url, urls:list=()) -> None:
+        super().__init__(urls)
+        self.on_url = on_url
+
+    def append(self, url:str):
+        super().append(url)
+        self.on_url(url)
+
+def fetch_with_pool(url: str, existing_urls: list, shared_video_urls, lock, stop_signal, driver_pool, discovered=None):
+    """Runs fetch_video_urls on a driver borrowed from the pool"""
+    with driver_pool.driver() as driver:
+        fetch_video_urls(url, existing_urls, shared_video_urls, lock, stop_signal, driver, discovered)
+
+def scrap_threaded(hashtag_urls, existing_urls:list, driver_pool, on_url=None, resume_urls:list=()):
+    """
+    Scrapes video URLs on threads using drivers of a persistent pool.
+    On timeout the threads are signalled to stop after their current scroll,
+    so no Chrome process is killed mid-command.
+
+    Parameters
+    ----------
+    hashtag_urls : list of str
+        List of hashtag URLs to scrape videos from.
+    existing_urls : list of str | VideoIdIndex
+        List of existing video URLs, or the index of their video IDs, to check
+        against to avoid duplicates, or None to check against the storage backend.
+    driver_pool : DriverPool
+        The pool the drivers are borrowed from.
+    on_url : callable, optional
+        Called with every new URL as soon as it is discovered, by default None
+    resume_urls : list, optional
+        URLs discovered before an interruption, counted towards
+        ScraperConfig.URL_SCRAP_COUNT, by default ()
+    """
+    shared_video_urls = NotifyingList(on_url, resume_urls) if on_url else list(resume_urls)
+    lock = threading.Lock()
+    stop_signal = SimpleNamespace(value=False)
+    discovered = new_discovered_index(resume_urls)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=driver_pool.size)
+    futures = [executor.submit(profiled, fetch_with_pool, url, existing_urls, shared_video_urls, lock, stop_signal, driver_pool, discovered) 
+               for url in hashtag_urls]
+    concurrent.futures.wait(futures, timeout=ScraperConfig.URL_SCRAPER_TIMEOUT)
+    stop_signal.value = True
+    executor.shutdown(wait=True, cancel_futures=True)
 
-def scrap_parallel(hashtag_urls, existing_urls:list, stop_signal):
+def scrap_parallel(hashtag_urls, existing_urls:list, stop_signal, resume_urls:list=()):
     """
     Scrapes video URLs in parallel using multiple processes.
 
@@ -99,10 +243,14 @@ def scrap_parallel(hashtag_urls, existing_urls:list, stop_signal):
     ----------
     hashtag_urls : list of str
         List of hashtag URLs to scrape videos from.
-    existing_urls : list of str
-        List of existing video URLs to check against to avoid duplicates.
+    existing_urls : list of str | VideoIdIndex
+        List of existing video URLs, or the index of their video IDs, to check
+        against to avoid duplicates, or None to check against the storage backend.
     stop_signal : multiprocessing.Manager().Value
         A signal to indicate when to stop the scraping process.
+    resume_urls : list, optional
+        URLs discovered before an interruption, counted towards
+        ScraperConfig.URL_SCRAP_COUNT, by default ()
 
     Returns
     -------
@@ -110,27 +258,45 @@ def scrap_parallel(hashtag_urls, existing_urls:list, stop_signal):
         A list of video URLs scraped from the provided hashtag URLs, excluding duplicates.
     """
     manager = multiprocessing.Manager()
-    shared_video_urls = manager.list()
+    shared_video_urls = manager.list(resume_urls)
     lock = manager.Lock()
+    discovered = new_discovered_index(resume_urls)
     cpu_count = min(ScraperConfig.CPU_COUNT, len(ScraperConfig.HASHTAGS))
     with concurrent.futures.ProcessPoolExecutor(max_workers=cpu_count) as executor:
-        futures = [executor.submit(fetch_video_urls, url, existing_urls, shared_video_urls, lock, stop_signal) for url in hashtag_urls]
+        futures = [executor.submit(profiled, fetch_video_urls, url, existing_urls, shared_video_urls, lock, stop_signal, None, discovered) 
+                   for url in hashtag_urls]
 
         for future in concurrent.futures.as_completed(futures):
             future.result()  
 
-def url_scraper(existing_urls: list):
+def url_scraper(existing_urls: list=None, driver_pool=None, on_url=None, resume_urls:list=None):
     """
     Initiates the URL scraping process for the given list of existing URLs.
 
     Parameters
     ----------
-    existing_urls : list
-        List of existing video URLs to check against to avoid duplicates.
+    existing_urls : list | VideoIdIndex, optional
+        List of existing video URLs, or the index of their video IDs, to check
+        against to avoid duplicates, by default None (checked against the storage backend)
+    driver_pool : DriverPool, optional
+        If given, drivers are reused from the pool instead of starting
+        a new Chrome per hashtag, by default None
+    on_url : callable, optional
+        Called with every new URL as soon as it is discovered. Requires
+        driver_pool, by default None
+    resume_urls : list, optional
+        URLs discovered before an interruption. Discovery continues from them
+        and they stay in the saved URLs, by default None
     """
     hashtag_urls = [ScraperConfig.URL + hashtag for hashtag in ScraperConfig.HASHTAGS]
+    resume_urls = list(resume_urls or [])
+    if len(resume_urls) >= ScraperConfig.URL_SCRAP_COUNT:
+        return
+    if driver_pool is not None:
+        scrap_threaded(hashtag_urls, existing_urls, driver_pool, on_url, resume_urls)
+        return
     stop_signal = multiprocessing.Manager().Value('b', False)
-    process = multiprocessing.Process(target=scrap_parallel, args=(hashtag_urls, existing_urls, stop_signal))
+    process = multiprocessing.Process(target=scrap_parallel, args=(hashtag_urls, existing_urls, stop_signal, resume_urls))
     process.start()
     process.join(timeout=ScraperConfig.URL_SCRAPER_TIMEOUT)
     if process.is_alive():
@@ -142,7 +308,7 @@ if __name__ == '__main__':
     existing_urls = utils.read('urls.json')[:10]
     url_scraper(existing_urls)
     try:
-        urls = utils.read('data/fetched_urls.json')
+        urls = get_storage().read(URLS_PATH)
         print(len(urls))
     except Exception as e:
         print(e)
@@ -0,0 +1,76 @@
+"""User agents of the requests and the Chrome drivers
+
+The pool is a JSON list at ScraperConfig.USER_AGENT_POOL_PATH. The first run
+draws it from the fake_useragent data and saves it, later runs and their
+worker processes only read that file.
+"""
+
+import functools
+import json
+import os
+import random
+import threading
+
+import utils
+from config import ScraperConfig
+
+# loaded on first use, shared by the threads of a process
+_pool = None
+_lock = threading.Lock()
+
+
+def draw(size:int) -> list:
+    """
+    Draws distinct user agents from the fake_useragent data.
+
+    Parameters
+    ----------
+    size : int
+        Number of picks, the maximum number of user agents.
+
+    Returns
+    -------
+    list
+    """
+    from fake_useragent import UserAgent
+
+    ua = UserAgent()
+    # every pick filters the whole browser data, duplicates are dropped
+    return list(dict.fromkeys(ua.random for _ in range(size)))
+
+def pool() -> list:
+    """User agents of the pool, drawn and saved if the pool file is missing"""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = _load()
+    return _pool
+
+def _load() -> list:
+    """Reads the pool file, or draws the pool and saves it"""
+    path = ScraperConfig.USER_AGENT_POOL_PATH
+    if os.path.exists(path):
+        return utils.read(path)
+    agents = draw(ScraperConfig.USER_AGENT_POOL_SIZE)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # worker processes may draw the pool at the same time, each writes its own temporary file
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(agents, file)
+    os.replace(temp_path, path)
+    return agents
+
+def random_user_agent() -> str:
+    """A user agent picked from the pool, e.g. for a new Chrome driver"""
+    return random.choice(pool())
+
+@functools.lru_cache(maxsize=None)
+def user_agent() -> str:
+    """The user agent of the requests of this process, picked once"""
+    return random_user_agent()
+
+def headers() -> dict:
+    """Headers of every request: the user agent of the process and ScraperConfig.HEADERS"""
+    return {'User-Agent': user_agent()} | ScraperConfig.HEADERS
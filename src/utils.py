@@ -1,28 +1,54 @@
 
 import json
+import os
+import random
 import time
 from datetime import datetime
 
-import pytz
-from langdetect import DetectorFactory, detect
-from langdetect.lang_detect_exception import LangDetectException
+from journal import journal_path, replay
 
 
+def backoff_delay(attempt:int, base:float=1, cap:float=60, jitter:bool=True) -> float:
+    """
+    Delay of an exponential backoff with a maximum delay.
+
+    Parameters
+    ----------
+    attempt : int
+        The current attempt number to calculate the backoff delay.
+    base : float, optional
+        The delay of attempt 0 in seconds, by default 1
+    cap : float, optional
+        The maximum delay in seconds, by default 60
+    jitter : bool, optional
+        If True, the delay is drawn uniformly from its upper half, so clients
+        failing together do not retry together, by default True
+
+    Returns
+    -------
+    float
+        The delay in seconds.
+    """
+    delay = min(base * 2 ** attempt, cap)
+    if jitter:
+        delay = random.uniform(delay / 2, delay)
+    return delay
+
 def exponential_backoff(attempt:int):
     """
-    Applies exponential backoff strategy with a maximum delay.
+    Applies exponential backoff strategy with a maximum delay of 60 seconds.
 
     Parameters
     ----------
     attempt : int
         The current attempt number to calculate the backoff delay.
     """
-    delay = min(2 ** attempt, 60)  # Exponential backoff with a maximum delay of 60 seconds
-    time.sleep(delay)
+    time.sleep(backoff_delay(attempt, jitter=False))
     
 def is_english(comment:str):
     """
-    Detects if a given comment is in English.
+    Detects if a given comment is in English. Results are cached, use
+    language.LanguageTagger to tag comments in batches.
 
     Parameters
     ----------
@@ -34,14 +60,17 @@ def is_english(comment:str):
     bool
         True if the comment is in English, False otherwise.
     """
-    try:
-        return detect(comment) == 'en'
-    except LangDetectException:
-        return False
+    # langdetect is only imported by the callers that tag languages
+    from language import language_of
+
+    return language_of(comment) == 'en'
     
 def write(filename:str, file:dict):
     """
     Writes a dictionary to a JSON file.
+    The file is written to a temporary file that replaces it, so a crash
+    leaves either the old or the new file on disk, never a truncated one.
+    Any pending journal of the file is discarded since the file is replaced.
 
     Parameters
     ----------
@@ -50,12 +79,19 @@ def write(filename:str, file:dict):
     file : dict
         The dictionary to be written to the file.
     """
-    with open(filename, 'w') as json_file:
+    temp_path = filename + '.tmp'
+    with open(temp_path, 'w') as json_file:
         json.dump(file, json_file, indent=4)
+        json_file.flush()
+        os.fsync(json_file.fileno())
+    os.replace(temp_path, filename)
+    if os.path.exists(journal_path(filename)):
+        os.remove(journal_path(filename))
         
 def read(filename:str) -> dict:
     """
     Reads a dictionary from a JSON file.
+    Results appended to the journal of the file are replayed on top.
 
     Parameters
     ----------
@@ -69,7 +105,7 @@ def read(filename:str) -> dict:
     """
     with open(filename, 'r') as file:
             result = json.load(file)
-    return result
+    return replay(filename, result)
     
 def record_now():
     """
@@ -80,6 +116,8 @@ def record_now():
     str
         The current time formatted as 'dd_mm_HHhMMm'.
     """
+    import pytz
+
     pst = pytz.timezone('America/Los_Angeles')
     now_pst = datetime.now(pst)
     formatted_time = now_pst.strftime('%d_%m_%Hh%Mm')
@@ -0,0 +1,398 @@
+"""Leased work queue of the distributed mode, in a shared SQLite file or served over TCP
+
+Tasks are leased for ScraperConfig.LEASE_TIMEOUT seconds. A worker extends
+its lease while it works; a lease that runs out is handed to the next worker
+that asks, and every lease gets a new token so that the report of a worker
+that lost its lease is rejected. Nodes sharing a file system use the SQLite
+file directly, other nodes talk to the coordinator over TCP (JSON lines), every request
+carrying the shared secret of ScraperConfig.COORDINATOR_TOKEN:
+    {"method": "lease", "kwargs": {"worker": "node-1"}, "token": "..."}  ->  {"result": {...}}
+"""
+
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+
+from config import ScraperConfig
+from storage import _Transaction
+
+# methods of WorkQueue that are served over TCP
+REMOTE_METHODS = ('lease', 'extend', 'complete', 'fail', 'counts')
+
+
+class WorkQueue:
+    """
+    Tasks of the distributed mode in an SQLite file in WAL mode. A task has a
+    kind ('discover' or 'fetch'), an optional shard and a JSON payload, and
+    goes from pending to leased to done. Tasks whose leases ran out
+    ScraperConfig.TASK_MAX_ATTEMPTS times are failed. Done and failed tasks
+    are ingested by the coordinator.
+
+    Parameters
+    ----------
+    path : str, optional
+        The SQLite file, by default ScraperConfig.QUEUE_PATH
+    """
+
+    def __init__(self, path:str=None) -> None:
+        self.path = path or ScraperConfig.QUEUE_PATH
+        self._local = threading.local()
+        with self.transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                               'id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, shard INTEGER, '
+                               'payload TEXT NOT NULL, state TEXT NOT NULL, worker TEXT, '
+                               'token INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, '
+                               'lease_until REAL, result TEXT, ingested INTEGER NOT NULL DEFAULT 0, '
+                               'updated_at REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, kind, shard)')
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current process and thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def transaction(self):
+        """Context manager running the enclosed statements in a single write transaction"""
+        return _Transaction(self._connection())
+
+    def add(self, kind:str, payloads:list, shard:int=None) -> list:
+        """
+        Queues tasks.
+
+        Parameters
+        ----------
+        kind : str
+            'discover' or 'fetch'
+        payloads : list
+            JSON serializable payload of every task.
+        shard : int, optional
+            Shard of the tasks, by default None
+
+        Returns
+        -------
+        list
+            IDs of the tasks.
+        """
+        with self.transaction() as connection:
+            return [self.insert(connection, kind, payload, shard) for payload in payloads]
+
+    def insert(self, connection:sqlite3.Connection, kind:str, payload, shard:int=None) -> int:
+        """Queues a task within a write transaction of the caller, returns its ID"""
+        return connection.execute('INSERT INTO tasks (kind, shard, payload, state, updated_at) '
+                                  "VALUES (?, ?, ?, 'pending', ?)",
+                                  (kind, shard, json.dumps(payload), time.time())).lastrowid
+
+    def _expire(self, connection:sqlite3.Connection, now:float):
+        """Hands out the tasks whose leases ran out again, or fails them"""
+        connection.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                           "worker = NULL, updated_at = ? WHERE state = 'leased' AND lease_until < ?",
+                           (ScraperConfig.TASK_MAX_ATTEMPTS, now, now))
+
+    def lease(self, worker:str, kinds:list=None, shards:list=None, timeout:float=None) -> dict:
+        """
+        Leases the oldest pending task.
+
+        Parameters
+        ----------
+        worker : str
+            Name of the worker node.
+        kinds : list, optional
+            Kinds of tasks the worker takes, by default all
+        shards : list, optional
+            Shards the worker takes, tasks without a shard are always taken,
+            by default all
+        timeout : float, optional
+            Seconds until the lease runs out, by default ScraperConfig.LEASE_TIMEOUT
+
+        Returns
+        -------
+        dict
+            id, kind, shard, payload and token of the task, None if no task is pending.
+        """
+        now = time.time()
+        query = "SELECT id, kind, shard, payload, token FROM tasks WHERE state = 'pending'"
+        parameters = []
+        if kinds:
+            query += f' AND kind IN ({",".join("?" * len(kinds))})'
+            parameters += kinds
+        if shards:
+            query += f' AND (shard IS NULL OR shard IN ({",".join("?" * len(shards))}))'
+            parameters += shards
+        with self.transaction() as connection:
+            self._expire(connection, now)
+            row = connection.execute(query + ' ORDER BY id LIMIT 1', parameters).fetchone()
+            if row is None:
+                return None
+            task_id, kind, shard, payload, token = row
+            connection.execute("UPDATE tasks SET state = 'leased', worker = ?, token = ?, attempts = attempts + 1, "
+                               'lease_until = ?, updated_at = ? WHERE id = ?',
+                               (worker, token + 1, now + (timeout or ScraperConfig.LEASE_TIMEOUT), now, task_id))
+        return {'id': task_id, 'kind': kind, 'shard': shard, 'payload': json.loads(payload), 'token': token + 1}
+
+    def extend(self, task_id:int, token:int, timeout:float=None) -> bool:
+        """
+        Extends a lease.
+
+        Returns
+        -------
+        bool
+            False if the lease was lost to another worker.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            cursor = connection.execute("UPDATE tasks SET state = 'leased', lease_until = ?, updated_at = ? "
+                                        "WHERE id = ? AND token = ? AND state IN ('leased', 'pending')",
+                                        (now + (timeout or ScraperConfig.LEASE_TIMEOUT), now, task_id, token))
+        return bool(cursor.rowcount)
+
+    def complete(self, task_id:int, token:int, result) -> bool:
+        """
+        Reports the result of a task. A late report is accepted as long as the
+        task was not leased again.
+
+        Returns
+        -------
+        bool
+            False if the lease was lost to another worker and the result dropped.
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute("UPDATE tasks SET state = 'done', result = ?, updated_at = ? "
+                                        "WHERE id = ? AND token = ? AND state IN ('leased', 'pending')",
+                                        (json.dumps(result), time.time(), task_id, token))
+        return bool(cursor.rowcount)
+
+    def fail(self, task_id:int, token:int, error:str='') -> bool:
+        """
+        Gives a leased task back, it is handed out again unless it ran out of attempts.
+
+        Returns
+        -------
+        bool
+            False if the lease was lost to another worker.
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                                        "worker = NULL, result = ?, updated_at = ? "
+                                        "WHERE id = ? AND token = ? AND state = 'leased'",
+                                        (ScraperConfig.TASK_MAX_ATTEMPTS, json.dumps({'error': error}),
+                                         time.time(), task_id, token))
+        return bool(cursor.rowcount)
+
+    def finished(self, limit:int=100) -> list:
+        """
+        Done and failed tasks that are not ingested yet, leases that ran out are expired first.
+
+        Returns
+        -------
+        list
+            dicts of id, kind, shard, state, payload and result.
+        """
+        with self.transaction() as connection:
+            self._expire(connection, time.time())
+        rows = self._connection().execute("SELECT id, kind, shard, state, payload, result FROM tasks "
+                                          "WHERE state IN ('done', 'failed') AND ingested = 0 ORDER BY id LIMIT ?",
+                                          (limit,)).fetchall()
+        return [{'id': task_id, 'kind': kind, 'shard': shard, 'state': state, 'payload': json.loads(payload),
+                 'result': json.loads(result) if result else None}
+                for task_id, kind, shard, state, payload, result in rows]
+
+    def mark_ingested(self, task_ids:list):
+        with self.transaction() as connection:
+            connection.executemany('UPDATE tasks SET ingested = 1 WHERE id = ?', [(task_id,) for task_id in task_ids])
+
+    def cancel(self):
+        """Fails every pending task, e.g. once enough data is collected"""
+        with self.transaction() as connection:
+            connection.execute("UPDATE tasks SET state = 'failed', ingested = 1, updated_at = ? WHERE state = 'pending'",
+                               (time.time(),))
+
+    def counts(self) -> dict:
+        """keys: task kinds | values: number of tasks per state"""
+        counts = {}
+        for kind, state, count in self._connection().execute('SELECT kind, state, COUNT(*) FROM tasks GROUP BY kind, state'):
+            counts.setdefault(kind, {})[state] = count
+        return counts
+
+    def close(self):
+        """Closes the connection of the current thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local = threading.local()
+
+
+def is_loopback(host:str) -> bool:
+    """True if host is localhost or a loopback address"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not self.server.authorized(request.get('token')):
+                    # a client without the secret gets no second try on the connection
+                    self.wfile.write((json.dumps({'error': 'PermissionError: invalid token'}) + '\n').encode())
+                    return
+                if request['method'] not in REMOTE_METHODS:
+                    raise ValueError(f'unknown method {request["method"]}')
+                response = {'result': getattr(self.server.queue, request['method'])(**request.get('kwargs', {}))}
+            except Exception as e:
+                response = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+            self.wfile.flush()
+
+
+class QueueServer(socketserver.ThreadingTCPServer):
+    """
+    Serves a WorkQueue to worker nodes over TCP, one JSON request per line.
+    Requests without the token are rejected. Serving beyond localhost
+    requires a token, as whoever can lease tasks can also report results.
+
+    Parameters
+    ----------
+    queue : WorkQueue
+    port : int, optional
+        by default ScraperConfig.COORDINATOR_PORT
+    host : str, optional
+        by default ScraperConfig.COORDINATOR_HOST
+    token : str, optional
+        Shared secret of the workers, by default ScraperConfig.COORDINATOR_TOKEN
+
+    Raises
+    ------
+    ValueError
+        If host is not a loopback address and no token is set.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, queue:WorkQueue, port:int=None, host:str=None, token:str=None) -> None:
+        host = host or ScraperConfig.COORDINATOR_HOST
+        self.token = token or ScraperConfig.COORDINATOR_TOKEN
+        if not self.token and not is_loopback(host):
+            raise ValueError(f'serving the queue on {host} requires a token, set SCRAPER_COORDINATOR_TOKEN')
+        super().__init__((host, ScraperConfig.COORDINATOR_PORT if port is None else port), _Handler)
+        self.queue = queue
+
+    def authorized(self, token:str) -> bool:
+        """True if no token is set or the token is the shared secret"""
+        if not self.token:
+            return True
+        return isinstance(token, str) and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def start(self) -> 'QueueServer':
+        """Serves on a daemon thread"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class QueueClient:
+    """
+    The WorkQueue methods of the workers, called on a coordinator over TCP.
+    The connection is opened on first use and reopened after errors.
+
+    Parameters
+    ----------
+    address : str
+        host:port of the coordinator, by default ScraperConfig.COORDINATOR_ADDRESS
+    token : str, optional
+        Shared secret of the coordinator, by default ScraperConfig.COORDINATOR_TOKEN
+    """
+
+    def __init__(self, address:str=None, token:str=None) -> None:
+        host, port = (address or ScraperConfig.COORDINATOR_ADDRESS).rsplit(':', 1)
+        self.address = (host, int(port))
+        self.token = token or ScraperConfig.COORDINATOR_TOKEN
+        self._socket = None
+        self._file = None
+        # the heartbeat thread of a worker shares the connection
+        self._lock = threading.Lock()
+
+    def _call(self, method:str, **kwargs):
+        with self._lock:
+            try:
+                if self._socket is None:
+                    self._socket = socket.create_connection(self.address, timeout=30)
+                    self._file = self._socket.makefile('rwb')
+                self._file.write((json.dumps({'method': method, 'kwargs': kwargs, 'token': self.token}) + '\n').encode())
+                self._file.flush()
+                line = self._file.readline()
+                if not line:
+                    raise ConnectionError('coordinator closed the connection')
+            except OSError:
+                self.close()
+                raise
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def lease(self, worker:str, kinds:list=None, shards:list=None, timeout:float=None) -> dict:
+        return self._call('lease', worker=worker, kinds=kinds, shards=shards, timeout=timeout)
+
+    def extend(self, task_id:int, token:int, timeout:float=None) -> bool:
+        return self._call('extend', task_id=task_id, token=token, timeout=timeout)
+
+    def complete(self, task_id:int, token:int, result) -> bool:
+        return self._call('complete', task_id=task_id, token=token, result=result)
+
+    def fail(self, task_id:int, token:int, error:str='') -> bool:
+        return self._call('fail', task_id=task_id, token=token, error=error)
+
+    def counts(self) -> dict:
+        return self._call('counts')
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._file.close()
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._file = None
+
+
+def get_queue():
+    """
+    Returns the work queue of a worker node: the coordinator at
+    ScraperConfig.COORDINATOR_ADDRESS if it is set, the shared SQLite file otherwise.
+
+    Returns
+    -------
+    QueueClient | WorkQueue
+    """
+    if ScraperConfig.COORDINATOR_ADDRESS:
+        return QueueClient()
+    return WorkQueue()
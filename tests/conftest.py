@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# the modules of src/ import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs a test in an empty directory, the data/ paths of the storage are relative"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
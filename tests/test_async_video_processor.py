@@ -0,0 +1,49 @@
+import pytest
+
+import async_video_processor
+import storage
+from async_video_processor import AsyncProcessMetaData
+from config import ScraperConfig
+from storage import METADATA_PATH, get_storage
+
+URLS = [f'https://www.tiktok.com/@user/video/{7375775673576705312 + i}' for i in range(6)]
+
+
+@pytest.fixture
+def processor(workdir, monkeypatch):
+    monkeypatch.setattr(storage, '_storage', None)
+    monkeypatch.setattr(ScraperConfig, 'RETRY_MAX_ATTEMPTS', 1)
+    monkeypatch.setattr(ScraperConfig, 'RESUME', False)
+
+    async def get(self, session, url):
+        return 200, url.encode()
+
+    def extract_video_info(page):
+        # the first video page holds "itemStruct": null
+        if page.decode() == URLS[0]:
+            raise TypeError("'NoneType' object is not subscriptable")
+        return {'Views': 1}
+
+    monkeypatch.setattr(AsyncProcessMetaData, '_get', get)
+    monkeypatch.setattr(async_video_processor, 'extract_video_info', extract_video_info)
+    get_storage().initialize()
+    return AsyncProcessMetaData(URLS)
+
+
+def test_a_page_that_fails_to_parse_only_fails_its_url(processor):
+    processor.get_metadata()
+    assert set(get_storage().read(METADATA_PATH)) == set(URLS[1:])
+    assert list(processor.retries.dropped) == [URLS[0]]
+    assert processor.retries.dropped[URLS[0]].startswith('parse: TypeError')
+
+
+def test_an_error_of_on_result_only_fails_its_url(processor):
+    def on_result(url, data):
+        if url == URLS[1]:
+            raise OSError('disk full')
+
+    processor.on_result = on_result
+    processor.get_metadata()
+    # the result was stored before on_result failed
+    assert set(get_storage().read(METADATA_PATH)) == set(URLS[1:])
+    assert set(processor.retries.dropped) == {URLS[0], URLS[1]}
@@ -0,0 +1,30 @@
+import sqlite3
+
+import comment_store
+from comment_store import CommentStore
+from storage import COMMENTS_PATH, SQLiteStorage
+
+URL = 'https://www.tiktok.com/@user/video/7375775673576705312'
+OTHER_URL = 'https://www.tiktok.com/@user/video/7375775673576705313'
+
+
+def test_strings_with_the_same_digest_keep_their_text(workdir, monkeypatch):
+    monkeypatch.setattr(comment_store, '_digest', lambda text: 42)
+    storage = SQLiteStorage('data/database.sqlite', comment_store=True)
+    storage.write(COMMENTS_PATH, {URL: ['first', 'second', 'first']})
+    storage.append(COMMENTS_PATH, {OTHER_URL: ['third', 'second']})
+    assert storage.read(COMMENTS_PATH) == {URL: ['first', 'second', 'first'], OTHER_URL: ['third', 'second']}
+    storage.close()
+
+
+def test_strings_keyed_by_digest_are_migrated(workdir):
+    connection = sqlite3.connect('comments.sqlite', isolation_level=None)
+    connection.execute('CREATE TABLE comment_strings (digest INTEGER PRIMARY KEY, id INTEGER NOT NULL)')
+    connection.execute('CREATE TABLE comment_pending (id INTEGER PRIMARY KEY, text TEXT NOT NULL)')
+    connection.execute('INSERT INTO comment_strings VALUES (?, 0)', (comment_store._digest('first'),))
+    connection.execute("INSERT INTO comment_pending VALUES (0, 'first')")
+    store = CommentStore()
+    CommentStore.create_tables(connection)
+    assert store._intern(connection, ['second', 'first']) == [1, 0]
+    assert connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'comment_strings'").fetchone() == (0,)
+    connection.close()
@@ -0,0 +1,30 @@
+import glob
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.dataset
+
+import storage
+from config import ScraperConfig
+from exporter import export
+from storage import get_storage
+
+URL = 'https://www.tiktok.com/@user/video/7375775673576705312'
+OTHER_URL = 'https://www.tiktok.com/@user/video/7375775673576705313'
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_exports_within_a_second_keep_every_record(workdir, monkeypatch, format):
+    monkeypatch.setattr(storage, '_storage', None)
+    monkeypatch.setattr(ScraperConfig, 'STORAGE_BACKEND', 'json')
+    monkeypatch.setattr('time.strftime', lambda pattern: '20240601120000')
+    get_storage().initialize()
+    get_storage().update_database({URL: {'Views': 1, 'Comments': ['first']}})
+    assert export(format, 'exports') == (1, 1)
+    get_storage().update_database({OTHER_URL: {'Views': 2, 'Comments': []}})
+    assert export(format, 'exports') == (1, 0)
+
+    assert len(glob.glob(f'exports/{format}/records/part-*')) == 2
+    dataset = pyarrow.dataset.dataset(f'exports/{format}/records', format='ipc' if format == 'arrow' else format)
+    assert sorted(dataset.to_table().column('URL').to_pylist()) == [URL, OTHER_URL]
@@ -0,0 +1,42 @@
+import threading
+import time
+
+import pipeline
+from config import ScraperConfig
+from pipeline import StreamingPipeline
+
+URLS = [f'https://www.tiktok.com/@user/video/{7375775673576705312 + i}' for i in range(6)]
+
+
+def test_records_are_emitted_off_the_loop(monkeypatch):
+    monkeypatch.setattr(ScraperConfig, 'PIPELINE_FLUSH_SIZE', 1)
+
+    def url_scraper(existing_urls, driver_pool=None, on_url=None):
+        for url in URLS:
+            on_url(url)
+
+    monkeypatch.setattr(pipeline, 'url_scraper', url_scraper)
+    fetch_threads = set()
+    emitted = []
+
+    def emit(records):
+        # a slow store must not hold up the fetchers
+        time.sleep(0.05)
+        emitted.append((threading.get_ident(), records))
+
+    streaming = StreamingPipeline([], None, emit)
+
+    async def fetch_metadata(session, url):
+        fetch_threads.add(threading.get_ident())
+        return {'Views': 1}
+
+    async def fetch_comments(session, url):
+        return ['comment']
+
+    monkeypatch.setattr(streaming.metadata_fetcher, '_fetch_data', fetch_metadata)
+    monkeypatch.setattr(streaming.comments_fetcher, '_fetch_data', fetch_comments)
+    merged = streaming.run()
+
+    assert set(merged) == set(URLS)
+    assert {url for _, records in emitted for url in records} == set(URLS)
+    assert not fetch_threads & {thread for thread, _ in emitted}
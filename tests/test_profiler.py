@@ -0,0 +1,34 @@
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+import profiler
+from profiler import profile_stage, profiled
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 12), reason='the stage profile sees every thread')
+def test_worker_threads_of_a_stage_are_profiled(workdir):
+    directory = profiler.start('profiles/run')
+    try:
+        with profile_stage('stage'):
+            thread = threading.Thread(target=profiled, args=(busy, 10000))
+            thread.start()
+            thread.join()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(profiled, [busy] * 4, [1000] * 4))
+    finally:
+        profiler.stop()
+    timings = [json.load(open(path)) for path in glob.glob(os.path.join(directory, 'stage.busy-*.json'))]
+    assert timings and all(timing['thread'] for timing in timings)
+    assert sum(timing['calls'] for timing in timings) == 5
+    summary = profiler.report(directory)
+    assert 'stage.busy' in summary and 'busy' in summary.split('-----stage.busy-----')[1]
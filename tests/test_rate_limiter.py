@@ -0,0 +1,47 @@
+import sys
+import threading
+
+import pytest
+
+from rate_limiter import BUCKET, RateLimiter
+
+THREADS = 16
+CALLS = 2000
+
+
+def tokens(limiter:RateLimiter, endpoint:str) -> float:
+    with open(limiter.path, 'rb') as file:
+        data = file.read()
+    offset = limiter.endpoints.index(endpoint) * BUCKET.size
+    return BUCKET.unpack(data[offset:offset + BUCKET.size])[0]
+
+
+def test_threads_of_a_process_share_the_budget(workdir):
+    # frequent thread switches interleave the read-modify-write of the buckets
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    # a refill too slow to matter, every reserve has to take one token
+    limiter = RateLimiter('data/rate_limits.bin', {'video': (1e-9, 10)})
+    barrier = threading.Barrier(THREADS)
+
+    def reserve():
+        barrier.wait()
+        for _ in range(CALLS):
+            limiter.reserve('video')
+
+    threads = [threading.Thread(target=reserve) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert tokens(limiter, 'video') == pytest.approx(10 - THREADS * CALLS, abs=1e-3)
+
+
+def test_reserve_waits_once_the_burst_is_spent(workdir):
+    limiter = RateLimiter('data/rate_limits.bin', {'video': (10, 2)})
+    assert limiter.reserve('video') == 0
+    assert limiter.reserve('video') == 0
+    assert limiter.reserve('video') == pytest.approx(0.1, abs=0.01)
@@ -0,0 +1,32 @@
+import extractor
+import storage
+from config import ScraperConfig
+from response_cache import ResponseCache, reparse_fetched
+from storage import COMMENTS_PATH, METADATA_PATH, get_storage
+
+URLS = [f'https://www.tiktok.com/@user/video/{7375775673576705312 + i}' for i in range(3)]
+
+
+def test_reparse_skips_broken_pages_and_stored_videos(workdir, monkeypatch):
+    monkeypatch.setattr(storage, '_storage', None)
+    monkeypatch.setattr(ScraperConfig, 'STORAGE_BACKEND', 'json')
+
+    def extract_video_info(page):
+        # a page that failed to parse is kept in the cache, expired
+        if page == b'null item':
+            raise TypeError("'NoneType' object is not subscriptable")
+        return {'Views': int(page)}
+
+    monkeypatch.setattr(extractor, 'extract_video_info', extract_video_info)
+    cache = ResponseCache('data/http_cache')
+    cache.put(URLS[0], b'null item')
+    cache.put(URLS[1], b'1')
+    cache.put(URLS[2], b'2')
+    get_storage().initialize()
+    get_storage().update_database({URLS[1]: {'Views': 1, 'Comments': []}})
+
+    metadata, comments = reparse_fetched(get_storage(), cache)
+    assert metadata == {URLS[2]: {'Views': 2}}
+    assert get_storage().read(METADATA_PATH) == metadata
+    assert get_storage().read(COMMENTS_PATH) == {}
+    cache.close()
@@ -0,0 +1,65 @@
+import pytest
+
+import utils
+from config import ScraperConfig
+from storage import (COMMENTS_PATH, DATABASE_PATH, JsonStorage, SQLiteStorage,
+                     import_json)
+
+URL = 'https://www.tiktok.com/@user/video/7375775673576705312'
+OTHER_URL = 'https://www.tiktok.com/@user/video/7375775673576705313'
+
+
+def test_import_json_joins_the_comment_store(workdir, monkeypatch):
+    monkeypatch.setattr(ScraperConfig, 'COMMENT_STORE', True)
+    records = {URL: {'Views': 10, 'Comments': ['first', 'second']}}
+    json_storage = JsonStorage()
+    json_storage.initialize()
+    json_storage.update_database(records)
+    json_storage.write(COMMENTS_PATH, {OTHER_URL: ['third']})
+    json_storage.close()
+    # database.json holds the records without their comments
+    assert 'Comments' not in utils.read(DATABASE_PATH)[URL]
+
+    storage = SQLiteStorage('data/database.sqlite')
+    import_json(storage)
+    assert storage.read(DATABASE_PATH) == records
+    assert storage.read(COMMENTS_PATH) == {OTHER_URL: ['third']}
+    storage.close()
+
+
+def test_import_json_without_comment_store(workdir, monkeypatch):
+    monkeypatch.setattr(ScraperConfig, 'COMMENT_STORE', False)
+    records = {URL: {'Views': 10, 'Comments': ['first']}}
+    json_storage = JsonStorage()
+    json_storage.initialize()
+    json_storage.update_database(records)
+
+    storage = SQLiteStorage('data/database.sqlite')
+    import_json(storage)
+    assert storage.read(DATABASE_PATH) == records
+    storage.close()
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def storage(request, workdir, monkeypatch):
+    monkeypatch.setattr(ScraperConfig, 'COMMENT_STORE', True)
+    storage = JsonStorage() if request.param == 'json' else SQLiteStorage('data/database.sqlite')
+    storage.initialize()
+    yield storage
+    storage.close()
+
+
+def test_read_fields_leaves_out_the_comments(storage):
+    storage.update_database({URL: {'Views': 10, 'Date posted': '06/01/2024', 'Comments': ['first']},
+                             OTHER_URL: {'Views': 0}})
+    assert storage.read_fields(('Views', 'Date posted', 'Comments', 'Likes')) == {
+        URL: {'Views': 10, 'Date posted': '06/01/2024'}, OTHER_URL: {'Views': 0}}
+
+
+def test_read_snapshots_keeps_the_latest(storage):
+    for collected_at in (1, 2, 3):
+        storage.append_snapshots({URL: {'Views': collected_at, 'Collected At': collected_at},
+                                  OTHER_URL: {'Views': 0, 'Collected At': collected_at + 0.5}})
+    assert storage.read_snapshots(2) == {URL: [{'Views': 2, 'Collected At': 2}, {'Views': 3, 'Collected At': 3}],
+                                         OTHER_URL: [{'Views': 0, 'Collected At': 2.5}, {'Views': 0, 'Collected At': 3.5}]}
+    assert len(storage.read_snapshots()[URL]) == 3
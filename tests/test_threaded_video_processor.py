@@ -0,0 +1,22 @@
+import pytest
+
+import threaded_video_processor
+from threaded_video_processor import ThreadedProcessMetaData
+
+
+class Controller:
+    parse_failures = 0
+
+    def record_parse_failure(self):
+        self.parse_failures += 1
+
+
+def test_parse_errors_are_raised_and_recorded(monkeypatch):
+    def extract_video_info(page):
+        raise TypeError("'NoneType' object is not subscriptable")
+
+    monkeypatch.setattr(threaded_video_processor, 'extract_video_info', extract_video_info)
+    controller = Controller()
+    with pytest.raises(TypeError):
+        ThreadedProcessMetaData([], controller)._parse(b'<html></html>')
+    assert controller.parse_failures == 1
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from work_queue import QueueClient, QueueServer, WorkQueue
+
+
+@pytest.fixture
+def queue(workdir):
+    queue = WorkQueue('data/queue.sqlite')
+    yield queue
+    queue.close()
+
+
+def serve(queue, token=None):
+    return QueueServer(queue, port=0, host='127.0.0.1', token=token).start()
+
+
+def test_expired_lease_is_handed_to_another_worker(queue):
+    [task_id] = queue.add('fetch', [{'urls': []}])
+    first = queue.lease('node-1', timeout=0.05)
+    assert queue.lease('node-2') is None
+    time.sleep(0.1)
+    second = queue.lease('node-2')
+    assert second['id'] == task_id and second['token'] == first['token'] + 1
+    # the report of the worker that lost its lease is rejected
+    assert not queue.extend(task_id, first['token'])
+    assert not queue.complete(task_id, first['token'], {'records': {}})
+    assert queue.complete(task_id, second['token'], {'records': {}})
+    assert [task['state'] for task in queue.finished()] == ['done']
+
+
+def test_client_leases_and_completes_over_tcp(queue):
+    queue.add('discover', [{'hashtag': 'fyp'}])
+    server = serve(queue, token='secret')
+    client = QueueClient(f'127.0.0.1:{server.server_address[1]}', token='secret')
+    try:
+        task = client.lease('node-1', kinds=['discover'])
+        assert task['payload'] == {'hashtag': 'fyp'}
+        assert client.extend(task['id'], task['token'])
+        assert client.complete(task['id'], task['token'], {'urls': []})
+        assert client.counts() == {'discover': {'done': 1}}
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_server_rejects_a_wrong_token(queue):
+    queue.add('discover', [{'hashtag': 'fyp'}])
+    server = serve(queue, token='secret')
+    address = f'127.0.0.1:{server.server_address[1]}'
+    clients = [QueueClient(address, token='wrong'), QueueClient(address, token=None)]
+    try:
+        for client in clients:
+            with pytest.raises(RuntimeError, match='invalid token'):
+                client.lease('node-1')
+        assert queue.counts() == {'discover': {'pending': 1}}
+    finally:
+        for client in clients:
+            client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_serving_beyond_localhost_requires_a_token(queue, monkeypatch):
+    monkeypatch.setattr('config.ScraperConfig.COORDINATOR_TOKEN', None)
+    with pytest.raises(ValueError):
+        QueueServer(queue, port=0, host='0.0.0.0')